@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+# Times the archiver's queries against synthetic archives of increasing
+# size, to see how storage choices scale. Results are JSON.
+#
+#   python -m bench.archive --posts 10000 --posts 100000 > archive.json
+
+import argparse
+from collections.abc import Callable
+import dataclasses
+import itertools
+import json
+import pathlib
+import statistics
+import sys
+import tempfile
+import time
+
+import transparentclassroom.archiver as archiver
+from .archivegen import generate_archive
+from .micro import git_commit
+
+
+DEFAULT_SIZES = [10000, 100000]
+
+# Posts a refresh from the API would bring back, and the fraction of those
+# that changed since they were stored.
+REFRESH_POSTS = 1000
+REFRESH_EDIT_FRACTION = 0.1
+
+# Width of the window read by `posts_in_date_range`, in posts, like a sync
+# over a couple of weeks.
+RANGE_POSTS = 120
+
+
+def timed(f: Callable[[], object], repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        timings.append(time.perf_counter() - start)
+    return {'best': min(timings), 'median': statistics.median(timings)}
+
+
+def drain(it) -> int:
+    n = 0
+    for _ in it:
+        n += 1
+    return n
+
+
+def bench_archive(path: pathlib.Path, repeat: int) -> dict:
+    db = archiver.db_init(path)
+
+    newest = list(itertools.islice(archiver.all_posts(db), REFRESH_POSTS))
+    until = newest[0].date
+    since = newest[min(RANGE_POSTS, len(newest)) - 1].date
+
+    # what the next run would see: mostly the same posts, a few edited
+    refresh = []
+    for i, p in enumerate(newest):
+        if i % round(1 / REFRESH_EDIT_FRACTION) == 0:
+            p = dataclasses.replace(p, html=p.html + ' <p>(edited)</p>')
+        refresh.append(p)
+
+    def upsert():
+        archiver.store_posts(db, refresh, now='9999-01-01T00:00:00.000+00:00')
+        db.rollback()
+
+    results = {
+        'newest_post_created_at': timed(
+            lambda: archiver.newest_post_created_at(db), repeat),
+        'all_posts': timed(lambda: drain(archiver.all_posts(db)), repeat),
+        'posts_in_date_range': timed(
+            lambda: drain(archiver.posts_in_date_range(db, since, until)),
+            repeat),
+        'store_posts': timed(upsert, repeat),
+        'classification_report': timed(
+            lambda: archiver.classification_report(db), repeat),
+    }
+
+    rows = db.execute('SELECT COUNT(*) AS n FROM Posts').fetchone()['n']
+    db.close()
+
+    return {
+        'rows': rows,
+        'bytes': path.stat().st_size,
+        'range': [since, until],
+        'refresh_posts': len(refresh),
+        'seconds': results,
+    }
+
+
+def main(args):
+    sizes = args.posts or DEFAULT_SIZES
+
+    if args.keep:
+        args.keep.mkdir(parents=True, exist_ok=True)
+
+    runs = []
+    with tempfile.TemporaryDirectory() as scratch:
+        for size in sizes:
+            path = pathlib.Path(args.keep or scratch, f'posts-{size}.sqlite')
+            if path.exists() and args.keep:
+                generate_seconds = None
+            else:
+                start = time.perf_counter()
+                generate_archive(path, size, args.seed)
+                generate_seconds = time.perf_counter() - start
+
+            run = {'posts': size, 'generate_seconds': generate_seconds} | \
+                bench_archive(path, args.repeat)
+            runs.append(run)
+
+            print(f'{size} posts: ' + ', '.join(
+                f'{name} {t["best"]:.3f}s'
+                for name, t in run['seconds'].items()), file=sys.stderr)
+
+    report = {
+        'commit': git_commit(),
+        'seed': args.seed,
+        'runs': runs,
+    }
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + '\n')
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--posts', type=int, action='append',
+                        help='archive size to test; repeat for several '
+                             f'(default {DEFAULT_SIZES})')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--keep', type=pathlib.Path,
+                        help='keep generated archives in this directory and '
+                             'reuse them next time')
+    parser.add_argument('--output', type=pathlib.Path)
+    main(parser.parse_args())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+# Writes a synthetic `posts.sqlite` in the archiver's format, for seeing how
+# archive queries scale past what one family accumulates.
+#
+#   python -m bench.archivegen --posts 100000 /tmp/posts.sqlite
+
+import argparse
+from datetime import datetime, timedelta
+import json
+import pathlib
+import random
+import sqlite3
+
+import transparentclassroom.archiver as archiver
+from urlfunctions import trim_url
+from . import fixtures
+
+
+# Rows written per transaction.
+BATCH_SIZE = 10000
+
+PHOTO_FIELDS = ['photo_url', 'medium_photo_url', 'large_photo_url',
+                'original_photo_url']
+
+
+# The row `retrieve_school_posts` would store for `post`.
+def post_json(post: dict) -> str:
+    post = dict(post)
+    for f in PHOTO_FIELDS:
+        if f in post:
+            post[f] = trim_url(post[f])
+    return json.dumps(post, sort_keys=True)
+
+
+def iso(t: datetime) -> str:
+    return t.isoformat(timespec='milliseconds')
+
+
+# Rows for every version of `post`. The archiver ran daily: each post was
+# first seen shortly after it was created and last seen on the final run,
+# `last_run`. Edited posts were first stored as they were before the edit.
+def post_rows(rng: random.Random, post: dict, last_run: datetime,
+              edit_fraction: float) -> list[tuple[str, str, str]]:
+    created_at = datetime.fromisoformat(post['created_at'])
+    first_seen = created_at + timedelta(hours=rng.uniform(1, 24))
+
+    rows = []
+    if rng.random() < edit_fraction:
+        edited_at = first_seen + timedelta(days=rng.randint(1, 3))
+        original = post | {'html': post['html'] + ' <p>(draft)</p>'}
+        rows.append((post_json(original), iso(first_seen), iso(edited_at)))
+        first_seen = edited_at + timedelta(hours=1)
+
+    rows.append((post_json(post), iso(first_seen), iso(last_run)))
+    return rows
+
+
+def generate_archive(path: pathlib.Path, post_count: int, seed: int = 1,
+                     edit_fraction: float = 0.05,
+                     class_post_fraction: float = 0.1) -> int:
+    path.unlink(missing_ok=True)
+    db = archiver.db_init(path)
+    rng = random.Random(seed)
+
+    posts = fixtures.iter_tc_posts(seed, post_count,
+                                   class_post_fraction=class_post_fraction)
+    last_run = None
+
+    rows = []
+    row_count = 0
+    for post in posts:
+        if last_run is None:
+            last_run = datetime.fromisoformat(post['created_at']) + \
+                timedelta(hours=6)
+        rows += post_rows(rng, post, last_run, edit_fraction)
+
+        if len(rows) >= BATCH_SIZE:
+            insert_rows(db, rows)
+            row_count += len(rows)
+            rows = []
+
+    insert_rows(db, rows)
+    row_count += len(rows)
+
+    db.execute('ANALYZE')
+    db.commit()
+    db.close()
+
+    return row_count
+
+
+def insert_rows(db: sqlite3.Connection, rows: list[tuple[str, str, str]]):
+    db.executemany("""
+        INSERT INTO Posts (post_json, first_seen, last_seen)
+        VALUES (?, ?, ?)
+        """, rows)
+    db.commit()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--posts', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--edit-fraction', type=float, default=0.05,
+                        help='fraction of posts stored in two versions')
+    parser.add_argument('--class-post-fraction', type=float, default=0.1)
+    parser.add_argument('path', type=pathlib.Path)
+    args = parser.parse_args()
+
+    rows = generate_archive(args.path, args.posts, args.seed,
+                            args.edit_fraction, args.class_post_fraction)
+    print(f'{args.posts} posts, {rows} rows, '
+          f'{args.path.stat().st_size} bytes')
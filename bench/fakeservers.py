@@ -0,0 +1,502 @@
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import date, datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+
+from . import fixtures
+
+
+# Local stand-ins for Transparent Classroom, Tinybeans and the AWS services
+# behind Tinybeans uploads, good enough to run sync against. Each serves
+# deterministic data from `fixtures` and can be slowed down or made flaky.
+
+SCHOOL_ID = fixtures.SCHOOL_ID
+
+# suffix -> (content type, first bytes, last bytes), so photos look like the
+# real thing to anything checking their format
+PHOTO_FORMATS = {
+    'jpg': ('image/jpeg', b'\xff\xd8\xff', b'\xff\xd9'),
+    'jpeg': ('image/jpeg', b'\xff\xd8\xff', b'\xff\xd9'),
+    'png': ('image/png', b'\x89PNG\r\n\x1a\n',
+            b'\x00\x00\x00\x00IEND\xaeB`\x82'),
+}
+TC_USER_ID = 4242
+TB_JOURNAL_ID = 9000
+TB_JOURNAL_TITLE = 'Bench Family'
+
+# matches `POSTS_PER_FULL_PAGE` in the TC client
+POSTS_PER_PAGE = 30
+
+SEARCH_TOKEN_REGEX = re.compile(r'[\w.]+')
+
+
+@dataclass
+class Faults:
+    # added to every response
+    latency: float = 0
+
+    # fraction of requests answered with a 500, or with a 429 and
+    # `Retry-After`
+    error_rate: float = 0
+    throttle_rate: float = 0
+
+
+@dataclass
+class Stats:
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    # route -> number of requests
+    requests: Counter = field(default_factory=Counter)
+    errors_injected: int = 0
+    throttles_injected: int = 0
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {
+                'requests': sum(self.requests.values()),
+                'by_route': dict(sorted(self.requests.items())),
+                'errors_injected': self.errors_injected,
+                'throttles_injected': self.throttles_injected,
+            }
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    faults: Faults
+    stats: Stats
+    fault_rng: random.Random
+
+    def __init__(self, handler: type[BaseHTTPRequestHandler], faults: Faults,
+                 seed: int):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.faults = faults
+        self.stats = Stats()
+        self.fault_rng = random.Random(seed)
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'FakeServer':
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    server: FakeServer
+    protocol_version = 'HTTP/1.1'
+
+    # Headers and body go out in separate writes; without this, delayed ACKs
+    # add tens of milliseconds to every response on a kept-alive connection.
+    disable_nagle_algorithm = True
+
+    # (method, regex) -> handler method name, matched against the path
+    routes: list[tuple[str, re.Pattern, str]] = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, o, status: int = 200):
+        self.send_bytes(json.dumps(o).encode(), 'application/json', status)
+
+    def send_bytes(self, body: bytes, content_type: str, status: int = 200,
+                   headers: dict[str, str] = {}):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def dispatch(self, method: str):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+
+        for route_method, regex, name in self.routes:
+            m = regex.fullmatch(url.path)
+            if route_method == method and m:
+                break
+        else:
+            self.read_body()
+            self.send_json({'error': 'not found'}, 404)
+            return
+
+        server = self.server
+        with server.stats.lock:
+            server.stats.requests[name] += 1
+            roll = server.fault_rng.random()
+
+        time.sleep(server.faults.latency)
+
+        if roll < server.faults.throttle_rate:
+            with server.stats.lock:
+                server.stats.throttles_injected += 1
+            self.read_body()
+            self.send_bytes(b'slow down', 'text/plain', 429,
+                            {'Retry-After': '1'})
+            return
+        if roll < server.faults.throttle_rate + server.faults.error_rate:
+            with server.stats.lock:
+                server.stats.errors_injected += 1
+            self.read_body()
+            self.send_bytes(b'oops', 'text/plain', 500)
+            return
+
+        getattr(self, name)(query, *m.groups())
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+
+def route(method: str, pattern: str, name: str) -> tuple[str, re.Pattern, str]:
+    return (method, re.compile(pattern), name)
+
+
+# Transparent Classroom: the API, the profile page `my_children` scrapes,
+# and the photos posts link to.
+class TransparentClassroomHandler(FakeHandler):
+    routes = [
+        route('GET', r'/api/v1/authenticate\.json', 'authenticate'),
+        route('GET', rf'/s/{SCHOOL_ID}/users/(\d+)', 'profile'),
+        route('GET', rf'/s/{SCHOOL_ID}/classrooms/(\d+)/children\.json',
+              'children'),
+        route('GET', rf'/s/{SCHOOL_ID}/posts\.json', 'posts'),
+        route('GET', rf'/s/{SCHOOL_ID}/children/(\d+)/posts\.json',
+              'child_posts'),
+        route('GET', r'/photos/(\d+)/(\w+)\.(\w+)', 'photo'),
+    ]
+
+    server: 'TransparentClassroomServer'
+
+    def authenticate(self, query):
+        self.send_json({
+            'id': TC_USER_ID,
+            'school_id': SCHOOL_ID,
+            'first_name': 'Pat',
+            'last_name': 'Parent',
+            'email': 'pat@example.com',
+            'api_token': 'tc-token',
+        })
+
+    def profile(self, query, user_id):
+        links = [f'<a href="/s/{SCHOOL_ID}/children/{c}">child</a>'
+                 for c, _ in self.server.family]
+        links += [f'<a href="/s/{SCHOOL_ID}/users?classroom_id={c}">class</a>'
+                  for c in fixtures.CLASSROOM_IDS]
+        self.send_bytes(f'<html><body>{"".join(links)}</body></html>'.encode(),
+                        'text/html')
+
+    def children(self, query, classroom_id):
+        self.send_json([{
+            'id': child_id,
+            'current_classroom_ids': [int(classroom_id)],
+            'parent_ids': [TC_USER_ID],
+            'first_name': name.split(' ')[0],
+            'last_name': name.split(' ')[1],
+            'birth_date': '2019-09-01',
+            'gender': 'F',
+            'program': 'Primary',
+            'profile_photo': f'{self.server.base_url}/photos/0/child.jpg',
+        } for child_id, name in self.server.children_in(int(classroom_id))])
+
+    # Lookups by `ids[]` come a page at a time like the feeds, so a client
+    # that asks for more than a page of IDs at once misses some.
+    def send_page(self, query, posts: list[dict]):
+        if 'ids[]' in query:
+            ids = set(int(i) for i in query['ids[]'])
+            posts = [p for p in posts if p['id'] in ids]
+
+        page = int(query.get('page', ['1'])[0])
+        start = (page - 1) * POSTS_PER_PAGE
+        self.send_json(posts[start:start + POSTS_PER_PAGE])
+
+    def posts(self, query):
+        self.send_page(query, self.server.posts)
+
+    def child_posts(self, query, child_id):
+        self.send_page(query, self.server.posts_by_child.get(int(child_id), []))
+
+    # Unique bytes for every URL, so the upload cache can't match one photo
+    # to another by content. Honors the one-byte ranges `photo_size` asks
+    # for.
+    def photo(self, query, post_id, variant, suffix):
+        size = self.server.photo_bytes[variant] if variant in \
+            self.server.photo_bytes else 1024
+        content_type, start, end = PHOTO_FORMATS[suffix]
+        header = start + f'{post_id}/{variant}'.encode()
+        body = header + bytes(size - len(header) - len(end)) + end
+
+        if self.headers.get('Range') == 'bytes=0-0':
+            self.send_bytes(body[:1], content_type, 206,
+                            {'Content-Range': f'bytes 0-0/{len(body)}'})
+        else:
+            self.send_bytes(body, content_type)
+
+
+class TransparentClassroomServer(FakeServer):
+    children: list[tuple[int, str]]
+    family: list[tuple[int, str]]
+    posts: list[dict]
+    posts_by_child: dict[int, list[dict]]
+    photo_bytes: dict[str, int]
+
+    def __init__(self, faults: Faults, seed: int, post_count: int,
+                 photo_bytes: int):
+        super().__init__(TransparentClassroomHandler, faults, seed)
+
+        rng = random.Random(seed)
+        self.children = fixtures.roster(rng)
+        self.family = self.children[:2]
+        self.posts = fixtures.tc_posts(seed, post_count,
+                                       children=self.children,
+                                       family=self.family,
+                                       photo_host=f'{self.base_url}')
+
+        self.posts_by_child = {}
+        for p in self.posts:
+            for child_id, _ in self.children:
+                if f'/children/{child_id}"' in p['html']:
+                    self.posts_by_child.setdefault(child_id, []).append(p)
+
+        self.photo_bytes = {
+            'original': photo_bytes,
+            'large': photo_bytes // 4,
+            'medium': photo_bytes // 16,
+            'thumb': photo_bytes // 64,
+        }
+
+    # Children are split between the two classrooms; the family's are in
+    # the first.
+    def children_in(self, classroom_id: int) -> list[tuple[int, str]]:
+        first = classroom_id == fixtures.CLASSROOM_IDS[0]
+        return [c for i, c in enumerate(self.children)
+                if (c in self.family or i % 2 == 0) == first]
+
+    def posts_dated(self, since: date, until: date) -> list[dict]:
+        return [p for p in self.posts
+                if since.isoformat() <= p['date'] <= until.isoformat()]
+
+
+# Tinybeans: enough of the API to list, search, pin and create entries.
+class TinybeansHandler(FakeHandler):
+    routes = [
+        route('POST', r'/api/1/authenticate', 'authenticate'),
+        route('GET', r'/api/1/journals', 'journals'),
+        route('GET', r'/api/1/journals/(\d+)', 'journal'),
+        route('GET', r'/api/1/journals/(\d+)/entries', 'entries'),
+        route('POST', r'/api/1/journals/(\d+)/entries', 'create_entry'),
+        route('POST', r'/api/1/journals/(\d+)/entries/(\d+)', 'update_entry'),
+        route('GET', r'/api/1/journals/(\d+)/search', 'search'),
+    ]
+
+    server: 'TinybeansServer'
+
+    def authenticate(self, query):
+        self.read_body()
+        self.send_json({
+            'status': 'ok',
+            'user': self.server.user | {
+                'username': 'pat@example.com',
+                'emailAddress': 'pat@example.com',
+            },
+            'accessToken': str(uuid.UUID(int=1)),
+        })
+
+    def journals(self, query):
+        self.send_json({'status': 'ok', 'journals': [self.server.journal]})
+
+    def journal(self, query, journal_id):
+        self.send_json({'status': 'ok', 'journal': self.server.journal})
+
+    def entries(self, query, journal_id):
+        year, month = int(query['year'][0]), int(query['month'][0])
+        day = int(query['day'][0]) if 'day' in query else None
+        with self.server.lock:
+            entries = [e for e in self.server.entries
+                       if (e['year'], e['month']) == (year, month) and
+                       (day is None or e['day'] == day)]
+        entries.sort(key=lambda e: (e['year'], e['month'], e['day'],
+                                    -e['timestamp']))
+        self.send_json({'status': 'ok', 'entries': entries})
+
+    def search(self, query, journal_id):
+        term = query['term'][0]
+        page = int(query.get('page', ['1'])[0])
+        length = int(query.get('length', ['10'])[0])
+        with self.server.lock:
+            matches = [e for e in self.server.entries
+                       if term in SEARCH_TOKEN_REGEX.findall(e['caption'])]
+        self.send_json({
+            'status': 'ok',
+            'count': len(matches),
+            'entries': matches[(page - 1) * length:page * length],
+        })
+
+    def create_entry(self, query, journal_id):
+        o = json.loads(self.read_body())
+
+        remote_file_name = o.get('remoteFileName')
+        if remote_file_name is not None and \
+                remote_file_name not in self.server.uploads:
+            self.send_json({'status': 'error',
+                            'message': 'unknown remoteFileName'}, 400)
+            return
+
+        day = datetime(o['year'], o['month'], o['day'])
+        with self.server.lock:
+            self.server.next_entry_id += 1
+            entry = fixtures.tb_entry(
+                self.server.rng, TB_JOURNAL_ID, self.server.next_entry_id,
+                int(time.time() * 1000), day, 0,
+                o.get('children', []))
+            entry['caption'] = o['caption']
+            self.server.entries.append(entry)
+            self.server.created += 1
+        self.send_json({'status': 'ok', 'entry': entry})
+
+    def update_entry(self, query, journal_id, entry_id):
+        o = json.loads(self.read_body())
+        with self.server.lock:
+            for e in self.server.entries:
+                if e['id'] == int(entry_id):
+                    e['pinnedTimestamp'] = o['pinnedTimestamp']
+                    self.server.pinned += 1
+        self.send_json({'status': 'ok'})
+
+
+class TinybeansServer(FakeServer):
+    lock: threading.Lock
+    rng: random.Random
+    user: dict
+    journal: dict
+    entries: list[dict]
+    next_entry_id: int
+
+    # names of objects uploaded to the fake bucket, filled in by
+    # `AwsServer`
+    uploads: set[str]
+
+    created: int
+    pinned: int
+
+    def __init__(self, faults: Faults, seed: int,
+                 family: list[tuple[int, str]], days: list[date],
+                 existing_per_day: int):
+        super().__init__(TinybeansHandler, faults, seed)
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+        self.uploads = set()
+        self.created = 0
+        self.pinned = 0
+
+        self.user = fixtures.tb_user(self.rng, 77)
+        self.journal = {
+            'id': TB_JOURNAL_ID,
+            'timestamp': 1500000000000,
+            'title': TB_JOURNAL_TITLE,
+            'user': self.user,
+            'children': [{
+                'id': 3001 + i,
+                'timestamp': 1500000000000,
+                'lastUpdatedTimestamp': 1500000000000,
+                'firstName': name.split(' ')[0],
+                'lastName': name.split(' ')[1],
+                'fullName': name,
+                'gender': 'F',
+                'dob': '2019-09-01',
+                'user': self.user,
+            } for i, (_, name) in enumerate(family)],
+        }
+
+        # Families post their own photos too, which sync has to pin around.
+        self.entries = []
+        self.next_entry_id = 800000
+        for d in days:
+            noon = datetime(d.year, d.month, d.day, 12, tzinfo=timezone.utc)
+            for i in range(existing_per_day):
+                self.next_entry_id += 1
+                self.entries.append(fixtures.tb_entry(
+                    self.rng, TB_JOURNAL_ID, self.next_entry_id,
+                    int(noon.timestamp() * 1000) - i * 60000, noon, 0, []))
+
+
+# Cognito identity, which hands out credentials, and the S3 bucket uploads go
+# to. boto3 is pointed here with `AWS_ENDPOINT_URL_*`; requests aren't
+# authenticated.
+class AwsHandler(FakeHandler):
+    routes = [
+        route('POST', r'/', 'cognito'),
+        route('PUT', r'/([^/]+)/(.+)', 's3_put_object'),
+    ]
+
+    server: 'AwsServer'
+
+    def cognito(self, query):
+        self.read_body()
+        target = self.headers.get('X-Amz-Target', '')
+        identity_id = f'us-east-1:{uuid.UUID(int=2)}'
+        match target.rpartition('.')[2]:
+            case 'GetId':
+                o = {'IdentityId': identity_id}
+            case 'GetCredentialsForIdentity':
+                o = {
+                    'IdentityId': identity_id,
+                    'Credentials': {
+                        'AccessKeyId': 'ASIAFAKE',
+                        'SecretKey': 'fake',
+                        'SessionToken': 'fake',
+                        'Expiration': time.time() + 3600,
+                    },
+                }
+            case _:
+                self.send_json({'__type': 'UnknownOperationException'}, 400)
+                return
+        self.send_bytes(json.dumps(o).encode(), 'application/x-amz-json-1.1')
+
+    def s3_put_object(self, query, bucket, key):
+        # boto3 may send the body in aws-chunked encoding; either way we
+        # only need to consume it
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                self.rfile.read(size + 2)
+                if size == 0:
+                    break
+        else:
+            self.read_body()
+
+        self.server.tinybeans.uploads.add(urllib.parse.unquote(key))
+        self.send_bytes(b'', 'application/xml',
+                        headers={'ETag': f'"{uuid.uuid4().hex}"'})
+
+
+class AwsServer(FakeServer):
+    tinybeans: TinybeansServer
+
+    def __init__(self, faults: Faults, seed: int, tinybeans: TinybeansServer):
+        super().__init__(AwsHandler, faults, seed)
+        self.tinybeans = tinybeans
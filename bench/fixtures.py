@@ -0,0 +1,251 @@
+from collections.abc import Iterator
+from datetime import datetime, timedelta, timezone
+import random
+import re
+import uuid
+
+
+# Deterministic stand-ins for what the services return. Everything is built
+# from a seeded `random.Random`, so the same seed gives byte-identical
+# fixtures on every machine and benchmark runs stay comparable across commits.
+
+
+FIRST_NAMES = [
+    'Ada', 'Beatrix', 'Cyrus', 'Delia', 'Emeka', 'Farah', 'Gideon', 'Hana',
+    'Ines', 'Jonah', 'Kaia', 'Leopold', 'Mira', 'Nico', 'Oona', 'Pablo',
+    'Quinn', 'Rosa', 'Soren', 'Tova', 'Umar', 'Vera', 'Wren', 'Xavi',
+    'Yara', 'Zeke',
+]
+
+LAST_NAMES = [
+    'Abara', 'Bergstrom', 'Castellanos', 'Dubois', 'Eriksen', 'Fujita',
+    'Galloway', 'Haddad', 'Ivanova', 'Jablonski', 'Kowalczyk', 'Lindqvist',
+    'Moreau', 'Nakamura', 'Okafor', 'Petrov',
+]
+
+AUTHORS = ['Ms. Alvarez', 'Mr. Brennan', 'Ms. Chen', 'Mrs. Dlamini']
+
+SENTENCES = [
+    'worked with the pink tower today.',
+    'spent a long time at the sandpaper letters.',
+    'helped set the table for snack.',
+    'was very proud of this map of South America.',
+    'practiced pouring water between two pitchers.',
+    'counted the golden beads all the way to one thousand.',
+    'read a story to a younger friend.',
+    'planted beans in the garden bed.',
+]
+
+SCHOOL_ID = 1000
+CLASSROOM_IDS = [1141, 1142]
+
+PHOTO_HOST = 'https://transparent-classroom.s3.amazonaws.com'
+TINYBEANS_CDN = 'https://cdn.tinybeans.com'
+
+TAG_REGEX = re.compile(r'<[^>]*>')
+
+
+# (id, full name) for a class, sorted by name the way TC expands an
+# all-class tag.
+def roster(rng: random.Random, size: int = 24) -> list[tuple[int, str]]:
+    names = set()
+    while len(names) < size:
+        names.add(f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}')
+    return [(2000 + i, name) for i, name in enumerate(sorted(names))]
+
+
+def child_link(child_id: int, name: str) -> str:
+    return (f'<a class="child-link" '
+            f'href="/s/{SCHOOL_ID}/children/{child_id}">{name}</a>')
+
+
+# HTML for one post. Class posts tag every child in one sorted,
+# space-separated run, sometimes with a name dropped and its space left
+# behind. Other posts tag a couple of children among some text, starting
+# with one of `family` if given.
+def post_html(rng: random.Random, children: list[tuple[int, str]],
+              class_post: bool,
+              family: list[tuple[int, str]] | None = None) -> str:
+    if class_post:
+        tagged = list(children)
+        if rng.random() < 0.3:
+            del tagged[rng.randrange(len(tagged))]
+            links = ' '.join(child_link(*c) for c in tagged[:5]) + '  ' + \
+                ' '.join(child_link(*c) for c in tagged[5:])
+        else:
+            links = ' '.join(child_link(*c) for c in tagged)
+        return f'{links} <p>{rng.choice(SENTENCES).capitalize()}</p>'
+
+    tagged = rng.sample(children, rng.randint(1, 3))
+    if family:
+        tagged = [rng.choice(family)] + [c for c in tagged[1:]
+                                         if c not in family]
+
+    parts = []
+    for child in tagged:
+        parts.append(f'{child_link(*child)} {rng.choice(SENTENCES)}')
+    if rng.random() < 0.5:
+        parts.append(f'<p><b>Note:</b> {rng.choice(SENTENCES)}</p>')
+    return ' '.join(parts)
+
+
+# close enough for `normalized_text`, which nothing here reads
+def text_from_post_html(html: str) -> str:
+    return TAG_REGEX.sub('', html)
+
+
+# A presigned S3 URL like the ones in `posts.json`. The signature changes
+# with `rng`, as it does between listings.
+def signed_url(rng: random.Random, path: str,
+               host: str = PHOTO_HOST) -> str:
+    signed_at = datetime(2024, 1, 1, tzinfo=timezone.utc) + \
+        timedelta(seconds=rng.randrange(365 * 86400))
+    return (f'{host}/{path}'
+            f'?response-content-disposition=inline'
+            f'&X-Amz-Algorithm=AWS4-HMAC-SHA256'
+            f'&X-Amz-Credential=AKIAEXAMPLE%2F{signed_at:%Y%m%d}'
+            f'%2Fus-east-1%2Fs3%2Faws4_request'
+            f'&X-Amz-Date={signed_at:%Y%m%dT%H%M%SZ}'
+            f'&X-Amz-Expires=604800'
+            f'&X-Amz-SignedHeaders=host'
+            f'&X-Amz-Signature={rng.getrandbits(256):064x}')
+
+
+# One post as it appears in `posts.json`.
+def tc_post(rng: random.Random, children: list[tuple[int, str]],
+            post_id: int, created_at: datetime,
+            class_post_fraction: float = 0.1,
+            photo_fraction: float = 0.8,
+            family: list[tuple[int, str]] | None = None,
+            photo_host: str = PHOTO_HOST) -> dict:
+    html = post_html(rng, children, rng.random() < class_post_fraction,
+                     family)
+    post = {
+        'id': post_id,
+        'created_at': created_at.isoformat(timespec='milliseconds'),
+        'classroom_id': rng.choice(CLASSROOM_IDS),
+        'author': rng.choice(AUTHORS),
+        'date': created_at.date().isoformat(),
+        'html': html,
+        'normalized_text': text_from_post_html(html),
+    }
+    if rng.random() < photo_fraction:
+        suffix = rng.choice(['jpg', 'jpg', 'jpeg', 'png'])
+        for key, variant in [('photo_url', 'thumb'),
+                             ('medium_photo_url', 'medium'),
+                             ('large_photo_url', 'large'),
+                             ('original_photo_url', 'original')]:
+            post[key] = signed_url(
+                rng, f'photos/{post_id}/{variant}.{suffix}', photo_host)
+    return post
+
+
+# `count` posts, newest first, spread over school days ending at `newest`.
+# Children come from `children` or else a roster made up from `seed`.
+def iter_tc_posts(seed: int, count: int,
+                  newest: datetime = datetime(
+                      2024, 6, 14, 15, 0,
+                      tzinfo=timezone(timedelta(hours=-5))),
+                  posts_per_day: int = 12, roster_size: int = 24,
+                  class_post_fraction: float = 0.1,
+                  photo_fraction: float = 0.8,
+                  children: list[tuple[int, str]] | None = None,
+                  family: list[tuple[int, str]] | None = None,
+                  photo_host: str = PHOTO_HOST) -> Iterator[dict]:
+    rng = random.Random(seed)
+    if children is None:
+        children = roster(rng, roster_size)
+
+    created_at = newest
+    for i in range(count):
+        if i > 0 and i % posts_per_day == 0:
+            created_at = created_at.replace(hour=15) - timedelta(days=1)
+            while created_at.weekday() >= 5:
+                created_at -= timedelta(days=1)
+        created_at -= timedelta(minutes=rng.randint(1, 20),
+                                milliseconds=rng.randint(0, 999))
+        yield tc_post(rng, children, 500000 + count - i, created_at,
+                      class_post_fraction, photo_fraction, family,
+                      photo_host)
+
+
+def tc_posts(seed: int, count: int, **kwargs) -> list[dict]:
+    return list(iter_tc_posts(seed, count, **kwargs))
+
+
+def tb_user(rng: random.Random, user_id: int) -> dict:
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    return {
+        'id': user_id,
+        'timestamp': 1600000000000,
+        'lastUpdatedTimestamp': 1600000000000,
+        'fullName': f'{first} {last}',
+        'firstName': first,
+        'lastName': last,
+        'hasMemoriesAccess': True,
+    }
+
+
+def tb_blobs(rng: random.Random, entry_id: int) -> dict:
+    key = f'{rng.getrandbits(64):016x}'
+    return {size: f'{TINYBEANS_CDN}/{entry_id}/{key}_{size}.jpg'
+            for size in ['o', 'o2', 't', 's', 's2', 'm', 'l', 'p']}
+
+
+# One entry as listed by `journals/nnn/entries`.
+def tb_entry(rng: random.Random, journal_id: int, entry_id: int,
+             timestamp: int, day: datetime, comments: int,
+             child_ids: list[int]) -> dict:
+    entry = {
+        'id': entry_id,
+        'journalId': journal_id,
+        'userId': 77,
+        'URL': f'https://tinybeans.com/app/#/main/entries/{entry_id}',
+        'timestamp': timestamp,
+        'lastUpdatedTimestamp': timestamp + rng.randint(0, 10**6),
+        'year': day.year,
+        'month': day.month,
+        'day': day.day,
+        'caption': rng.choice(SENTENCES).capitalize(),
+        'privateMode': False,
+        'uuid': str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+        'type': 'PHOTO',
+        'blobs': tb_blobs(rng, entry_id),
+        'totalCommentsCount': comments,
+        'comments': [{
+            'id': entry_id * 100 + i,
+            'entryId': entry_id,
+            'URL': f'https://tinybeans.com/app/#/main/entries/{entry_id}',
+            'timestamp': timestamp + i,
+            'lastUpdatedTimestamp': timestamp + i,
+            'user': tb_user(rng, 78 + i),
+            'details': rng.choice(SENTENCES).capitalize(),
+            'repliesCount': 0,
+        } for i in range(comments)],
+    }
+    if child_ids:
+        entry['children'] = [{'childId': c} for c in child_ids]
+    return entry
+
+
+# A month of `journals/nnn/entries`, about `per_day` entries a day, in the
+# order the server returns them: newest first within each day.
+def tb_entries_page(seed: int, year: int, month: int, per_day: int = 4,
+                    comments_per_entry: int = 2,
+                    journal_id: int = 9000) -> dict:
+    rng = random.Random(seed)
+
+    entries = []
+    day = datetime(year, month, 1, 12, tzinfo=timezone.utc)
+    entry_id = 700000
+    while day.month == month:
+        base = int(day.timestamp() * 1000)
+        for i in range(per_day):
+            entry_id += 1
+            entries.append(tb_entry(
+                rng, journal_id, entry_id, base - i * 60000, day,
+                rng.randint(0, comments_per_entry * 2),
+                rng.sample([3001, 3002], rng.randint(0, 2))))
+        day += timedelta(days=1)
+
+    return {'status': 'ok', 'entries': entries}
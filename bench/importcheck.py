@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+# Fails if the quick commands start importing the heavy dependencies that
+# `kidstuff.py` loads lazily, or get slower to start than their budget.
+# Exits non-zero on any failure, so it can gate a change.
+#
+#   python -m bench.importcheck
+
+import argparse
+import subprocess
+import sys
+import time
+
+from .micro import REPO_ROOT
+
+
+# Packages that only the commands needing them should import.
+HEAVY_PACKAGES = {'boto3', 'botocore', 'aiohttp'}
+
+# (command line relative to the repo root, best wall time allowed in
+# seconds). Budgets leave about 2x headroom over a laptop's timings, so only
+# a real regression trips them; importing boto3 alone costs ~0.15s.
+CHECKS = [
+    (['kidstuff.py', '--help'], 0.2),
+    (['kidstuff.py', 'tb', '--help'], 0.5),
+    (['kidstuff.py', 'tb', 'search', '--help'], 0.5),
+    (['kidstuff.py', 'tb', 'backup', '--help'], 0.5),
+]
+
+
+# Top-level packages `args` imports, from `python -X importtime`.
+def imported_packages(args: list[str]) -> set[str]:
+    r = subprocess.run([sys.executable, '-X', 'importtime', *args],
+                       cwd=REPO_ROOT, check=True, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.PIPE, text=True)
+
+    # import time: self [us] | cumulative | imported package
+    packages = set()
+    for line in r.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            name = line.rsplit('|', 1)[1].strip()
+            packages.add(name.split('.')[0])
+    return packages
+
+
+def best_time(args: list[str], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=REPO_ROOT, check=True,
+                       stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(args):
+    failures = 0
+    for command, budget in CHECKS:
+        name = ' '.join(command[1:])
+        budget *= args.budget_scale
+
+        heavy = imported_packages(command) & HEAVY_PACKAGES
+        if heavy:
+            print(f'FAIL: {name}: imports {", ".join(sorted(heavy))}')
+            failures += 1
+
+        seconds = best_time(command, args.repeat)
+        if seconds > budget:
+            print(f'FAIL: {name}: {seconds * 1e3:.0f} ms, '
+                  f'budget {budget * 1e3:.0f} ms')
+            failures += 1
+        else:
+            print(f'ok: {name}: {seconds * 1e3:.0f} ms, '
+                  f'budget {budget * 1e3:.0f} ms')
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget-scale', type=float, default=1,
+                        help='multiply every budget by this, e.g. on a slow '
+                             'CI machine')
+    main(parser.parse_args())
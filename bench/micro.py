@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+# Micro-benchmarks for the pure-Python paths sync and the archiver spend
+# their time in, run offline against generated fixtures. Results are JSON so
+# runs from different commits can be diffed.
+#
+#   python -m bench.micro > before.json
+
+import argparse
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+import json
+import pathlib
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import apischema
+
+from htmlfunctions import text_from_html
+import tinybeans.apitypes as tbtypes
+import transparentclassroom.apitypes as tctypes
+from transparentclassroom.postfunctions import (
+    all_class_post_confidence, filter_by_date, tagged_child_ids)
+from urlfunctions import trim_url, url_suffix
+from . import fixtures
+
+
+REPO_ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+# Matches `POSTS_PER_FULL_PAGE` in the TC client.
+POSTS_PER_PAGE = 30
+
+# Each timing runs the benchmark enough times to take at least this long.
+MIN_TIME_SECONDS = 0.2
+
+# Command lines timed for start-up, relative to the repo root.
+STARTUP_COMMANDS = [
+    ['kidstuff.py', '--help'],
+    ['kidstuff.py', 'sync', '--help'],
+    ['kidstuff.py', 'tb', '--help'],
+]
+
+
+@dataclass
+class Result:
+    name: str
+
+    # what one call processes, e.g. 'post' or 'page'
+    unit: str
+
+    # calls per timing
+    loops: int
+
+    # seconds per call
+    best: float
+    median: float
+
+
+# Time `f` the way `timeit` does: grow the loop count until one timing
+# takes `min_time`, then keep the best and median of `repeat` timings.
+def measure(name: str, unit: str, f: Callable[[], object], repeat: int,
+            min_time: float) -> Result:
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            f()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops *= 2 if elapsed == 0 else max(2, int(min_time / elapsed) + 1)
+
+    timings = [elapsed]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            f()
+        timings.append(time.perf_counter() - start)
+
+    return Result(name=name, unit=unit, loops=loops,
+                  best=min(timings) / loops,
+                  median=statistics.median(timings) / loops)
+
+
+# Cycle through `items` so each call sees a different one and no cache
+# built by the code under test sees only one input.
+def cycling(items: list, f: Callable[[object], object]) -> Callable[[], object]:
+    i = 0
+
+    def call():
+        nonlocal i
+        item = items[i]
+        i = (i + 1) % len(items)
+        return f(item)
+
+    return call
+
+
+def benchmarks(seed: int) -> list[tuple[str, str, Callable[[], object]]]:
+    posts_json = fixtures.tc_posts(seed, POSTS_PER_PAGE * 20)
+    pages_json = [posts_json[i:i + POSTS_PER_PAGE]
+                  for i in range(0, len(posts_json), POSTS_PER_PAGE)]
+    html = [p['html'] for p in posts_json]
+    photo_urls = [p['original_photo_url'] for p in posts_json
+                  if 'original_photo_url' in p]
+
+    deserialize_page = apischema.deserialization_method(
+        list[tctypes.Post], additional_properties=True)
+    posts = [p for page in pages_json for p in deserialize_page(page)]
+    mid = posts[len(posts) // 2].date_as_datetime
+    since, until = mid.replace(day=1), mid
+
+    entries_json = fixtures.tb_entries_page(seed, 2024, 5)
+    deserialize_entries = apischema.deserialization_method(
+        tbtypes.ListEntriesResponse, additional_properties=True)
+    deserialize_entry_summaries = apischema.deserialization_method(
+        tbtypes.ListEntrySummariesResponse, additional_properties=True)
+
+    def filter_all():
+        for _ in filter_by_date(posts, since, until):
+            pass
+
+    return [
+        ('tagged_child_ids', 'post', cycling(html, tagged_child_ids)),
+        ('all_class_post_confidence', 'post',
+         cycling(html, all_class_post_confidence)),
+        ('text_from_html', 'post', cycling(html, text_from_html)),
+        ('filter_by_date', f'{len(posts)} posts', filter_all),
+        ('trim_url', 'url', cycling(photo_urls, trim_url)),
+        ('url_suffix', 'url', cycling(photo_urls, url_suffix)),
+        ('deserialize_tc_posts_page', f'{POSTS_PER_PAGE}-post page',
+         cycling(pages_json, deserialize_page)),
+        ('deserialize_tb_entries_page',
+         f'{len(entries_json["entries"])}-entry page',
+         lambda: deserialize_entries(entries_json)),
+        ('deserialize_tb_entry_summaries_page',
+         f'{len(entries_json["entries"])}-entry page',
+         lambda: deserialize_entry_summaries(entries_json)),
+    ]
+
+
+# Wall time for a fresh interpreter to run each of `STARTUP_COMMANDS`.
+def startup_results(repeat: int) -> list[Result]:
+    results = []
+    for args in STARTUP_COMMANDS:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, *args], cwd=REPO_ROOT, check=True,
+                           stdout=subprocess.DEVNULL)
+            timings.append(time.perf_counter() - start)
+        results.append(Result(name=f'startup: {" ".join(args[1:])}',
+                              unit='process', loops=1, best=min(timings),
+                              median=statistics.median(timings)))
+    return results
+
+
+def git_commit() -> str | None:
+    r = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT,
+                       capture_output=True, text=True)
+    return r.stdout.strip() if r.returncode == 0 else None
+
+
+def main(args):
+    results = []
+    for name, unit, f in benchmarks(args.seed):
+        if args.only and args.only not in name:
+            continue
+        results.append(measure(name, unit, f, args.repeat, args.min_time))
+        print(f'{name}: {results[-1].best * 1e6:.1f} us/{unit}',
+              file=sys.stderr)
+
+    if not args.no_startup and (not args.only or 'startup' in args.only):
+        for r in startup_results(args.repeat):
+            results.append(r)
+            print(f'{r.name}: {r.best * 1e3:.0f} ms', file=sys.stderr)
+
+    report = {
+        'commit': git_commit(),
+        'run_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'results': [asdict(r) for r in results],
+    }
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + '\n')
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=MIN_TIME_SECONDS)
+    parser.add_argument('--only', help='run benchmarks whose name contains this')
+    parser.add_argument('--no-startup', action='store_true')
+    parser.add_argument('--output', type=pathlib.Path)
+    main(parser.parse_args())
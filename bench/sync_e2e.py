@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+# Runs `kidstuff.py sync copy-posts-in-range` end to end against the local
+# stand-ins in `fakeservers` and reports throughput as JSON.
+#
+#   python -m bench.sync_e2e --posts 600 --latency-ms 30 > run.json
+#   python -m bench.sync_e2e --sync-options=--per-child-feeds
+
+import argparse
+from datetime import date
+import json
+import os
+import pathlib
+import resource
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+from . import fakeservers
+from .fakeservers import Faults
+from .micro import git_commit, REPO_ROOT
+
+
+SERVICES = ['tc', 'tb', 'aws']
+
+# Unaddressed buckets would be looked up as `bucket.127.0.0.1`.
+AWS_CONFIG = """\
+[default]
+region = us-east-1
+s3 =
+    addressing_style = path
+"""
+
+
+def service_faults(args, service: str) -> Faults:
+    def pick(name: str):
+        value = getattr(args, f'{service}_{name}')
+        return value if value is not None else getattr(args, name)
+
+    return Faults(latency=pick('latency_ms') / 1000,
+                  error_rate=pick('error_rate'),
+                  throttle_rate=pick('throttle_rate'))
+
+
+def sync_env(tc: fakeservers.TransparentClassroomServer,
+             tb: fakeservers.TinybeansServer, aws: fakeservers.AwsServer,
+             scratch: pathlib.Path) -> dict[str, str]:
+    aws_config = scratch.joinpath('aws_config')
+    aws_config.write_text(AWS_CONFIG)
+
+    env = {k: v for k, v in os.environ.items()
+           if not k.startswith('AWS_') and k != 'TINYBEANS_DEFAULT_JOURNAL'}
+    return env | {
+        'TRANSPARENT_CLASSROOM_USERNAME': 'bench',
+        'TRANSPARENT_CLASSROOM_PASSWORD': 'bench',
+        'TRANSPARENT_CLASSROOM_API_BASE': tc.base_url,
+        'TINYBEANS_USERNAME': 'bench',
+        'TINYBEANS_PASSWORD': 'bench',
+        'TINYBEANS_API_BASE': f'{tb.base_url}/api/1',
+        'AWS_CONFIG_FILE': str(aws_config),
+        'AWS_SHARED_CREDENTIALS_FILE': os.devnull,
+        'AWS_ENDPOINT_URL_S3': aws.base_url,
+        'AWS_ENDPOINT_URL_COGNITO_IDENTITY': aws.base_url,
+        'KIDSTUFF_CACHE_DIR': str(scratch.joinpath('cache')),
+    }
+
+
+def main(args):
+    tc = fakeservers.TransparentClassroomServer(
+        service_faults(args, 'tc'), args.seed, args.posts, args.photo_bytes)
+
+    # everything the feed holds, by default
+    until = args.until or date.fromisoformat(tc.posts[0]['date'])
+    since = args.since or date.fromisoformat(tc.posts[-1]['date'])
+    posts = tc.posts_dated(since, until)
+    days = sorted(set(date.fromisoformat(p['date']) for p in posts))
+
+    tb = fakeservers.TinybeansServer(
+        service_faults(args, 'tb'), args.seed, tc.family, days,
+        args.existing_entries_per_day)
+    aws = fakeservers.AwsServer(service_faults(args, 'aws'), args.seed, tb)
+
+    servers = {'tc': tc.start(), 'tb': tb.start(), 'aws': aws.start()}
+    try:
+        with tempfile.TemporaryDirectory() as scratch:
+            command = [
+                sys.executable, 'kidstuff.py', 'sync',
+                *shlex.split(args.sync_options),
+                'copy-posts-in-range',
+                '--since', since.isoformat(), '--until', until.isoformat(),
+                '--tinybeans-journal', str(fakeservers.TB_JOURNAL_ID),
+            ]
+            start = time.perf_counter()
+            result = subprocess.run(
+                command, cwd=REPO_ROOT,
+                env=sync_env(tc, tb, aws, pathlib.Path(scratch)),
+                stdout=subprocess.DEVNULL if not args.verbose else None,
+                stderr=subprocess.PIPE, text=True)
+            elapsed = time.perf_counter() - start
+    finally:
+        for s in servers.values():
+            s.stop()
+
+    if result.returncode != 0:
+        print(result.stderr, file=sys.stderr)
+
+    stats = {name: s.stats.as_dict() for name, s in servers.items()}
+    total_requests = sum(s['requests'] for s in stats.values())
+
+    # Linux reports kilobytes, macOS bytes
+    peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform != 'darwin':
+        peak_rss *= 1024
+
+    report = {
+        'commit': git_commit(),
+        'command': shlex.join(command[1:]),
+        'seed': args.seed,
+        'faults': {name: vars(service_faults(args, name))
+                   for name in SERVICES},
+        'exit_code': result.returncode,
+        'posts': len(posts),
+        'entries_created': tb.created,
+        'entries_pinned': tb.pinned,
+        'photos_uploaded': len(tb.uploads),
+        'seconds': elapsed,
+        'posts_per_second': len(posts) / elapsed,
+        'requests': total_requests,
+        'requests_per_post': total_requests / max(len(posts), 1),
+        'peak_rss_bytes': peak_rss,
+        'services': stats,
+    }
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + '\n')
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    sys.exit(result.returncode)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--posts', type=int, default=300,
+                        help='posts in the fake feed')
+    parser.add_argument('--since', type=date.fromisoformat)
+    parser.add_argument('--until', type=date.fromisoformat)
+    parser.add_argument('--photo-bytes', type=int, default=512 * 1024,
+                        help='size of each original photo')
+    parser.add_argument('--existing-entries-per-day', type=int, default=2)
+    parser.add_argument('--sync-options', default='',
+                        help='options for the `sync` group. They start with '
+                             '"-", so join them with "=", e.g. '
+                             '--sync-options="--per-child-feeds '
+                             '--prefetch-photos 0"')
+
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--throttle-rate', type=float, default=0)
+    for service in SERVICES:
+        parser.add_argument(f'--{service}-latency-ms', type=float)
+        parser.add_argument(f'--{service}-error-rate', type=float)
+        parser.add_argument(f'--{service}-throttle-rate', type=float)
+
+    parser.add_argument('--verbose', action='store_true',
+                        help="show sync's output")
+    parser.add_argument('--output', type=pathlib.Path)
+    main(parser.parse_args())
@@ -0,0 +1,50 @@
+from datetime import timedelta
+import hashlib
+import json
+import os
+from pathlib import Path
+import time
+from typing import Any
+
+from filefunctions import write_atomically
+
+
+# Small JSON values cached on disk between runs. Set KIDSTUFF_CACHE_DIR to
+# move the cache somewhere other than ~/.cache/kidstuff.
+def cache_dir() -> Path:
+    return Path(os.getenv('KIDSTUFF_CACHE_DIR', '~/.cache/kidstuff')
+                ).expanduser()
+
+
+def _cache_path(name: str, key: str) -> Path:
+    # `key` often includes account details, so keep it out of the filename
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    return cache_dir().joinpath(f'{name}-{digest}.json')
+
+
+# Returns the value stored for (`name`, `key`), or None if there isn't one
+# or it's older than `max_age`.
+def load(name: str, key: str, max_age: timedelta) -> Any | None:
+    try:
+        with _cache_path(name, key).open() as f:
+            o = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    if o['key'] != key or time.time() - o['stored_at'] > max_age.total_seconds():
+        return None
+
+    return o['value']
+
+
+def store(name: str, key: str, value: Any):
+    # concurrent readers never see a partial file
+    write_atomically(_cache_path(name, key), json.dumps({
+        'key': key,
+        'stored_at': time.time(),
+        'value': value,
+    }))
+
+
+def invalidate(name: str, key: str):
+    _cache_path(name, key).unlink(missing_ok=True)
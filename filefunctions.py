@@ -0,0 +1,19 @@
+import os
+from pathlib import Path
+import tempfile
+
+
+# Replace `path` with `data` in one step, so readers see the old file or the
+# new one, never part of either, and an interrupted write leaves the old one
+# intact.
+def write_atomically(path: Path, data: str | bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile('wb' if isinstance(data, bytes) else 'w',
+                                     dir=path.parent, suffix='.unfinished',
+                                     delete=False) as f:
+        try:
+            f.write(data)
+        except BaseException:
+            os.unlink(f.name)
+            raise
+    os.replace(f.name, path)
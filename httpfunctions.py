@@ -0,0 +1,63 @@
+import threading
+import time
+
+import requests
+import requests.adapters
+
+
+# Spaces out calls to `wait()` so they happen at most `per_second` times a
+# second, across all threads.
+class RateLimiter:
+    interval: float
+    lock: threading.Lock
+    next_time: float
+
+    def __init__(self, per_second: float):
+        self.interval = 1 / per_second
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            wait_until = max(now, self.next_time)
+            self.next_time = wait_until + self.interval
+        time.sleep(wait_until - now)
+
+
+# An adapter that sends requests through another adapter's connection pool,
+# after waiting on `limiter`. Lets sessions with different credentials and
+# rate limits share connections.
+class RateLimitedAdapter(requests.adapters.HTTPAdapter):
+    pool_from: requests.adapters.HTTPAdapter
+    limiter: RateLimiter | None
+
+    def __init__(self, pool_from: requests.adapters.HTTPAdapter,
+                 limiter: RateLimiter | None = None):
+        self.pool_from = pool_from
+        self.limiter = limiter
+        super().__init__(pool_connections=pool_from._pool_connections,
+                         pool_maxsize=pool_from._pool_maxsize,
+                         pool_block=pool_from._pool_block)
+
+    # Called by `HTTPAdapter` where it would build a pool of its own. Using
+    # `pool_from`'s instead means every session built on it reuses one set
+    # of kept-alive connections per host, and that pool's size bounds them
+    # all together. Credentials are per session, in headers, so sharing
+    # connections doesn't share them.
+    def init_poolmanager(self, *args, **kwargs):
+        self.poolmanager = self.pool_from.poolmanager
+
+    def send(self, request, *args, **kwargs):
+        if self.limiter is not None:
+            self.limiter.wait()
+        return super().send(request, *args, **kwargs)
+
+
+def new_session(adapter: requests.adapters.HTTPAdapter | None = None
+                ) -> requests.Session:
+    session = requests.Session()
+    if adapter is not None:
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+    return session
@@ -0,0 +1,279 @@
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from pathlib import Path
+import re
+import sys
+import threading
+import time
+import urllib.parse
+
+import requests
+
+from filefunctions import write_atomically
+from textfunctions import format_table
+
+
+# Per-request records from the API clients' sessions and the archiver's
+# aiohttp session, passed to whatever sinks are registered. `HttpMetrics` is
+# the sink the CLI uses: it aggregates by endpoint and writes a summary
+# table and a Prometheus textfile at the end of a run.
+
+
+# Upper bounds of the latency histogram's buckets, in seconds.
+LATENCY_BUCKETS = [0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+# Turn paths into endpoint templates, e.g. `/s/123/posts.json` into
+# `/s/{id}/posts.json`, so each endpoint is one series.
+UUID_REGEX = re.compile(
+    r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}', re.I)
+# Not `\b`, which doesn't separate e.g. a blob name from its `_o.jpg`.
+HEX_REGEX = re.compile(r'(?<![0-9a-f])[0-9a-f]{16,}(?![0-9a-f])', re.I)
+# single digits are more likely API versions than IDs
+NUMBER_REGEX = re.compile(r'(?<![0-9a-z])\d{2,}(?![0-9a-z])', re.I)
+
+
+@dataclass
+class RequestRecord:
+    host: str
+    method: str
+    endpoint: str
+
+    # None if no response arrived
+    status: int | None
+
+    seconds: float
+    bytes_sent: int
+    bytes_received: int
+
+
+Sink = Callable[[RequestRecord], None]
+
+_sinks: list[Sink] = []
+
+
+def add_sink(sink: Sink):
+    _sinks.append(sink)
+
+
+def remove_sink(sink: Sink):
+    _sinks.remove(sink)
+
+
+def endpoint_of(url: str) -> tuple[str, str]:
+    parsed = urllib.parse.urlsplit(url)
+    path = UUID_REGEX.sub('{uuid}', parsed.path)
+    path = HEX_REGEX.sub('{hex}', path)
+    path = NUMBER_REGEX.sub('{id}', path)
+    return parsed.netloc, path
+
+
+def record(url: str, method: str, status: int | None, seconds: float,
+           bytes_sent: int, bytes_received: int):
+    if not _sinks:
+        return
+
+    host, endpoint = endpoint_of(url)
+    r = RequestRecord(host=host, method=method, endpoint=endpoint,
+                      status=status, seconds=seconds, bytes_sent=bytes_sent,
+                      bytes_received=bytes_received)
+    for sink in _sinks:
+        sink(r)
+
+
+def _body_length(body) -> int:
+    if isinstance(body, (bytes, str)):
+        return len(body)
+    return 0
+
+
+# `requests` response hook. Hooks run before the body is read, so `elapsed`
+# is time to headers. Streamed bodies are counted by `Content-Length`, since
+# reading them here would defeat streaming.
+def _record_response(response: requests.Response, *args,
+                     stream: bool = False, **kwargs):
+    if not _sinks:
+        return
+
+    if stream:
+        received = int(response.headers.get('content-length', 0))
+    else:
+        received = len(response.content or b'')
+
+    record(response.url, response.request.method, response.status_code,
+           response.elapsed.total_seconds(),
+           _body_length(response.request.body), received)
+
+
+# Hooks for one-off `requests.get(...)` calls.
+HOOKS = {'response': [_record_response]}
+
+
+# Records every response `session` receives. Safe to call more than once.
+def instrument_session(session: requests.Session) -> requests.Session:
+    if _record_response not in session.hooks['response']:
+        session.hooks['response'].append(_record_response)
+    return session
+
+
+# `trace_configs` for an `aiohttp.ClientSession`, recording every request.
+def aiohttp_trace_configs() -> list:
+    # only the archiver's downloads use aiohttp, so don't import it for
+    # everyone else
+    import aiohttp
+
+    async def on_request_start(session, ctx, params):
+        ctx.start = time.monotonic()
+        ctx.bytes_sent = 0
+
+    async def on_request_chunk_sent(session, ctx, params):
+        ctx.bytes_sent += len(params.chunk)
+
+    async def on_request_end(session, ctx, params):
+        record(str(params.url), params.method, params.response.status,
+               time.monotonic() - ctx.start, ctx.bytes_sent,
+               params.response.content_length or 0)
+
+    async def on_request_exception(session, ctx, params):
+        record(str(params.url), params.method, None,
+               time.monotonic() - ctx.start, ctx.bytes_sent, 0)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_chunk_sent.append(on_request_chunk_sent)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    return [trace_config]
+
+
+@dataclass
+class EndpointStats:
+    count: int = 0
+    seconds_sum: float = 0
+    bucket_counts: list[int] = field(
+        default_factory=lambda: [0] * len(LATENCY_BUCKETS))
+    statuses: dict[str, int] = field(default_factory=dict)
+    bytes_sent: int = 0
+    bytes_received: int = 0
+
+    # for percentiles in the summary; a run makes thousands of requests at
+    # most
+    latencies: list[float] = field(default_factory=list)
+
+    def add(self, r: RequestRecord):
+        self.count += 1
+        self.seconds_sum += r.seconds
+        for i, le in enumerate(LATENCY_BUCKETS):
+            if r.seconds <= le:
+                self.bucket_counts[i] += 1
+        status = str(r.status) if r.status is not None else 'error'
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.bytes_sent += r.bytes_sent
+        self.bytes_received += r.bytes_received
+        self.latencies.append(r.seconds)
+
+    def percentile(self, p: float) -> float:
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    @property
+    def failures(self) -> int:
+        return sum(n for status, n in self.statuses.items()
+                   if status == 'error' or int(status) >= 400)
+
+
+def _label_value(s: str) -> str:
+    return s.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(**labels: str) -> str:
+    return '{' + ','.join(f'{k}="{_label_value(v)}"'
+                          for k, v in labels.items()) + '}'
+
+
+class HttpMetrics:
+    lock: threading.Lock
+
+    # (host, method, endpoint) -> stats
+    endpoints: dict[tuple[str, str, str], EndpointStats]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def __call__(self, r: RequestRecord):
+        with self.lock:
+            self.endpoints.setdefault(
+                (r.host, r.method, r.endpoint), EndpointStats()).add(r)
+
+    def summary(self) -> str:
+        rows = [('endpoint', 'count', 'fail', 'p50 ms', 'p95 ms', 'max ms',
+                 'MB in')]
+        with self.lock:
+            for (host, method, endpoint), s in sorted(self.endpoints.items()):
+                rows.append((
+                    f'{method} {host}{endpoint}', str(s.count),
+                    str(s.failures),
+                    f'{s.percentile(0.5) * 1000:.0f}',
+                    f'{s.percentile(0.95) * 1000:.0f}',
+                    f'{max(s.latencies) * 1000:.0f}',
+                    f'{s.bytes_received / 1e6:.1f}'))
+
+        return format_table(rows)
+
+    # https://prometheus.io/docs/instrumenting/exposition_formats/
+    def prometheus_text(self, job: str) -> str:
+        lines = [
+            '# HELP kidstuff_http_request_duration_seconds Time to response '
+            'headers.',
+            '# TYPE kidstuff_http_request_duration_seconds histogram',
+        ]
+        responses = [
+            '# HELP kidstuff_http_responses_total Responses by status code.',
+            '# TYPE kidstuff_http_responses_total counter',
+        ]
+        sent = [
+            '# HELP kidstuff_http_request_bytes_total Request body bytes.',
+            '# TYPE kidstuff_http_request_bytes_total counter',
+        ]
+        received = [
+            '# HELP kidstuff_http_response_bytes_total Response body bytes.',
+            '# TYPE kidstuff_http_response_bytes_total counter',
+        ]
+
+        with self.lock:
+            for (host, method, endpoint), s in sorted(self.endpoints.items()):
+                labels = dict(job=job, host=host, method=method,
+                              endpoint=endpoint)
+                name = 'kidstuff_http_request_duration_seconds'
+                for le, n in zip(LATENCY_BUCKETS, s.bucket_counts):
+                    lines.append(
+                        f'{name}_bucket{_labels(**labels, le=str(le))} {n}')
+                lines.append(
+                    f'{name}_bucket{_labels(**labels, le="+Inf")} {s.count}')
+                lines.append(f'{name}_sum{_labels(**labels)} {s.seconds_sum}')
+                lines.append(f'{name}_count{_labels(**labels)} {s.count}')
+
+                for status, n in sorted(s.statuses.items()):
+                    responses.append(f'kidstuff_http_responses_total'
+                                     f'{_labels(**labels, code=status)} {n}')
+                sent.append(f'kidstuff_http_request_bytes_total'
+                            f'{_labels(**labels)} {s.bytes_sent}')
+                received.append(f'kidstuff_http_response_bytes_total'
+                                f'{_labels(**labels)} {s.bytes_received}')
+
+        finished = [
+            '# HELP kidstuff_last_run_timestamp_seconds When the run ended.',
+            '# TYPE kidstuff_last_run_timestamp_seconds gauge',
+            f'kidstuff_last_run_timestamp_seconds{_labels(job=job)} '
+            f'{time.time():.3f}',
+        ]
+
+        return '\n'.join(lines + responses + sent + received +
+                         finished) + '\n'
+
+    # Print the summary and write the textfile. The textfile is replaced in
+    # one step, since a collector may read it at any moment.
+    def report(self, textfile: Path, job: str):
+        print(self.summary(), file=sys.stderr)
+
+        write_atomically(textfile, self.prometheus_text(job))
@@ -1,20 +1,86 @@
 #! /usr/bin/env python3
 
+import importlib
+from pathlib import Path
+
 import click
+import dotenv
+
+import tracing
+
+
+# Command groups, loaded only when invoked. Between them they import boto3,
+# aiohttp, html5lib and more, which used to take longer than the quicker
+# commands themselves.
+#
+# name -> (module:attribute, short help)
+LAZY_COMMANDS = {
+    'sync': ('sync.cli:sync', 'Sync from TransparentClassroom to Tinybeans'),
+    'tb': ('tinybeans.cli:tb', 'Tinybeans'),
+    'tc': ('transparentclassroom.cli:tc', 'Transparent Classroom'),
+}
+
+
+# Where `--profile` puts the trace, and the profiles next to it, if `--trace`
+# doesn't say.
+DEFAULT_PROFILE_TRACE = 'kidstuff-trace.json'
+
+
+class LazyGroup(click.Group):
+    def list_commands(self, ctx: click.Context) -> list[str]:
+        return sorted(LAZY_COMMANDS)
+
+    def get_command(self, ctx: click.Context, name: str
+                    ) -> click.Command | None:
+        if name not in LAZY_COMMANDS:
+            return None
+        module_name, attribute = LAZY_COMMANDS[name][0].split(':')
+        return getattr(importlib.import_module(module_name), attribute)
+
+    # Listing commands for `--help` would otherwise import all of them just
+    # to read their docstrings.
+    def format_commands(self, ctx: click.Context,
+                        formatter: click.HelpFormatter):
+        with formatter.section('Commands'):
+            formatter.write_dl([(name, help) for name, (_, help)
+                                in sorted(LAZY_COMMANDS.items())])
+
 
-from sync.cli import sync as sync_command
-from tinybeans.cli import tb as tinybeans_command
-from transparentclassroom.cli import tc as transparentclassroom_command
+@click.group(cls=LazyGroup)
+@click.option('--metrics', 'metrics_file',
+              type=click.Path(dir_okay=False, path_type=Path),
+              help='When the command ends, print a summary of HTTP requests '
+                   'and write them here as a Prometheus textfile.')
+@click.option('--trace', 'trace_file',
+              type=click.Path(dir_okay=False, path_type=Path),
+              help='When the command ends, print where the time went and '
+                   'write stage timings here as a Chrome trace.')
+@click.option('--profile', is_flag=True,
+              help='Run the command under cProfile and tracemalloc, writing '
+                   f'their results next to the trace (default trace: '
+                   f'{DEFAULT_PROFILE_TRACE}).')
+@click.pass_context
+def kidstuff(ctx: click.Context, metrics_file: Path | None,
+             trace_file: Path | None, profile: bool):
+    dotenv.load_dotenv()
 
+    if profile and trace_file is None:
+        trace_file = Path(DEFAULT_PROFILE_TRACE)
+    if trace_file is not None:
+        run = tracing.TracedRun(trace_file, profile=profile)
+        run.start()
+        ctx.call_on_close(run.finish)
 
-@click.group()
-def kidstuff():
-    pass
+    if metrics_file is not None:
+        # pulls in `requests`, which `--help` shouldn't wait for
+        import httpmetrics
 
+        metrics = httpmetrics.HttpMetrics()
+        httpmetrics.add_sink(metrics)
+        # runs even if the command fails, when metrics matter most
+        ctx.call_on_close(
+            lambda: metrics.report(metrics_file, job='kidstuff'))
 
-kidstuff.add_command(sync_command)
-kidstuff.add_command(tinybeans_command)
-kidstuff.add_command(transparentclassroom_command)
 
 if __name__ == '__main__':
     kidstuff()
@@ -1,57 +1,310 @@
-from datetime import datetime
+import dataclasses
+from datetime import datetime, timedelta
+from pathlib import Path
+import time
 
 import click
+import requests
 
 import tinybeans.apiclient as tbclient
 import transparentclassroom.apiclient as tcclient
-import transparentclassroom.postfunctions as tcposts
+import transparentclassroom.archiver as tcarchiver
+import tracing
+from . import postsource
+from . import photos
 from . import postsync
+from . import reconcile as syncreconcile
+from . import syncstate
+from . import tenants
+
+
+# How often `watch` looks up matching children again. They're cached on disk
+# for longer than this, so this mostly just notices when that cache expires.
+WATCH_ROSTER_INTERVAL_SECONDS = 24 * 60 * 60
 
 
 @click.group()
-def sync():
+@click.option('--refresh-children', is_flag=True,
+              help='Look up matching children again instead of using the '
+                   'cached list.')
+@click.option('--per-child-feeds', is_flag=True,
+              help="Read each matching child's posts instead of the "
+                   'school-wide feed.')
+@click.option('--photo-variant', type=click.Choice(photos.PHOTO_VARIANTS),
+              default='original', show_default=True,
+              help='Photo size to copy, falling back to the original if '
+                   'missing.')
+@click.option('--photo-max-bytes', type=int,
+              help='Copy the largest variant no bigger than this.')
+@click.option('--prefetch-photos', type=click.IntRange(min=0),
+              default=postsync.PREFETCH_POSTS, show_default=True,
+              help='Download photos for this many posts ahead of the one '
+                   'being copied. 0 downloads each only when needed.')
+@click.pass_context
+def sync(ctx: click.Context, refresh_children: bool, per_child_feeds: bool,
+         photo_variant: photos.PhotoVariant, photo_max_bytes: int | None,
+         prefetch_photos: int):
     """Sync from TransparentClassroom to Tinybeans"""
-    pass
+    ctx.obj = postsync.SyncOptions(
+        refresh_children=refresh_children,
+        per_child_feeds=per_child_feeds,
+        photo_policy=photos.PhotoPolicy(preferred=photo_variant,
+                                        max_bytes=photo_max_bytes),
+        prefetch_photos=prefetch_photos)
+
+
+def posts_in_range(tc: tcclient.TransparentClassroomClient,
+                   since: datetime, until: datetime, archive: Path | None,
+                   child_ids: list[int] | None):
+    if archive is None:
+        return postsource.live_posts(tc, since, until, child_ids)
+    else:
+        return postsource.archived_posts(
+            tc, tcarchiver.db_open_readonly(archive), since, until, child_ids)
 
 
 @sync.command()
 @click.option('--tinybeans-journal', type=str)
 @click.argument('tc_post_ids', nargs=-1, type=click.INT)
-def copy_posts_by_id(tinybeans_journal: str | None,
+@click.pass_obj
+def copy_posts_by_id(options: postsync.SyncOptions,
+                     tinybeans_journal: str | None,
                      tc_post_ids: tuple[int, ...]):
     tc = tcclient.default_client()
     tb = tbclient.default_client().journal(tinybeans_journal)
 
     print(postsync.IMPORT_SESSION_ID)
 
-    matching_children = postsync.find_matching_children(tc, tb)
+    matching_children = postsync.find_matching_children(
+        tc, tb, refresh=options.refresh_children)
+
+    tc_posts = tc.posts_by_id_batched(tc_post_ids)
+    missing = [id for id in tc_post_ids if id not in tc_posts]
+
+    for _ in postsync.copy_posts(
+            tc, tb, matching_children,
+            [tc_posts[id] for id in tc_post_ids if id in tc_posts], options):
+        pass
 
-    for id in tc_post_ids:
-        postsync.copy_one_post(tc, tb, matching_children, id)
+    if missing:
+        raise click.ClickException(
+            f'posts not found: {", ".join(str(id) for id in missing)}')
 
 
 @sync.command()
 @click.option('--since', type=click.DateTime(['%Y-%m-%d']), required=True)
 @click.option('--until', type=click.DateTime(['%Y-%m-%d']), required=True)
 @click.option('--tinybeans-journal', type=str)
-def copy_posts_in_range(since: datetime, until: datetime,
-                        tinybeans_journal: str | None):
+@click.option('--archive', type=click.Path(exists=True, dir_okay=False,
+                                           path_type=Path),
+              help='Read posts from this `posts.sqlite` archive, using the '
+                   'API only for posts newer than the archive.')
+@click.pass_obj
+def copy_posts_in_range(options: postsync.SyncOptions,
+                        since: datetime, until: datetime,
+                        tinybeans_journal: str | None, archive: Path | None):
+    tc = tcclient.default_client()
+    tb = tbclient.default_client().journal(tinybeans_journal)
+
+    print(postsync.IMPORT_SESSION_ID)
+
+    matching_children = postsync.find_matching_children(
+        tc, tb, refresh=options.refresh_children)
+    tc_posts = posts_in_range(
+        tc, since, until, archive,
+        postsync.feed_child_ids(matching_children, options.per_child_feeds))
+
+    for _ in postsync.copy_posts(tc, tb, matching_children, tc_posts,
+                                 options):
+        pass
+
+
+@sync.command()
+@click.option('--state-file', type=click.Path(dir_okay=False, path_type=Path),
+              required=True)
+@click.option('--margin-days', type=int, default=2, show_default=True,
+              help='Re-check posts created this long before the newest post '
+                   'handled by the previous run.')
+@click.option('--initial-days', type=int, default=10, show_default=True,
+              help='Look back this far when there is no previous run.')
+@click.option('--tinybeans-journal', type=str)
+@click.pass_obj
+def copy_new_posts(options: postsync.SyncOptions, state_file: Path,
+                   margin_days: int, initial_days: int,
+                   tinybeans_journal: str | None):
+    """Copy posts created since the previous run"""
     tc = tcclient.default_client()
     tb = tbclient.default_client().journal(tinybeans_journal)
 
     print(postsync.IMPORT_SESSION_ID)
 
-    matching_children = postsync.find_matching_children(tc, tb)
-    tc_posts = tcposts.filter_by_date(tc.all_child_posts(), since, until)
+    state = syncstate.load_state(state_file)
+    print(f'previous newest post: {state.newest_created_at}')
+
+    matching_children = postsync.find_matching_children(
+        tc, tb, refresh=options.refresh_children)
+    postsync.copy_posts_since_mark(
+        tc, tb, matching_children, state,
+        margin=timedelta(days=margin_days),
+        initial_window=timedelta(days=initial_days),
+        options=options)
+    syncstate.save_state(state_file, state)
+
+
+@sync.command()
+@click.option('--state-file', type=click.Path(dir_okay=False, path_type=Path),
+              required=True)
+@click.option('--margin-days', type=int, default=2, show_default=True)
+@click.option('--initial-days', type=int, default=10, show_default=True)
+@click.option('--min-interval', type=int, default=60, show_default=True,
+              help='Seconds between polls right after new posts.')
+@click.option('--max-interval', type=int, default=3600, show_default=True,
+              help='Seconds between polls when nothing is happening.')
+@click.option('--tinybeans-journal', type=str)
+@click.pass_obj
+def watch(options: postsync.SyncOptions, state_file: Path,
+          margin_days: int, initial_days: int,
+          min_interval: int, max_interval: int,
+          tinybeans_journal: str | None):
+    """Keep polling for new posts and copy them as they appear"""
+    print(postsync.IMPORT_SESSION_ID)
+
+    state = syncstate.load_state(state_file)
+
+    # Built on first use, and again after anything that suggests they've
+    # gone stale.
+    tc: tcclient.TransparentClassroomClient | None = None
+    tb: tbclient.TinybeansJournal | None = None
+    matching_children: list[postsync.MatchingChild] | None = None
+    matching_children_at = 0.0
+    refresh_children = options.refresh_children
+
+    interval = min_interval
+    while True:
+        try:
+            if tc is None or tb is None:
+                # `default_client` is cached, and holds the old token
+                tcclient.default_client.cache_clear()
+                tc = tcclient.default_client()
+                tb = tbclient.default_client().journal(tinybeans_journal)
+
+            if matching_children is None or time.monotonic() - \
+                    matching_children_at > WATCH_ROSTER_INTERVAL_SECONDS:
+                matching_children = postsync.find_matching_children(
+                    tc, tb, refresh=refresh_children)
+                matching_children_at = time.monotonic()
+                refresh_children = False
+
+            # New posts almost always land on the first page. Only run the
+            # pipeline when something there is newer than our mark.
+            first_page = tc.all_child_posts_one_page(1)
+            newest = max((p.created_at_as_datetime for p in first_page),
+                         default=None)
+            mark = state.newest_created_at_as_datetime
+
+            if newest is not None and (mark is None or newest > mark):
+                # The mark advances post by post, so work on a copy and keep
+                # it only if every post made it. Otherwise the next poll
+                # could start after a post that failed.
+                run_state = dataclasses.replace(state)
+                postsync.copy_posts_since_mark(
+                    tc, tb, matching_children, run_state,
+                    margin=timedelta(days=margin_days),
+                    initial_window=timedelta(days=initial_days),
+                    options=options)
+                syncstate.save_state(state_file, run_state)
+                state = run_state
+                interval = min_interval
+            else:
+                interval = min(interval * 2, max_interval)
+        except Exception as e:
+            # Keep watching whatever went wrong: a flaky network, S3, or a
+            # bug in one post shouldn't need someone to restart us.
+            print(f'FAILED: {e!r}')
+            interval = min(interval * 2, max_interval)
+
+            if isinstance(e, requests.HTTPError) and \
+                    e.response is not None and e.response.status_code == 401:
+                tc = tb = None
+            if isinstance(e, AssertionError):
+                # most likely "couldn't match tagged child": the roster
+                # changed since we looked
+                matching_children = None
+                refresh_children = True
+
+        # with `--trace`, write out this poll's spans rather than keeping
+        # them until an exit that never comes
+        tracing.checkpoint()
+
+        print(f'{datetime.now():%Y-%m-%d %H:%M:%S} '
+              f'next check in {interval}s')
+        time.sleep(interval)
+
+
+@sync.command()
+@click.option('--config', type=click.Path(exists=True, dir_okay=False,
+                                          path_type=Path), required=True)
+@click.pass_obj
+def copy_new_posts_for_tenants(options: postsync.SyncOptions, config: Path):
+    """Copy new posts for every family in a config file"""
+    print(postsync.IMPORT_SESSION_ID)
+
+    failed = tenants.sync_all_tenants(tenants.load_config(config), options)
+    if failed:
+        raise click.ClickException(f'failed: {", ".join(failed)}')
+
+
+@sync.command()
+@click.option('--since', type=click.DateTime(['%Y-%m-%d']), required=True)
+@click.option('--until', type=click.DateTime(['%Y-%m-%d']), required=True)
+@click.option('--tinybeans-journal', type=str)
+@click.option('--archive', type=click.Path(exists=True, dir_okay=False,
+                                           path_type=Path),
+              help='Read posts from this `posts.sqlite` archive, using the '
+                   'API only for posts newer than the archive.')
+@click.pass_obj
+def reconcile(options: postsync.SyncOptions,
+              since: datetime, until: datetime,
+              tinybeans_journal: str | None, archive: Path | None):
+    """List posts missing from Tinybeans and imports with no TC post"""
+    tc = tcclient.default_client()
+    tb = tbclient.default_client().journal(tinybeans_journal)
+
+    child_ids = None
+    if options.per_child_feeds:
+        child_ids = postsync.feed_child_ids(
+            postsync.find_matching_children(
+                tc, tb, refresh=options.refresh_children),
+            per_child_feeds=True)
+    tc_posts = posts_in_range(tc, since, until, archive, child_ids)
+
+    r = syncreconcile.reconcile(
+        tc_posts, tb.get_entries_range(since.date(), until.date(),
+                                       with_comments=False))
+
+    print(f'{len(r.missing)} missing from Tinybeans:')
+    for p in r.missing:
+        print(f'  {p.date}\tpost.{p.id}')
+
+    print(f'{len(r.orphaned)} imported with no TC post:')
+    for e in r.orphaned:
+        print(f'  {e.year:04}-{e.month:02}-{e.day:02}\t'
+              f'{postsync.url_for_tinybeans_entry(e)}')
 
-    for post in tc_posts:
-        postsync.copy_one_post(tc, tb, matching_children, post)
+    print(f'{len(r.duplicated)} imported more than once:')
+    for post_id, entries in r.duplicated.items():
+        print(f'  post.{post_id}')
+        for e in entries:
+            print(f'    {postsync.url_for_tinybeans_entry(e)}')
 
 
 @sync.command()
 @click.option('--tinybeans-journal', type=str)
-def show_matching_children(tinybeans_journal: str | None):
+@click.pass_obj
+def show_matching_children(options: postsync.SyncOptions,
+                           tinybeans_journal: str | None):
     tc = tcclient.default_client()
     tb = tbclient.default_client().journal(tinybeans_journal)
-    for c in postsync.find_matching_children(tc, tb):
+    for c in postsync.find_matching_children(
+        tc, tb, refresh=options.refresh_children):
         print(f'{c.first_name} {c.last_name}\tTC:{c.tc_id}\tTB:{c.tb_id}')
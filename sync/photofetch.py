@@ -0,0 +1,174 @@
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+import hashlib
+from pathlib import Path
+import secrets
+import tempfile
+import threading
+
+import requests
+
+import httpmetrics
+import tinybeans.apitypes as tbtypes
+from tracing import span
+from urlfunctions import url_suffix
+from . import synclog
+
+
+PHOTO_CHUNK_SIZE = 1024 * 1024
+
+# Posts whose photos may be downloaded ahead of time, counting the one being
+# copied. Each may have a photo on disk until its copy is done.
+PREFETCH_POSTS = 4
+
+
+@dataclass
+class FetchedPhoto:
+    url: str
+    path: Path
+    content_sha256: str
+
+    def discard(self):
+        self.path.unlink(missing_ok=True)
+
+
+# What a prefetch found out about its post, so copying it needn't ask again.
+@dataclass
+class Prefetched:
+    # the post's copies already in Tinybeans, found by searching
+    existing_entries: list[tbtypes.Entry]
+
+    # None if there was nothing to download, or the download failed
+    photo: FetchedPhoto | None
+
+    def discard(self):
+        if self.photo is not None:
+            self.photo.discard()
+
+
+# Returns a post's existing copies in Tinybeans, and the URL of the photo
+# copying it would download, if any.
+PrefetchPlan = Callable[[], tuple[list[tbtypes.Entry], str | None]]
+
+
+# Downloads photos over one pool of connections to the image host, and can
+# start on upcoming posts' photos in the background while earlier posts are
+# being copied. At most `lookahead` photos are pending or on disk at once;
+# each is streamed to a scratch directory that's removed on `close`.
+class PhotoFetcher:
+    lookahead: int
+    session: requests.Session
+    executor: ThreadPoolExecutor
+    directory: tempfile.TemporaryDirectory
+
+    lock: threading.Lock
+
+    # post ID -> what its prefetch found, or None if it failed
+    pending: dict[int, Future[Prefetched | None]]
+
+    def __init__(self, lookahead: int = PREFETCH_POSTS):
+        self.lookahead = lookahead
+
+        # one connection per worker, plus one for the caller
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=lookahead + 1)
+        self.session = httpmetrics.instrument_session(requests.Session())
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        # threads only start once something is submitted
+        self.executor = ThreadPoolExecutor(max(lookahead, 1),
+                                           thread_name_prefix='photofetch')
+        self.directory = tempfile.TemporaryDirectory(prefix='kidstuff-photos-')
+
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def __enter__(self) -> 'PhotoFetcher':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Download `url` now.
+    def fetch(self, url: str) -> FetchedPhoto:
+        path = Path(self.directory.name,
+                    f'{secrets.token_hex(8)}{url_suffix(url)}')
+
+        # hash as we go, since uploads are deduplicated by content
+        content_hash = hashlib.sha256()
+        with self.session.get(url, stream=True) as r, path.open('wb') as f:
+            r.raise_for_status()
+            while chunk := r.raw.read(PHOTO_CHUNK_SIZE):
+                content_hash.update(chunk)
+                f.write(chunk)
+
+        return FetchedPhoto(url=url, path=path,
+                            content_sha256=content_hash.hexdigest())
+
+    # Start running `plan` for post `post_id` and downloading the photo it
+    # picks, if there's room. Both happen in the background.
+    def prefetch(self, post_id: int, plan: PrefetchPlan):
+        with self.lock:
+            if post_id in self.pending or len(self.pending) >= self.lookahead:
+                return
+            self.pending[post_id] = self.executor.submit(
+                self._prefetch, post_id, plan, synclog.prefix.get())
+
+    def _prefetch(self, post_id: int, plan: PrefetchPlan,
+                  log_prefix: str) -> Prefetched | None:
+        synclog.prefix.set(log_prefix)
+        with span('photo prefetch', prefetching=post_id):
+            # the copy will try again, and fail properly if it has to
+            try:
+                existing_entries, url = plan()
+            except requests.RequestException as e:
+                synclog.log(f'PREFETCH FAILED for {post_id}: {e}')
+                return None
+
+            prefetched = Prefetched(existing_entries=existing_entries,
+                                    photo=None)
+            if url is not None:
+                try:
+                    prefetched.photo = self.fetch(url)
+                except requests.RequestException as e:
+                    synclog.log(f'PREFETCH FAILED for {post_id}: {e}')
+            return prefetched
+
+    # What the prefetch for `post_id` found, waiting for it if it's still
+    # running, or None if there wasn't one or it failed. Its photo stays on
+    # disk until `discard`.
+    def take(self, post_id: int) -> Prefetched | None:
+        with self.lock:
+            future = self.pending.get(post_id)
+        if future is None:
+            return None
+
+        with span('photo wait'):
+            return future.result()
+
+    # Forget `post_id`'s prefetch and delete its photo, making room for
+    # another. A download still running is left to finish and then deleted,
+    # rather than waited for.
+    def discard(self, post_id: int):
+        with self.lock:
+            future = self.pending.pop(post_id, None)
+        if future is not None and not future.cancel():
+            future.add_done_callback(_discard_result)
+
+    def close(self):
+        with self.lock:
+            futures = list(self.pending.values())
+            self.pending.clear()
+
+        for f in futures:
+            f.cancel()
+        self.executor.shutdown(wait=True)
+        self.session.close()
+        self.directory.cleanup()
+
+
+def _discard_result(future: Future[Prefetched | None]):
+    prefetched = future.result()
+    if prefetched is not None:
+        prefetched.discard()
@@ -0,0 +1,79 @@
+from dataclasses import dataclass
+import re
+from typing import Literal
+
+import requests
+
+import httpmetrics
+import transparentclassroom.apitypes as tctypes
+
+
+PhotoVariant = Literal['original', 'large', 'medium']
+
+# largest first
+PHOTO_VARIANTS: list[PhotoVariant] = ['original', 'large', 'medium']
+
+CONTENT_RANGE_REGEX = re.compile(r'bytes \d+-\d+/(\d+)')
+
+
+# Which of a TC post's photos to copy. Tinybeans makes its own renditions
+# from whatever we upload, so a smaller variant can be good enough.
+@dataclass(frozen=True)
+class PhotoPolicy:
+    # Variant to try first. Smaller variants are tried after it.
+    preferred: PhotoVariant = 'original'
+
+    # If set, take the largest variant, starting from `preferred`, that's no
+    # bigger than this. If none is small enough, take the smallest.
+    max_bytes: int | None = None
+
+
+def photo_url(post: tctypes.Post, variant: PhotoVariant) -> str | None:
+    match variant:
+        case 'original': return post.original_photo_url
+        case 'large': return post.large_photo_url
+        case 'medium': return post.medium_photo_url
+
+
+# Size of the file at `url` in bytes, or None if the server won't say.
+#
+# Photo URLs are presigned for GET, so a HEAD request would be refused. Ask
+# for the first byte instead and read the total from `Content-Range`.
+def photo_size(url: str) -> int | None:
+    with requests.get(url, headers={'Range': 'bytes=0-0'}, stream=True,
+                      hooks=httpmetrics.HOOKS) as r:
+        if not r.ok:
+            return None
+
+        m = CONTENT_RANGE_REGEX.fullmatch(r.headers.get('content-range', ''))
+        if m:
+            return int(m.group(1))
+
+        # server ignored the range and is sending the whole thing
+        if r.status_code == 200 and 'content-length' in r.headers:
+            return int(r.headers['content-length'])
+
+    return None
+
+
+# URL of the photo to copy from `post` under `policy`, or None if the post
+# has no photo. Falls back to the original when smaller variants are
+# missing.
+def choose_photo_url(post: tctypes.Post, policy: PhotoPolicy) -> str | None:
+    start = PHOTO_VARIANTS.index(policy.preferred)
+    candidates = [url for url in (photo_url(post, v)
+                                  for v in PHOTO_VARIANTS[start:])
+                  if url]
+
+    if len(candidates) == 0:
+        return post.original_photo_url
+
+    if policy.max_bytes is None:
+        return candidates[0]
+
+    for url in candidates:
+        size = photo_size(url)
+        if size is not None and size <= policy.max_bytes:
+            return url
+
+    return candidates[-1]
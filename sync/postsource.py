@@ -0,0 +1,82 @@
+from collections.abc import Iterable
+from datetime import date, datetime, timedelta, timezone
+import heapq
+import sqlite3
+
+from transparentclassroom.apiclient import TransparentClassroomClient
+import transparentclassroom.apitypes as tctypes
+import transparentclassroom.archiver as archiver
+import transparentclassroom.postfunctions as tcposts
+
+
+def sort_key(p: tctypes.Post) -> tuple[str, str]:
+    # same order as `posts.json`
+    return (p.date, p.created_at)
+
+
+# Posts in range, newest first, read from the API.
+#
+# Everywhere in this module, `child_ids` asks the client to read just those
+# children's feeds; see `TransparentClassroomClient.all_child_posts`.
+def live_posts(tc: TransparentClassroomClient, since: datetime,
+               until: datetime, child_ids: list[int] | None = None
+               ) -> Iterable[tctypes.Post]:
+    return tcposts.filter_by_date(tc.all_child_posts(child_ids), since, until)
+
+
+# Posts in range, newest first, read from an archive created by `archiver.py`.
+#
+# The API is only consulted for posts the archive might not have yet, i.e.
+# those dated after the archive's watermark less `OLD_POST_MARGIN`. Where a
+# post is in both, the live copy wins.
+def archived_posts(tc: TransparentClassroomClient, db: sqlite3.Connection,
+                   since: datetime, until: datetime,
+                   child_ids: list[int] | None = None
+                   ) -> Iterable[tctypes.Post]:
+    live_not_before = str(
+        date.fromisoformat(archiver.newest_post_created_at(db))
+        - archiver.OLD_POST_MARGIN)
+    live_not_before = max(live_not_before, since.strftime('%Y-%m-%d'))
+
+    live: list[tctypes.Post] = []
+    for p in tc.all_child_posts(child_ids):
+        if p.date < live_not_before:
+            break
+        live.append(p)
+    live_ids = set(p.id for p in live)
+
+    archived = [
+        p for p in archiver.posts_in_date_range(db,
+                                                since.strftime('%Y-%m-%d'),
+                                                until.strftime('%Y-%m-%d'))
+        if p.id not in live_ids]
+
+    merged = heapq.merge(live, archived, key=sort_key, reverse=True)
+    return tcposts.filter_by_date(merged, since, until)
+
+
+# Posts newest first, stopping once we reach posts created more than `margin`
+# before `mark`, the newest `created_at` handled by a previous run. With no
+# mark, returns posts dated within `initial_window` of today.
+#
+# Like the archiver, this assumes posts are never back-dated by more than
+# `margin` relative to when they were created.
+def posts_since_mark(tc: TransparentClassroomClient, mark: datetime | None,
+                     margin: timedelta, initial_window: timedelta,
+                     child_ids: list[int] | None = None
+                     ) -> Iterable[tctypes.Post]:
+    if mark is None:
+        cutoff = datetime.now(timezone.utc) - initial_window
+    else:
+        cutoff = mark - margin
+    cutoff_date = cutoff.strftime('%Y-%m-%d')
+
+    for p in tc.all_child_posts(child_ids):
+        if p.date < cutoff_date:
+            break
+
+        # handled by an earlier run, even though dated recently
+        if mark is not None and p.created_at_as_datetime < cutoff:
+            continue
+
+        yield p
@@ -1,20 +1,25 @@
-from dataclasses import dataclass
-from datetime import datetime
-from pathlib import Path
+from collections import deque
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, field
+from datetime import timedelta
 import secrets
-import shutil
-import tempfile
 
-import requests
+from apischema import deserialize, serialize
 
+import cachefiles
 from htmlfunctions import text_from_html
 from tinybeans.apiclient import TinybeansJournal
-from tinybeans.upload_picture import upload_picture_file
 import tinybeans.apitypes as tbtypes
 from transparentclassroom.apiclient import TransparentClassroomClient
 import transparentclassroom.apitypes as tctypes
 import transparentclassroom.postfunctions as tcposts
-from urlfunctions import url_suffix
+from tracing import span
+from . import postsource
+from . import synclog
+from .photofetch import FetchedPhoto, PhotoFetcher, PREFETCH_POSTS
+from .photos import choose_photo_url, PhotoPolicy
+from .syncstate import SyncState
+from .uploadcache import default_upload_cache
 
 
 @dataclass
@@ -26,8 +31,29 @@ class MatchingChild:
     tb_id: int
 
 
+# Settings shared by the sync commands. Frozen, since one instance is the
+# default for several functions.
+@dataclass(frozen=True)
+class SyncOptions:
+    # ignore the cached result of `find_matching_children`
+    refresh_children: bool = False
+
+    # read matching children's feeds instead of the school-wide one
+    per_child_feeds: bool = False
+
+    photo_policy: PhotoPolicy = field(default_factory=PhotoPolicy)
+
+    # posts to download photos for ahead of time; 0 to download each photo
+    # only when its post needs it
+    prefetch_photos: int = PREFETCH_POSTS
+
+
 IMPORT_SESSION_ID = secrets.token_hex(3)
 
+# Rosters rarely change. Pass `refresh=True` to `find_matching_children` to
+# pick up a change sooner.
+MATCHING_CHILDREN_CACHE_MAX_AGE = timedelta(days=7)
+
 
 def url_for_tinybeans_entry(p: tbtypes.Entry) -> str:
     # URL field is for API use, not for browsing
@@ -35,66 +61,180 @@ def url_for_tinybeans_entry(p: tbtypes.Entry) -> str:
 
 
 def find_matching_children(tc: TransparentClassroomClient,
-                           tb: TinybeansJournal) -> list[MatchingChild]:
+                           tb: TinybeansJournal,
+                           refresh: bool = False) -> list[MatchingChild]:
+    cache_key = f'{tc.school_id}.{tc.user_info.id}.{tb.journal_id}'
+    if not refresh:
+        cached = cachefiles.load('matching_children', cache_key,
+                                 MATCHING_CHILDREN_CACHE_MAX_AGE)
+        if cached is not None:
+            return deserialize(list[MatchingChild], cached)
+
     tc_children = tc.my_children()
-    tb_children = tb.get_details().children
+    tb_children = tb.get_details(refresh=refresh).children
+
+    # if this turns out to be too exacting, we could look at DOB
+    tb_children_by_name: dict[tuple[str, str], list[tbtypes.Child]] = {}
+    for tbb in tb_children:
+        tb_children_by_name.setdefault(
+            (tbb.firstName, tbb.lastName), []).append(tbb)
 
     matches = []
     for tcc in tc_children:
-        for tbb in tb_children:
-            # if this turns out to be too exacting, we could look at DOB
-            if tbb.firstName == tcc.first_name and tbb.lastName == tcc.last_name:
-                matches.append(MatchingChild(
-                    first_name=tbb.firstName,
-                    last_name=tbb.lastName,
-                    tc_id=tcc.id,
-                    tb_id=tbb.id))
+        for tbb in tb_children_by_name.get((tcc.first_name, tcc.last_name), []):
+            matches.append(MatchingChild(
+                first_name=tbb.firstName,
+                last_name=tbb.lastName,
+                tc_id=tcc.id,
+                tb_id=tbb.id))
+
+    # don't remember a roster that's still being set up
+    if len(matches) > 0:
+        cachefiles.store('matching_children', cache_key, serialize(matches))
 
     return matches
 
 
+# Children whose own feeds to read, or None to read the school-wide feed.
+def feed_child_ids(matching_children: list[MatchingChild],
+                   per_child_feeds: bool) -> list[int] | None:
+    if not per_child_feeds:
+        return None
+    return [c.tc_id for c in matching_children]
+
+
+# Copy the photo at `url` to Tinybeans' bucket, unless we recently did, and
+# return its name there. Uses `prefetched` if it's the same photo, otherwise
+# downloads it with `photos`.
+def upload_photo(url: str, photos: PhotoFetcher,
+                 prefetched: FetchedPhoto | None = None) -> str:
+    cache = default_upload_cache()
+
+    remote_file_name = cache.by_photo_url(url)
+    if remote_file_name is not None:
+        synclog.log(f'REUSING upload {remote_file_name}')
+        return remote_file_name
+
+    photo = prefetched
+    if photo is None or photo.url != url:
+        with span('photo download'):
+            photo = photos.fetch(url)
+
+    try:
+        # upload it to Tinybeans, unless the same bytes came from another URL
+        remote_file_name = cache.by_content_hash(photo.content_sha256)
+        if remote_file_name is not None:
+            synclog.log(f'REUSING upload {remote_file_name}')
+        else:
+            # boto3 takes a while to import, so only load it once there's
+            # something to upload
+            from tinybeans.upload_picture import upload_picture_file
+            with span('photo upload'):
+                remote_file_name = upload_picture_file(photo.path)
+    finally:
+        photo.discard()
+
+    cache.record(url, photo.content_sha256, remote_file_name)
+    return remote_file_name
+
+
+# `tc_post`'s existing copies in Tinybeans, and the photo `copy_one_post`
+# would download for it, or None if it wouldn't download one: the post is
+# already copied, skipped, or its photo was uploaded recently. Checks the same
+# things, so a prefetch isn't wasted, and the copy uses the search's result
+# rather than searching again.
+def plan_prefetch(tb: TinybeansJournal, tc_post: tctypes.Post,
+                  photo_policy: PhotoPolicy
+                  ) -> tuple[list[tbtypes.Entry], str | None]:
+    existing_entries = tb.search(f'post.{tc_post.id}')
+    if existing_entries or skip_reason(tc_post) is not None:
+        return existing_entries, None
+
+    url = choose_photo_url(tc_post, photo_policy)
+    if url is None or default_upload_cache().by_photo_url(url) is not None:
+        return existing_entries, None
+
+    return existing_entries, url
+
+
+# Why we'd leave `tc_post` out of Tinybeans, or None if we wouldn't.
+def skip_reason(tc_post: tctypes.Post) -> str | None:
+    # skip posts without photos
+    if tc_post.photo_url is None:
+        return 'no picture'
+
+    # skip class photo posts
+    with span('html parse', purpose='class post'):
+        class_photo_score = tcposts.all_class_post_confidence(tc_post.html)
+    if class_photo_score > 3:
+        return f'suspected class post (score {class_photo_score})'
+
+    return None
+
+
 def copy_one_post(tc: TransparentClassroomClient, tb: TinybeansJournal,
                   matching_children: list[MatchingChild],
-                  tc_post_or_id: tctypes.Post | int):
+                  tc_post_or_id: tctypes.Post | int,
+                  photo_policy: PhotoPolicy = PhotoPolicy(),
+                  photos: PhotoFetcher | None = None):
     match tc_post_or_id:
         case int(tc_post_id): pass
         case tctypes.Post(id=tc_post_id): pass
 
-    # skip posts already sync'd
-    existing_posts = tb.search(f'post.{tc_post_id}')
+    if photos is None:
+        with PhotoFetcher(lookahead=0) as photos:
+            return copy_one_post(tc, tb, matching_children, tc_post_or_id,
+                                 photo_policy, photos)
+
+    try:
+        with span('copy post', post=tc_post_id):
+            _copy_one_post(tc, tb, matching_children, tc_post_or_id,
+                           tc_post_id, photo_policy, photos)
+    finally:
+        photos.discard(tc_post_id)
+
+
+def _copy_one_post(tc: TransparentClassroomClient, tb: TinybeansJournal,
+                   matching_children: list[MatchingChild],
+                   tc_post_or_id: tctypes.Post | int, tc_post_id: int,
+                   photo_policy: PhotoPolicy, photos: PhotoFetcher):
+    # skip posts already sync'd, which a prefetch may have checked already
+    prefetched = photos.take(tc_post_id)
+    if prefetched is not None:
+        existing_posts = prefetched.existing_entries
+    else:
+        with span('search'):
+            existing_posts = tb.search(f'post.{tc_post_id}')
     match existing_posts:
         case [existing_tb_post]:
-            print(f'SKIPPING {tc_post_id}, already posted:')
-            print(f'  {url_for_tinybeans_entry(existing_tb_post)}')
+            synclog.log(f'SKIPPING {tc_post_id}, already posted:')
+            synclog.log(f'  {url_for_tinybeans_entry(existing_tb_post)}')
             return
 
     # assign tc_post
     match tc_post_or_id:
         case tctypes.Post() as tc_post: pass
         case int():
-            match tc.posts_by_id([tc_post_id]):
+            with span('fetch post'):
+                posts = tc.posts_by_id([tc_post_id])
+            match posts:
                 case [tc_post]: pass
                 case _: raise KeyError(f'post {tc_post_id} not found')
 
-    # skip posts without photos
-    if tc_post.photo_url is None:
-        print(f'SKIPPING {tc_post_id} with no picture')
+    reason = skip_reason(tc_post)
+    if reason is not None:
+        synclog.log(f'SKIPPING {tc_post_id}, {reason}')
         return
 
-    # skip class photo posts
-    class_photo_score = tcposts.all_class_post_confidence(tc_post.html)
-    if class_photo_score > 3:
-        print(f'SKIPPING {tc_post_id}, '
-              f'suspected class post (score {class_photo_score})')
-        return
-
-    tc_post_date = datetime.strptime(tc_post.date, '%Y-%m-%d')
+    tc_post_date = tc_post.date_as_datetime
 
     # Make sure the day has a pinned entry so we don't change the cover.
 
-    tb_entries_for_day = tb.get_entries(tc_post_date.year,
-                                        tc_post_date.month,
-                                        tc_post_date.day)
+    with span('day listing'):
+        tb_entries_for_day = tb.get_entries(tc_post_date.year,
+                                            tc_post_date.month,
+                                            tc_post_date.day,
+                                            with_comments=False)
     
     # If there are *any* posts and none are already pinned, choose the one
     # the server returned first (which is being used as the cover) to pin,
@@ -105,9 +245,11 @@ def copy_one_post(tc: TransparentClassroomClient, tb: TinybeansJournal,
         if all([e.pinnedTimestamp is None for e in tb_entries_for_day]):
             maybe_pin = tb_entries_for_day[0]
             if maybe_pin.caption.find('tctbimport.') == -1:
-                tb.pin_entry(maybe_pin)
+                with span('pin'):
+                    tb.pin_entry(maybe_pin)
 
-    caption = text_from_html(tc_post.html)
+    with span('html parse', purpose='caption'):
+        caption = text_from_html(tc_post.html)
     caption += (f'\n\n(post.{tc_post_id}, '
                 f'tctbimport.{IMPORT_SESSION_ID})')
 
@@ -119,20 +261,19 @@ def copy_one_post(tc: TransparentClassroomClient, tb: TinybeansJournal,
         caption=caption,
     )
 
-    if tc_post.original_photo_url:
-        url = tc_post.original_photo_url
-
-        with tempfile.NamedTemporaryFile(suffix=url_suffix(url)) as picture_file:
-            # download original photo to temp file ...
-            with requests.get(url, stream=True) as r:
-                r.raise_for_status()
-                shutil.copyfileobj(r.raw, picture_file)
-            
-            # ... and upload it to Tinybeans
-            new_tb_entry.remoteFileName = upload_picture_file(Path(
-                picture_file.name))
+    # a prefetch made the same choice already
+    photo = prefetched.photo if prefetched is not None else None
+    if photo is not None:
+        url = photo.url
+    else:
+        with span('choose photo'):
+            url = choose_photo_url(tc_post, photo_policy)
+    if url:
+        with span('photo'):
+            new_tb_entry.remoteFileName = upload_photo(url, photos, photo)
 
-    tagged_children = tcposts.tagged_child_ids(tc_post.html)
+    with span('html parse', purpose='tagged children'):
+        tagged_children = tcposts.tagged_child_ids(tc_post.html)
     relevant_children: list[MatchingChild] = []
     for c in matching_children:
         if c.tc_id in tagged_children:
@@ -144,6 +285,59 @@ def copy_one_post(tc: TransparentClassroomClient, tb: TinybeansJournal,
 
     new_tb_entry.children = [c.tb_id for c in relevant_children]
 
-    added_tb_entry = tb.create_entry(new_tb_entry)
+    with span('create'):
+        added_tb_entry = tb.create_entry(new_tb_entry)
+    if new_tb_entry.remoteFileName is not None:
+        default_upload_cache().forget(new_tb_entry.remoteFileName)
+
+    synclog.log(url_for_tinybeans_entry(added_tb_entry))
+
+
+# Copy each of `tc_posts`, yielding each once it's done. Photos for the next
+# few posts download in the background meanwhile.
+def copy_posts(tc: TransparentClassroomClient, tb: TinybeansJournal,
+               matching_children: list[MatchingChild],
+               tc_posts: Iterable[tctypes.Post],
+               options: SyncOptions = SyncOptions()
+               ) -> Iterator[tctypes.Post]:
+    tc_posts = iter(tc_posts)
+
+    with PhotoFetcher(lookahead=options.prefetch_photos) as photos:
+        # the post being copied, then the ones we're prefetching for
+        window: deque[tctypes.Post] = deque()
+        while True:
+            while len(window) < max(options.prefetch_photos, 1):
+                post = next(tc_posts, None)
+                if post is None:
+                    break
+                window.append(post)
+            if len(window) == 0:
+                return
+
+            for post in window:
+                photos.prefetch(
+                    post.id,
+                    lambda post=post: plan_prefetch(
+                        tb, post, options.photo_policy))
+
+            post = window.popleft()
+            copy_one_post(tc, tb, matching_children, post,
+                          options.photo_policy, photos)
+            yield post
+
+
+# Copy posts created since `state`'s mark, advancing the mark as we go. The
+# caller should only save `state` if this returns normally: posts come sorted
+# by `date`, not `created_at`, so the mark is only meaningful once we've seen
+# every post after it.
+def copy_posts_since_mark(tc: TransparentClassroomClient, tb: TinybeansJournal,
+                          matching_children: list[MatchingChild],
+                          state: SyncState, margin: timedelta,
+                          initial_window: timedelta,
+                          options: SyncOptions = SyncOptions()):
+    tc_posts = postsource.posts_since_mark(
+        tc, state.newest_created_at_as_datetime, margin, initial_window,
+        child_ids=feed_child_ids(matching_children, options.per_child_feeds))
 
-    print(url_for_tinybeans_entry(added_tb_entry))
+    for post in copy_posts(tc, tb, matching_children, tc_posts, options):
+        state.advance(post)
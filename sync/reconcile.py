@@ -0,0 +1,57 @@
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+import re
+
+import tinybeans.apitypes as tbtypes
+import transparentclassroom.apitypes as tctypes
+from . import postsync
+
+
+# Matches the marker `copy_one_post` appends to captions, e.g.
+# "(post.123456, tctbimport.abcdef)".
+IMPORT_MARKER_REGEX = re.compile(r'\(post\.(\d+), tctbimport\.[0-9a-f]+\)')
+
+
+def imported_post_id(entry: tbtypes.Entry) -> int | None:
+    m = IMPORT_MARKER_REGEX.search(entry.caption)
+    return int(m.group(1)) if m else None
+
+
+@dataclass
+class Reconciliation:
+    # TC posts we would copy but haven't
+    missing: list[tctypes.Post] = field(default_factory=list)
+
+    # Tinybeans imports whose TC post isn't among the posts we were given
+    orphaned: list[tbtypes.Entry] = field(default_factory=list)
+
+    # TC post ID -> every Tinybeans entry imported from it, where there's
+    # more than one
+    duplicated: dict[int, list[tbtypes.Entry]] = field(default_factory=dict)
+
+
+# Compare TC posts against Tinybeans entries for the same dates, using only
+# the markers in captions.
+def reconcile(tc_posts: Iterable[tctypes.Post],
+              tb_entries: Iterable[tbtypes.Entry]) -> Reconciliation:
+    imports: dict[int, list[tbtypes.Entry]] = {}
+    for e in tb_entries:
+        post_id = imported_post_id(e)
+        if post_id is not None:
+            imports.setdefault(post_id, []).append(e)
+
+    result = Reconciliation()
+
+    tc_post_ids = set()
+    for p in tc_posts:
+        tc_post_ids.add(p.id)
+        if p.id not in imports and postsync.skip_reason(p) is None:
+            result.missing.append(p)
+
+    for post_id, entries in imports.items():
+        if post_id not in tc_post_ids:
+            result.orphaned += entries
+        if len(entries) > 1:
+            result.duplicated[post_id] = entries
+
+    return result
@@ -0,0 +1,12 @@
+import contextvars
+
+
+# Put in front of every line the sync prints, e.g. "[smith] " while several
+# tenants sync at once and their output is interleaved. Threads start with
+# the default, so code that hands work to a thread passes it along.
+prefix: contextvars.ContextVar[str] = contextvars.ContextVar('log_prefix',
+                                                             default='')
+
+
+def log(message: str):
+    print(f'{prefix.get()}{message}')
@@ -0,0 +1,42 @@
+from dataclasses import dataclass
+from datetime import datetime
+import json
+from pathlib import Path
+
+from apischema import deserialize, serialize
+
+from filefunctions import write_atomically
+import transparentclassroom.apitypes as tctypes
+
+
+# State persisted between runs of `copy-new-posts`.
+@dataclass
+class SyncState:
+    # `created_at` of the newest post handled by a successful run, in the
+    # server's own format.
+    newest_created_at: str | None = None
+
+    @property
+    def newest_created_at_as_datetime(self) -> datetime | None:
+        if self.newest_created_at is None:
+            return None
+        return datetime.strptime(self.newest_created_at,
+                                 '%Y-%m-%dT%H:%M:%S.%f%z')
+
+    def advance(self, post: tctypes.Post):
+        newest = self.newest_created_at_as_datetime
+        if newest is None or post.created_at_as_datetime > newest:
+            self.newest_created_at = post.created_at
+
+
+def load_state(path: Path) -> SyncState:
+    if not path.exists():
+        return SyncState()
+
+    with path.open() as f:
+        return deserialize(SyncState, json.load(f))
+
+
+def save_state(path: Path, state: SyncState):
+    # an interrupted save leaves the old state intact
+    write_atomically(path, json.dumps(serialize(state), indent=2))
@@ -0,0 +1,151 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import timedelta
+import json
+import os
+from pathlib import Path
+import re
+
+import apischema
+import requests.adapters
+
+from httpfunctions import new_session, RateLimitedAdapter, RateLimiter
+import tinybeans.apiclient as tbclient
+from tinybeans.apiclient import TinybeansClient
+import transparentclassroom.apiclient as tcclient
+from transparentclassroom.apiclient import TransparentClassroomClient
+from . import postsync
+from . import synclog
+from . import syncstate
+
+
+# `$NAME` or `${NAME}`, as `os.path.expandvars` understands them
+ENV_VAR_REGEX = re.compile(r'\$(\w+)|\$\{([^}]*)\}')
+
+
+# One family: a Transparent Classroom account synced to a Tinybeans journal.
+#
+# String values may refer to environment variables, e.g. "$SMITH_TC_PASSWORD",
+# so the config file itself needn't hold secrets.
+@dataclass
+class Tenant:
+    name: str
+
+    transparent_classroom_username: str
+    transparent_classroom_password: str
+
+    tinybeans_username: str
+    tinybeans_password: str
+    tinybeans_journal: str
+
+    # relative to the config file
+    state_file: str
+
+    # applies to each service separately
+    requests_per_second: float = 2
+
+
+@dataclass
+class TenantsConfig:
+    tenants: list[Tenant]
+
+    # Tenants beyond this many wait their turn, in config order.
+    max_concurrent_tenants: int = 4
+
+    margin_days: int = 2
+    initial_days: int = 10
+
+
+# `value` with environment variables substituted. Unlike
+# `os.path.expandvars`, a variable that isn't set is an error rather than
+# being left in place, where it'd be sent as a password.
+def expand_env_vars(value: str, context: str) -> str:
+    def replace(m: re.Match) -> str:
+        name = m[1] or m[2]
+        if name not in os.environ:
+            raise ValueError(f'{context} refers to ${name}, which is not set')
+        return os.environ[name]
+
+    return ENV_VAR_REGEX.sub(replace, value)
+
+
+def load_config(path: Path) -> TenantsConfig:
+    with path.open() as f:
+        config = apischema.deserialize(TenantsConfig, json.load(f))
+
+    for t in config.tenants:
+        for field in ['transparent_classroom_username',
+                      'transparent_classroom_password',
+                      'tinybeans_username',
+                      'tinybeans_password',
+                      'tinybeans_journal']:
+            setattr(t, field,
+                    expand_env_vars(getattr(t, field), f'{t.name}: {field}'))
+        t.state_file = str(path.parent.joinpath(t.state_file))
+
+    return config
+
+
+def sync_tenant(t: Tenant, config: TenantsConfig,
+                shared_adapter: requests.adapters.HTTPAdapter,
+                options: postsync.SyncOptions):
+    # Each service gets its own limiter, so a slow one doesn't eat into the
+    # other's budget.
+    tc = TransparentClassroomClient(
+        t.transparent_classroom_username, t.transparent_classroom_password,
+        session=new_session(RateLimitedAdapter(
+            shared_adapter, RateLimiter(t.requests_per_second))))
+    tb = TinybeansClient(
+        t.tinybeans_username, t.tinybeans_password,
+        session=new_session(RateLimitedAdapter(
+            shared_adapter, RateLimiter(t.requests_per_second)))
+        ).journal(t.tinybeans_journal)
+
+    state_file = Path(t.state_file)
+    state = syncstate.load_state(state_file)
+
+    matching_children = postsync.find_matching_children(
+        tc, tb, refresh=options.refresh_children)
+    postsync.copy_posts_since_mark(
+        tc, tb, matching_children, state,
+        margin=timedelta(days=config.margin_days),
+        initial_window=timedelta(days=config.initial_days),
+        options=options)
+    syncstate.save_state(state_file, state)
+
+
+# Most requests one tenant has in flight to one service at once: the clients'
+# own concurrent lookups, or the post being copied plus the searches of the
+# posts whose photos are being prefetched. Per-child feeds read one page per
+# child at a time, and a family has fewer children than the clients' limit.
+def connections_per_tenant(options: postsync.SyncOptions) -> int:
+    return max(tcclient.MAX_CONCURRENT_REQUESTS,
+               tbclient.MAX_CONCURRENT_REQUESTS,
+               options.prefetch_photos + 1)
+
+
+# Sync every tenant, several at a time. Returns the names of tenants that
+# failed; a failure doesn't stop the others.
+def sync_all_tenants(config: TenantsConfig,
+                     options: postsync.SyncOptions) -> list[str]:
+    # One pool of connections for all tenants. Connections are keyed by
+    # host, so each service gets up to `pool_maxsize` of them.
+    shared_adapter = requests.adapters.HTTPAdapter(
+        pool_maxsize=config.max_concurrent_tenants *
+        connections_per_tenant(options))
+
+    def run(t: Tenant) -> str | None:
+        synclog.prefix.set(f'[{t.name}] ')
+        synclog.log('starting')
+        try:
+            sync_tenant(t, config, shared_adapter, options)
+        except Exception as e:
+            synclog.log(f'FAILED: {e!r}')
+            return t.name
+        synclog.log('done')
+        return None
+
+    with ThreadPoolExecutor(config.max_concurrent_tenants) as executor:
+        results = list(executor.map(run, config.tenants))
+
+    return [name for name in results if name is not None]
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta, timezone
+import functools
+import pathlib
+import sqlite3
+import threading
+
+import cachefiles
+from urlfunctions import trim_url
+
+
+# How long an uploaded object stays usable for `create_entry`. The bucket's
+# real retention isn't published, so stay well inside what we've seen work.
+UPLOAD_MAX_AGE = timedelta(days=1)
+
+
+# Remembers which photos we've already uploaded to Tinybeans' bucket, so a
+# run that dies between uploading and creating the entry doesn't upload the
+# same bytes again next time. Once an entry is created from an upload, call
+# `forget` so no other entry is created from the same object.
+class UploadCache:
+    db: sqlite3.Connection
+    lock: threading.Lock
+
+    def __init__(self, path: pathlib.Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # shared between sync threads, so serialize access ourselves
+        self.db = sqlite3.connect(path, check_same_thread=False,
+                                  isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS Uploads (
+                content_sha256 TEXT NOT NULL,
+                photo_url TEXT NOT NULL,
+                remote_file_name TEXT NOT NULL,
+                uploaded_at TEXT NOT NULL
+            );
+
+            CREATE INDEX IF NOT EXISTS UploadsByHash
+                ON Uploads (content_sha256, uploaded_at);
+            CREATE INDEX IF NOT EXISTS UploadsByUrl
+                ON Uploads (photo_url, uploaded_at);
+        """)
+
+        self.db.execute("""
+            DELETE FROM Uploads
+            WHERE uploaded_at < :not_before
+            """, {
+            'not_before': self._not_before(),
+        })
+
+    @staticmethod
+    def _not_before() -> str:
+        return (datetime.now(timezone.utc) - UPLOAD_MAX_AGE).isoformat()
+
+    def _find(self, column: str, value: str) -> str | None:
+        with self.lock:
+            r = self.db.execute(f"""
+                SELECT remote_file_name
+                FROM Uploads
+                WHERE {column} = :value AND uploaded_at >= :not_before
+                ORDER BY uploaded_at DESC
+                LIMIT 1
+                """, {
+                'value': value,
+                'not_before': self._not_before(),
+            }).fetchone()
+        return r['remote_file_name'] if r else None
+
+    # Photo URLs are presigned; only the part before the signature is
+    # stable between listings.
+    def by_photo_url(self, url: str) -> str | None:
+        return self._find('photo_url', trim_url(url))
+
+    def by_content_hash(self, content_sha256: str) -> str | None:
+        return self._find('content_sha256', content_sha256)
+
+    def record(self, url: str, content_sha256: str, remote_file_name: str):
+        with self.lock:
+            self.db.execute("""
+                INSERT INTO Uploads (content_sha256, photo_url,
+                                     remote_file_name, uploaded_at)
+                VALUES (:content_sha256, :photo_url, :remote_file_name, :now)
+                """, {
+                'content_sha256': content_sha256,
+                'photo_url': trim_url(url),
+                'remote_file_name': remote_file_name,
+                'now': datetime.now(timezone.utc).isoformat(),
+            })
+
+    # An entry was created from `remote_file_name`, so it can't be reused.
+    def forget(self, remote_file_name: str):
+        with self.lock:
+            self.db.execute("""
+                DELETE FROM Uploads
+                WHERE remote_file_name = :remote_file_name
+                """, {
+                'remote_file_name': remote_file_name,
+            })
+
+
+@functools.cache
+def default_upload_cache() -> UploadCache:
+    return UploadCache(cachefiles.cache_dir().joinpath('uploads.sqlite'))
@@ -0,0 +1,33 @@
+import unittest
+
+from httpmetrics import endpoint_of
+
+
+class EndpointOfTest(unittest.TestCase):
+    def test_api_ids(self):
+        self.assertEqual(
+            endpoint_of('https://www.transparentclassroom.com/s/123/posts.json'
+                        '?page=2'),
+            ('www.transparentclassroom.com', '/s/{id}/posts.json'))
+        self.assertEqual(
+            endpoint_of('https://tinybeans.com/api/1/journals/4567/entries'),
+            ('tinybeans.com', '/api/1/journals/{id}/entries'))
+
+    def test_uuid(self):
+        self.assertEqual(
+            endpoint_of('https://tinybeans.com/api/1/entries/'
+                        '0f8fad5b-d9cb-469f-a165-70867728950e'),
+            ('tinybeans.com', '/api/1/entries/{uuid}'))
+
+    # Each blob would otherwise be its own series.
+    def test_blob_names_next_to_underscores(self):
+        self.assertEqual(
+            endpoint_of('https://cdn.tinybeans.com/123/91b7584a2265b1f5_o.jpg'),
+            ('cdn.tinybeans.com', '/{id}/{hex}_o.jpg'))
+        self.assertEqual(
+            endpoint_of('https://cdn.tinybeans.com/123/456_o.jpg'),
+            ('cdn.tinybeans.com', '/{id}/{id}_o.jpg'))
+
+
+if __name__ == '__main__':
+    unittest.main()
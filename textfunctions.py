@@ -0,0 +1,8 @@
+# `rows` as aligned columns, the first left-aligned and the rest
+# right-aligned, for numbers. The first row is usually headings.
+def format_table(rows: list[tuple[str, ...]]) -> str:
+    widths = [max(len(r[i]) for r in rows) for i in range(len(rows[0]))]
+    return '\n'.join(
+        '  '.join(cell.ljust(w) if i == 0 else cell.rjust(w)
+                  for i, (cell, w) in enumerate(zip(row, widths)))
+        for row in rows)
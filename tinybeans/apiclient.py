@@ -1,12 +1,16 @@
-from datetime import datetime
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 from functools import partial
 import os
+import time
 from typing import cast, Literal
 
 import apischema
-import dotenv
 import requests
 
+import cachefiles
+import httpmetrics
 from . import apitypes
 from . import websiteconfig
 
@@ -14,24 +18,62 @@ from . import websiteconfig
 deserialize = partial(apischema.deserialize, additional_properties=True)
 serialize = partial(apischema.serialize, exclude_none=True)
 
+# Built once up front for the responses we read most, rather than looked up
+# on every call.
+deserialize_entries = apischema.deserialization_method(
+    apitypes.ListEntriesResponse, additional_properties=True)
+deserialize_entry_summaries = apischema.deserialization_method(
+    apitypes.ListEntrySummariesResponse, additional_properties=True)
+deserialize_search = apischema.deserialization_method(
+    apitypes.SearchResponse, additional_properties=True)
 
-dotenv.load_dotenv()
 
+API_BASE = 'https://tinybeans.com/api/1'
 
-class TinybeansClient:
-    session: requests.Session
-    journal_id: int
+# How long journal metadata -- titles, owners, children -- is reused before
+# we ask the server again.
+JOURNAL_CACHE_MAX_AGE = timedelta(days=1)
+
+# Most requests we make in parallel to the API from one client.
+MAX_CONCURRENT_REQUESTS = 8
 
-    def __init__(self, username: str, password: str):
-        self.session = requests.Session()
+# Page size for `search_all`. This is what the webapp uses; we don't know
+# whether the server would allow more.
+SEARCH_MAX_RESULTS_PER_PAGE = 72
 
-        access_token = self._get_access_token(username, password)
-        self.session.headers['authorization'] = access_token
 
-    # returns: access token, an opaque string that happens to be GUID-shaped
-    def _get_access_token(self, username: str, password: str) -> str:
+class TinybeansClient:
+    api_base: str
+    session: requests.Session
+    user: apitypes.UserWithEmail
+
+    # Journal metadata, each with the `time.monotonic()` it was fetched. When
+    # `persist_journal_cache` is set, it's also kept on disk between runs.
+    persist_journal_cache: bool
+    _journals: tuple[float, list[apitypes.Journal]] | None
+    _journal_details: dict[int, tuple[float, apitypes.Journal]]
+
+    def __init__(self, username: str, password: str,
+                 session: requests.Session | None = None,
+                 persist_journal_cache: bool = False,
+                 api_base: str = API_BASE):
+        self.session = httpmetrics.instrument_session(
+            session or requests.Session())
+        self.api_base = api_base
+        self.persist_journal_cache = persist_journal_cache
+        self._journals = None
+        self._journal_details = {}
+
+        o = self._authenticate(username, password)
+        self.user = o.user
+        self.session.headers['authorization'] = o.accessToken
+
+    # response includes the access token, an opaque string that happens to be
+    # GUID-shaped
+    def _authenticate(self, username: str, password: str
+                      ) -> apitypes.AuthenticateResponse:
         r = self.session.post(
-            'https://tinybeans.com/api/1/authenticate',
+            f'{self.api_base}/authenticate',
             json={
                 'username': username,
                 'password': password,
@@ -44,16 +86,46 @@ class TinybeansClient:
 
         o = deserialize(apitypes.AuthenticateResponse, r.json())
         assert(o.status == 'ok')
-        return o.accessToken
+        return o
 
+    def _cache_key(self, *parts) -> str:
+        return '.'.join(str(p) for p in [self.user.id, *parts])
+
+    # always asks the server, and refreshes the cache used by
+    # `cached_journals`
     def get_journals(self) -> list[apitypes.Journal]:
-        r = self.session.get('https://tinybeans.com/api/1/journals')
+        r = self.session.get(f'{self.api_base}/journals')
         r.raise_for_status()
 
         o = deserialize(apitypes.ListJournalsResponse, r.json())
         assert(o.status == 'ok')
 
+        self._journals = (time.monotonic(), o.journals)
+        if self.persist_journal_cache:
+            cachefiles.store('tinybeans_journals', self._cache_key(),
+                             serialize(o.journals))
+
         return o.journals
+
+    def cached_journals(self, refresh: bool = False
+                        ) -> list[apitypes.Journal]:
+        if not refresh:
+            if self._journals is not None:
+                fetched_at, journals = self._journals
+                if (time.monotonic() - fetched_at <
+                        JOURNAL_CACHE_MAX_AGE.total_seconds()):
+                    return journals
+
+            if self.persist_journal_cache:
+                cached = cachefiles.load('tinybeans_journals',
+                                         self._cache_key(),
+                                         JOURNAL_CACHE_MAX_AGE)
+                if cached is not None:
+                    journals = deserialize(list[apitypes.Journal], cached)
+                    self._journals = (time.monotonic(), journals)
+                    return journals
+
+        return self.get_journals()
     
     def journal(self, journal_ref: str | int | None) -> 'TinybeansJournal':
         def parses_as_int(s: str):
@@ -66,20 +138,28 @@ class TinybeansClient:
         if journal_ref is None:
             journal_ref = os.getenv('TINYBEANS_DEFAULT_JOURNAL', None)
 
+        def journal_id_for_title(journals: list[apitypes.Journal],
+                                 title: str) -> int | None:
+            for j in journals:
+                if j.title == title:
+                    return j.id
+            return None
+
         match journal_ref:
             case None:
-                journal_id = self.get_journals()[0].id
+                journal_id = self.cached_journals()[0].id
             case int(journal_id): pass
             case str(journal_id_str) if parses_as_int(journal_id_str):
                 journal_id = int(journal_id_str)
             case str(journal_title):
-                for j in self.get_journals():
-                    if j.title == journal_title:
-                        journal_id = j.id
-                        break
-                else:  # runs if loop ends normally, i.e. no "break"
+                # a miss might just mean the cache is out of date
+                journal_id = (
+                    journal_id_for_title(self.cached_journals(), journal_title)
+                    or journal_id_for_title(self.cached_journals(refresh=True),
+                                            journal_title))
+                if journal_id is None:
                     raise ValueError('no journal with that name')
-            
+
         return TinybeansJournal(self, journal_id)
 
 
@@ -91,20 +171,46 @@ class TinybeansJournal:
         self.client = client
         self.journal_id = journal_id
 
-    def get_details(self) -> apitypes.Journal:
-        r = self.client.session.get(
-            f'https://tinybeans.com/api/1/journals/{self.journal_id}')
+    def get_details(self, refresh: bool = False) -> apitypes.Journal:
+        client = self.client
+        cache_key = client._cache_key(self.journal_id)
+
+        if not refresh:
+            if self.journal_id in client._journal_details:
+                fetched_at, journal = client._journal_details[self.journal_id]
+                if (time.monotonic() - fetched_at <
+                        JOURNAL_CACHE_MAX_AGE.total_seconds()):
+                    return journal
+
+            if client.persist_journal_cache:
+                cached = cachefiles.load('tinybeans_journal_details',
+                                         cache_key, JOURNAL_CACHE_MAX_AGE)
+                if cached is not None:
+                    journal = deserialize(apitypes.Journal, cached)
+                    client._journal_details[self.journal_id] = (
+                        time.monotonic(), journal)
+                    return journal
+
+        r = client.session.get(
+            f'{client.api_base}/journals/{self.journal_id}')
         r.raise_for_status()
 
         o = deserialize(apitypes.GetJournalResponse, r.json())
         assert(o.status == 'ok')
 
+        client._journal_details[self.journal_id] = (time.monotonic(), o.journal)
+        if client.persist_journal_cache:
+            cachefiles.store('tinybeans_journal_details', cache_key,
+                             serialize(o.journal))
+
         return o.journal
 
-    def get_entries(self, year: int, month: int, day: int | None = None
-                    ) -> list[apitypes.EntryWithComments]:
+    # Without `with_comments`, entries come back as plain `Entry`s, which is
+    # quicker when all you need is captions and ordering.
+    def get_entries(self, year: int, month: int, day: int | None = None,
+                    with_comments: bool = True) -> list[apitypes.Entry]:
         r = self.client.session.get(
-            f'https://tinybeans.com/api/1/journals/{self.journal_id}/entries',
+            f'{self.client.api_base}/journals/{self.journal_id}/entries',
             params={
                 'year': year,
                 'month': month,
@@ -113,29 +219,50 @@ class TinybeansJournal:
             }))
         r.raise_for_status()
 
-        o = deserialize(apitypes.ListEntriesResponse, r.json())
+        o = (deserialize_entries if with_comments
+             else deserialize_entry_summaries)(r.json())
         assert(o.status == 'ok')
 
-        if len(o.entries) > 0 and day is not None:
-            entries = o.entries
-
-            # Check we have the right idea for how entries are sorted within a
-            # day. At last check, unless there's a pinned entry, the webapp just
-            # uses the first entry returned by the server as the day's cover;
-            # the server, in turn, manages the sort order to choose the "right"
-            # cover. Elsewhere we rely on knowing which picture gets picked, so
-            # we have these checks here to surprise us if the order changes.
-
-            def sort_key(e: apitypes.Entry):
-                # Entries are sorted by sortOrder ascending, where present,
-                # or else by descending timestamp. It's possible for some
-                # entries in a day to have sortOrder and others not to.
-                return (e.sortOrder if e.sortOrder is not None else -1,
-                        -e.timestamp)
-            assert(entries == sorted(entries, key=sort_key))
+        if day is not None:
+            check_day_sort_order(o.entries)
 
         return o.entries
 
+    # Entries from `since` to `until` inclusive, oldest day first. Within a
+    # day, entries keep the order the month listing returns them in, which
+    # isn't known to be the cover order `get_entries` checks for a day.
+    def get_entries_range(self, since: date, until: date,
+                          with_comments: bool = True
+                          ) -> Iterator[apitypes.Entry]:
+        by_day = self.get_entries_by_day(since, until, with_comments)
+        for _, entries in sorted(by_day.items()):
+            yield from entries
+
+    # Fetches every month in the range at once, then splits them up by day.
+    # See `get_entries_range` about the order within a day.
+    def get_entries_by_day(self, since: date, until: date,
+                           with_comments: bool = True
+                           ) -> dict[date, list[apitypes.Entry]]:
+        months = []
+        year, month = since.year, since.month
+        while (year, month) <= (until.year, until.month):
+            months.append((year, month))
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+        with ThreadPoolExecutor(MAX_CONCURRENT_REQUESTS) as executor:
+            pages = executor.map(
+                lambda ym: self.get_entries(*ym, with_comments=with_comments),
+                months)
+
+            by_day: dict[date, list[apitypes.Entry]] = {}
+            for entries in pages:
+                for e in entries:
+                    d = date(e.year, e.month, e.day)
+                    if since <= d <= until:
+                        by_day.setdefault(d, []).append(e)
+
+        return by_day
+
     # sort orders:
     #   'DD' -- date descending
     #   'DA' -- date ascending
@@ -143,9 +270,18 @@ class TinybeansJournal:
     def search(self, keywords: str, sort_order: Literal['DD', 'DA']  = 'DD',
                page: int = 1, results_per_page: int = 10
                ) -> list[apitypes.Entry]:
+        o = self.search_page(keywords, sort_order, page, results_per_page)
 
+        if o.entries is None:
+            return []
+        return o.entries
+
+    # like `search`, but also returns the total number of matches
+    def search_page(self, keywords: str, sort_order: Literal['DD', 'DA'],
+                    page: int, results_per_page: int
+                    ) -> apitypes.SearchResponse:
         r = self.client.session.get(
-            f'https://tinybeans.com/api/1/journals/{self.journal_id}/search',
+            f'{self.client.api_base}/journals/{self.journal_id}/search',
             params={
                 'term': keywords,
                 'sort': sort_order,
@@ -154,17 +290,34 @@ class TinybeansJournal:
             })
         r.raise_for_status()
 
-        o = deserialize(apitypes.SearchResponse, r.json())
+        o = deserialize_search(r.json())
         assert(o.status == 'ok')
 
-        if o.entries is None:
-            return []
-        return o.entries
+        return o
+
+    # Every match, in order. The first page tells us how many pages there
+    # are; we fetch the rest all at once.
+    def search_all(self, keywords: str,
+                   sort_order: Literal['DD', 'DA'] = 'DD'
+                   ) -> Iterator[apitypes.Entry]:
+        per_page = SEARCH_MAX_RESULTS_PER_PAGE
+
+        first = self.search_page(keywords, sort_order, 1, per_page)
+        yield from first.entries or []
+
+        page_count = -(-first.count // per_page)  # round up
+        with ThreadPoolExecutor(MAX_CONCURRENT_REQUESTS) as executor:
+            later = executor.map(
+                lambda page: self.search_page(keywords, sort_order, page,
+                                              per_page),
+                range(2, page_count + 1))
+            for o in later:
+                yield from o.entries or []
 
     # caller needs to upload any photo themselves and set remoteFileName
     def create_entry(self, entry: apitypes.EntryForCreate) -> apitypes.Entry:
         r = self.client.session.post(
-            f'https://tinybeans.com/api/1/journals/{self.journal_id}/entries',
+            f'{self.client.api_base}/journals/{self.journal_id}/entries',
             json=serialize(entry))
         r.raise_for_status()
 
@@ -197,15 +350,37 @@ class TinybeansJournal:
             update_entry.children = [id_of(c) for c in entry.children]
 
         r = self.client.session.post(
-            f'https://tinybeans.com/api/1/journals/{self.journal_id}'
+            f'{self.client.api_base}/journals/{self.journal_id}'
             f'/entries/{entry.id}',
             json=serialize(update_entry))
         r.raise_for_status()
 
 
+# Check we have the right idea for how entries are sorted within a day. At
+# last check, unless there's a pinned entry, the webapp just uses the first
+# entry returned by the server as the day's cover; the server, in turn,
+# manages the sort order to choose the "right" cover. Elsewhere we rely on
+# knowing which picture gets picked, so we have these checks here to surprise
+# us if the order changes.
+def check_day_sort_order(entries: list[apitypes.Entry]):
+    def sort_key(e: apitypes.Entry):
+        # Entries are sorted by sortOrder ascending, where present,
+        # or else by descending timestamp. It's possible for some
+        # entries in a day to have sortOrder and others not to.
+        return (e.sortOrder if e.sortOrder is not None else -1,
+                -e.timestamp)
+    assert(entries == sorted(entries, key=sort_key))
+
+
 def default_client():
     username = os.getenv('TINYBEANS_USERNAME')
     password = os.getenv('TINYBEANS_PASSWORD')
     assert username and password, 'set TINYBEANS_USERNAME and TINYBEANS_PASSWORD'
 
-    return TinybeansClient(username, password)
+    # e.g. a local stand-in server, see `bench/`
+    api_base = os.getenv('TINYBEANS_API_BASE', API_BASE)
+
+    # Each CLI command is a fresh process, so only a cache on disk saves
+    # round trips.
+    return TinybeansClient(username, password, persist_journal_cache=True,
+                           api_base=api_base)
@@ -2,7 +2,7 @@ from dataclasses import dataclass, field
 from typing import Literal
 
 
-@dataclass
+@dataclass(slots=True)
 class User:
     id: int
 
@@ -16,7 +16,7 @@ class User:
     hasMemoriesAccess: bool
 
 
-@dataclass
+@dataclass(slots=True)
 class UserWithEmail(User):
     username: str
     emailAddress: str
@@ -24,14 +24,14 @@ class UserWithEmail(User):
 
 # POST https://tinybeans.com/api/1/authenticate
 # request body (JSON): username, password, clientId
-@dataclass
+@dataclass(slots=True)
 class AuthenticateResponse:
     status: str
     user: UserWithEmail
     accessToken: str  # usually guid-shaped
 
 
-@dataclass
+@dataclass(slots=True)
 class Child:
     id: int
 
@@ -47,7 +47,7 @@ class Child:
     user: User
 
 
-@dataclass
+@dataclass(slots=True)
 class Journal:
     id: int
 
@@ -60,7 +60,7 @@ class Journal:
 
 
 # https://tinybeans.com/api/1/journals
-@dataclass
+@dataclass(slots=True)
 class ListJournalsResponse:
     status: str
     journals: list[Journal]
@@ -68,13 +68,13 @@ class ListJournalsResponse:
 
 # https://tinybeans.com/api/1/journals/123
 # 123 = journal id
-@dataclass
+@dataclass(slots=True)
 class GetJournalResponse:
     status: str
     journal: Journal
 
 
-@dataclass
+@dataclass(slots=True)
 class Comment:
     id: int
     entryId: int
@@ -90,12 +90,12 @@ class Comment:
     repliesCount: int
 
 
-@dataclass
+@dataclass(slots=True)
 class ChildId:
     childId: int
 
 
-@dataclass
+@dataclass(slots=True)
 class Blobs:
     o: str
     o2: str
@@ -108,7 +108,7 @@ class Blobs:
 
 
 # https://github.com/mmdriley/kidstuff/blob/0e6e75ef8c3568a56cba7c7f4ed133ec892ab0d4/websites/tinybeans/tinybeans-frontend/models/entry.js#L2
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, slots=True)
 class Entry:
     id: int
     journalId: int
@@ -146,7 +146,7 @@ class Entry:
     attachmentUrl_webm: str | None = None
 
 
-@dataclass
+@dataclass(slots=True)
 class EntryWithComments(Entry):
     totalCommentsCount: int
     comments: list[Comment] = field(default_factory=list)
@@ -155,16 +155,24 @@ class EntryWithComments(Entry):
 # https://tinybeans.com/api/1/journals/123/entries
 # 123 = journal id
 # query params: year, month, day
-@dataclass
+@dataclass(slots=True)
 class ListEntriesResponse:
     status: str
     entries: list[EntryWithComments] = field(default_factory=list)
 
 
+# Same endpoint, read without comments. Comments are most of the work of
+# deserializing a busy day, and most callers never look at them.
+@dataclass(slots=True)
+class ListEntrySummariesResponse:
+    status: str
+    entries: list[Entry] = field(default_factory=list)
+
+
 # https://tinybeans.com/api/1/entries/123/uuid/aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee
 # 123 = entry id
 # aaa = entry guid
-@dataclass
+@dataclass(slots=True)
 class GetEntryResponse:
     status: str
     entry: EntryWithComments
@@ -174,7 +182,7 @@ class GetEntryResponse:
 # 123 = journal id
 # query params: term, sort, page, length
 # - sort: 'DA' (date-ascending) or 'DD' (date-descending)
-@dataclass
+@dataclass(slots=True)
 class SearchResponse:
     status: str
     count: int
@@ -183,7 +191,7 @@ class SearchResponse:
 
 # the fields of Entry above populated on create
 # TODO: bring this into some hierarchy with Entry?
-@dataclass
+@dataclass(slots=True)
 class EntryForCreate:
     year: int
     month: int
@@ -202,7 +210,7 @@ class EntryForCreate:
     privateMode: bool | None = None
 
 
-@dataclass
+@dataclass(slots=True)
 class CreateEntryResponse:
     status: str
     entry: Entry
@@ -210,7 +218,7 @@ class CreateEntryResponse:
 
 # fields of Entry sent for update, see:
 # https://github.com/mmdriley/kidstuff/blob/7d9748c324058df145ee3fddec929d2a9fbd0512/websites/tinybeans/tinybeans-frontend/services/tinybeans-backend.js#L251-L265
-@dataclass
+@dataclass(slots=True)
 class EntryForUpdate:
     year: int
     month: int
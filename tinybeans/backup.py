@@ -0,0 +1,179 @@
+from concurrent.futures import as_completed, ThreadPoolExecutor
+import dataclasses
+import datetime
+import json
+import pathlib
+import shutil
+import sqlite3
+import urllib.parse
+
+import requests
+from tqdm import tqdm
+
+import httpmetrics
+from . import apitypes
+from .apiclient import TinybeansJournal
+
+
+MAX_CONCURRENT_DOWNLOADS = 8
+
+# Downloads are streamed to disk in pieces this big, so memory use doesn't
+# grow with video size.
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def db_init(path: pathlib.Path) -> sqlite3.Connection:
+    db_conn = sqlite3.connect(path, isolation_level='IMMEDIATE')
+    db_conn.row_factory = sqlite3.Row
+
+    db_conn.executescript("""
+        CREATE TABLE IF NOT EXISTS Entries (
+            id INTEGER PRIMARY KEY,
+            last_updated INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            entry_json TEXT NOT NULL,
+            first_seen TEXT NOT NULL,
+            last_seen TEXT NOT NULL
+        );
+
+        CREATE INDEX IF NOT EXISTS EntriesByDate ON Entries (date);
+    """)
+
+    return db_conn
+
+
+# The entries that are new or changed since we last stored them.
+def changed_entries(db: sqlite3.Connection,
+                    entries: list[apitypes.EntryWithComments]
+                    ) -> list[apitypes.EntryWithComments]:
+    known = {
+        r['id']: r['last_updated'] for r in db.execute("""
+            SELECT id, last_updated
+            FROM Entries
+            """)
+    }
+    return [e for e in entries
+            if known.get(e.id, -1) < e.lastUpdatedTimestamp]
+
+
+def store_entries(db: sqlite3.Connection,
+                  entries: list[apitypes.EntryWithComments], now: str):
+    for e in entries:
+        db.execute("""
+            INSERT INTO Entries (id, last_updated, date, entry_json,
+                                 first_seen, last_seen)
+            VALUES (:id, :last_updated, :date, :entry_json, :now, :now)
+            ON CONFLICT(id) DO UPDATE
+            SET last_updated = :last_updated,
+                date = :date,
+                entry_json = :entry_json,
+                last_seen = :now
+            """, {
+            'id': e.id,
+            'last_updated': e.lastUpdatedTimestamp,
+            'date': f'{e.year:04}-{e.month:02}-{e.day:02}',
+            # apischema can't serialize `Entry`'s `Literal` unions, but every
+            # field is plain data anyway
+            'entry_json': json.dumps(dataclasses.asdict(e), sort_keys=True),
+            'now': now,
+        })
+
+
+# (url, path relative to the backup) for each file worth keeping from `e`
+def entry_files(e: apitypes.Entry) -> list[tuple[str, pathlib.Path]]:
+    def suffix_of(url: str) -> str:
+        return pathlib.PurePosixPath(urllib.parse.urlparse(url).path).suffix
+
+    directory = pathlib.Path(f'{e.year:04}', f'{e.month:02}')
+
+    files = []
+    if e.type == 'PHOTO' and e.blobs.o:
+        files.append((e.blobs.o,
+                      directory.joinpath(f'{e.id}_o{suffix_of(e.blobs.o)}')))
+    if e.attachmentUrl_mp4:
+        files.append((e.attachmentUrl_mp4,
+                      directory.joinpath(f'{e.id}.mp4')))
+    return files
+
+
+def download_file(session: requests.Session, url: str,
+                  final_path: pathlib.Path):
+    # Invariant: file exists at final path only if it was downloaded
+    # successfully and completely.
+    temp_path = final_path.with_name(final_path.name + '.unfinished')
+    final_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with session.get(url, stream=True) as r:
+        r.raise_for_status()
+        with temp_path.open('wb') as f:
+            shutil.copyfileobj(r.raw, f, DOWNLOAD_CHUNK_SIZE)
+    temp_path.replace(final_path)
+
+
+def backup_journal(journal: TinybeansJournal, base_path: pathlib.Path,
+                   since: datetime.date, until: datetime.date):
+    base_path.mkdir(parents=True, exist_ok=True)
+    db = db_init(base_path.joinpath('entries.sqlite'))
+    now = datetime.datetime.now(
+        datetime.timezone.utc).isoformat(timespec='milliseconds')
+
+    # Listing is cheap next to downloading, and the API can't list only
+    # what changed, so we always list everything and use
+    # `lastUpdatedTimestamp` to decide which entries need their files.
+    entries = list(journal.get_entries_range(since, until))
+    changed = changed_entries(db, entries)
+    print(f'{len(entries)} entries, {len(changed)} new or changed')
+
+    # A changed entry is only stored once its files are, so if the photo was
+    # replaced and the new one fails to download, the next run still sees
+    # the entry as changed and tries again.
+    changed_ids = set(e.id for e in changed)
+    store_entries(db, [e for e in entries if e.id not in changed_ids], now)
+    db.commit()
+
+    # Fetch files for changed entries in case the photo was replaced, and for
+    # any other entry whose files an earlier run failed to download.
+    files = []
+    for e in entries:
+        for url, relative_path in entry_files(e):
+            final_path = base_path.joinpath('blobs', relative_path)
+            if e.id in changed_ids or not final_path.exists():
+                files.append((e.id, url, final_path))
+
+    # Blob URLs don't want our API credentials, so use a separate session.
+    session = httpmetrics.instrument_session(requests.Session())
+    failed_ids = set()
+    failures = 0
+    with ThreadPoolExecutor(MAX_CONCURRENT_DOWNLOADS) as executor:
+        futures = {
+            executor.submit(download_file, session, url, final_path):
+                (id, url)
+            for id, url, final_path in files
+        }
+        for f in tqdm(as_completed(futures), total=len(futures)):
+            id, url = futures[f]
+            try:
+                f.result()
+            except requests.RequestException as e:
+                print(f'FAIL: {url} ({e})')
+                failed_ids.add(id)
+                failures += 1
+
+    store_entries(db, [e for e in changed if e.id not in failed_ids], now)
+    db.commit()
+
+    print(f'{len(files) - failures} files downloaded, {failures} failed')
+    db.close()
+
+
+# Earliest day the journal could have entries for: when it was created, or
+# the birth of its oldest child if that's earlier.
+def journal_start_date(journal: TinybeansJournal) -> datetime.date:
+    details = journal.get_details()
+    start = datetime.date.fromtimestamp(details.timestamp / 1000)
+    for c in details.children:
+        try:
+            start = min(start, datetime.date.fromisoformat(c.dob))
+        except ValueError:
+            pass
+    return start
@@ -1,5 +1,6 @@
 from dataclasses import dataclass
 from datetime import datetime
+import pathlib
 import pprint
 from typing import Protocol
 
@@ -8,6 +9,7 @@ from colors import bold, underline
 
 from . import apiclient
 from . import apitypes
+from . import backup as tbbackup
 
 
 @click.group()
@@ -76,7 +78,7 @@ def short_caption(caption: str) -> str:
     return caption.replace('\n', '')[:50]
 
 
-def print_cover(entries: list[apitypes.EntryWithComments]):
+def print_cover(entries: list[apitypes.Entry]):
     if len(entries) == 0:
         print(f'cover photo: NONE (no entries)')
         return
@@ -130,14 +132,70 @@ def get_entries(journal: str | None, interval: str):
 
 @tb.command()
 @click.option('--journal', type=str, default=None)
+@click.option('--since', type=click.DateTime(['%Y-%m-%d']), required=True)
+@click.option('--until', type=click.DateTime(['%Y-%m-%d']), required=True)
+def get_entries_range(journal: str | None, since: datetime, until: datetime):
+    """Summarize each day in a range, both endpoints inclusive"""
+    c = apiclient.default_client()
+    j = c.journal(journal)
+
+    by_day = j.get_entries_by_day(since.date(), until.date(),
+                                  with_comments=False)
+
+    if len(by_day) == 0:
+        print('no entries in that interval')
+        return
+
+    # Covers depend on the order within a day, which only day listings are
+    # known to keep. Check a day against its own listing before trusting the
+    # month listings for the rest.
+    sample = next((d for d, entries in sorted(by_day.items())
+                   if len(entries) > 1), None)
+    if sample is not None:
+        day_entries = j.get_entries(sample.year, sample.month, sample.day,
+                                    with_comments=False)
+        if [e.id for e in day_entries] != [e.id for e in by_day[sample]]:
+            print('month listings are out of cover order; listing each day')
+            by_day = {d: j.get_entries(d.year, d.month, d.day,
+                                       with_comments=False)
+                      for d in by_day}
+
+    for day, entries in sorted(by_day.items()):
+        print(bold(f'{day} ({len(entries)} entries)'))
+        print_cover(entries)
+
+
+@tb.command()
+@click.option('--journal', type=str, default=None)
+@click.option('--all', 'all_pages', is_flag=True,
+              help='Show every match, not just the first page.')
 @click.argument('keywords')
-def search(journal: str | None, keywords: str):
+def search(journal: str | None, all_pages: bool, keywords: str):
     c = apiclient.default_client()
-    r = c.journal(journal).search(keywords)
+    j = c.journal(journal)
+    r = j.search_all(keywords) if all_pages else j.search(keywords)
 
     for e in r:
         print(e.caption)
 
 
+@tb.command()
+@click.option('--journal', type=str, default=None)
+@click.option('--dest', type=click.Path(file_okay=False,
+                                        path_type=pathlib.Path),
+              default='TinybeansBackup', show_default=True)
+@click.option('--since', type=click.DateTime(['%Y-%m-%d']),
+              help='Default: when the journal or its oldest child started.')
+def backup(journal: str | None, dest: pathlib.Path, since: datetime | None):
+    """Mirror entries and their photos and videos to local disk"""
+    c = apiclient.default_client()
+    j = c.journal(journal)
+
+    since_date = (since.date() if since is not None
+                  else tbbackup.journal_start_date(j))
+    tbbackup.backup_journal(j, dest.resolve(), since_date,
+                            datetime.now().date())
+
+
 if __name__ == '__main__':
     tb()
@@ -1,5 +1,6 @@
-import functools
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
+import threading
 import typing
 import uuid
 
@@ -9,8 +10,17 @@ import botocore.config
 from . import websiteconfig
 
 
-@functools.cache
-def authenticated_aws_session() -> boto3.Session:
+# Cognito credentials expire after an hour. Long-running processes replace
+# them this long before they run out.
+CREDENTIALS_REFRESH_MARGIN = timedelta(minutes=5)
+
+# Connections kept open to S3, shared by every thread uploading through
+# `s3_client()`.
+S3_MAX_POOL_CONNECTIONS = 20
+
+
+# returns: the session and when its credentials expire
+def authenticated_aws_session() -> tuple[boto3.Session, datetime]:
     aws_config = botocore.config.Config(
         region_name = websiteconfig.aws_region,
     )
@@ -29,7 +39,27 @@ def authenticated_aws_session() -> boto3.Session:
         aws_secret_access_key=aws_credentials['SecretKey'],
         aws_session_token=aws_credentials['SessionToken'])
 
-    return authenticated_session
+    return authenticated_session, aws_credentials['Expiration']
+
+
+_s3_client_lock = threading.Lock()
+_s3_client = None
+_s3_client_expiration: datetime | None = None
+
+
+# An S3 client with current credentials. Reused across uploads so its
+# connections stay warm, and replaced shortly before its credentials expire.
+def s3_client():
+    global _s3_client, _s3_client_expiration
+
+    with _s3_client_lock:
+        now = datetime.now(timezone.utc)
+        if (_s3_client_expiration is None or
+                now >= _s3_client_expiration - CREDENTIALS_REFRESH_MARGIN):
+            session, _s3_client_expiration = authenticated_aws_session()
+            _s3_client = session.client('s3', config=botocore.config.Config(
+                max_pool_connections=S3_MAX_POOL_CONNECTIONS))
+        return _s3_client
 
 
 def upload_picture_file(filename: Path) -> str:
@@ -39,8 +69,7 @@ def upload_picture_file(filename: Path) -> str:
 
 # suffix e.g. '.jpg'
 def upload_picture_fileobj(binaryfile: typing.BinaryIO, suffix: str) -> str:
-    aws_s = authenticated_aws_session()
-    s3 = aws_s.client('s3')
+    s3 = s3_client()
 
     # ref: https://github.com/mmdriley/kidstuff/blob/72664feb/websites/tinybeans/tinybeans-frontend/services/rest-backend.js#L157
     key = str(uuid.uuid4()) + suffix
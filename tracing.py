@@ -0,0 +1,306 @@
+from contextlib import contextmanager
+import contextvars
+import cProfile
+from dataclasses import dataclass, field
+import json
+import os
+from pathlib import Path
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+
+from filefunctions import write_atomically
+from textfunctions import format_table
+
+
+# Timing for the stages of a run, e.g. each step of copying a post. Code marks
+# stages with `span(...)`; when nothing is tracing, that costs next to
+# nothing. `TracedRun` collects spans for a whole command, prints where the
+# time went, and writes them as a Chrome trace (open in chrome://tracing or
+# https://ui.perfetto.dev).
+
+
+# How many of the slowest posts the summary breaks down.
+SLOWEST_POSTS = 5
+
+# How many allocation sites the memory report lists.
+TOP_ALLOCATIONS = 30
+
+
+@dataclass(slots=True)
+class Span:
+    name: str
+
+    # `time.perf_counter_ns()`
+    start: int
+    end: int
+
+    thread_id: int
+
+    # index of the enclosing span in `Tracer.spans`, if any
+    parent: int | None
+
+    # the post this span was working on, inherited from enclosing spans
+    post: int | None
+
+    args: dict = field(default_factory=dict)
+
+    @property
+    def seconds(self) -> float:
+        return (self.end - self.start) / 1e9
+
+
+# (index in `Tracer.spans` of the innermost open span, its post)
+_current: contextvars.ContextVar[tuple[int | None, int | None]] = \
+    contextvars.ContextVar('current_span', default=(None, None))
+
+_tracer: 'Tracer | None' = None
+_run: 'TracedRun | None' = None
+
+
+# Time the enclosed block as stage `name`. Pass `post=` on the outermost span
+# for a post so the summary can break time down per post; other keyword
+# arguments show up in the trace viewer.
+@contextmanager
+def span(name: str, post: int | None = None, **args):
+    tracer = _tracer
+    if tracer is None:
+        yield
+        return
+
+    parent, parent_post = _current.get()
+    if post is None:
+        post = parent_post
+
+    index = tracer.open(Span(name=name, start=time.perf_counter_ns(), end=0,
+                             thread_id=threading.get_ident(), parent=parent,
+                             post=post, args=args))
+    token = _current.set((index, post))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+        tracer.close(index)
+
+
+@dataclass
+class StageStats:
+    count: int = 0
+    seconds: float = 0
+
+    # excluding time in nested spans
+    self_seconds: float = 0
+
+    durations: list[float] = field(default_factory=list)
+
+
+class Tracer:
+    lock: threading.Lock
+    origin: int
+    spans: list[Span]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter_ns()
+        self.spans = []
+
+    def open(self, s: Span) -> int:
+        with self.lock:
+            self.spans.append(s)
+            return len(self.spans) - 1
+
+    def close(self, index: int):
+        self.spans[index].end = time.perf_counter_ns()
+
+    # spans that have ended, by index
+    def finished_spans(self) -> dict[int, Span]:
+        with self.lock:
+            return {i: s for i, s in enumerate(self.spans) if s.end}
+
+    # finished spans, each with its time excluding nested spans
+    def spans_with_self_seconds(self) -> list[tuple[Span, float]]:
+        spans = self.finished_spans()
+
+        children_seconds: dict[int, float] = {}
+        for s in spans.values():
+            if s.parent is not None:
+                children_seconds[s.parent] = \
+                    children_seconds.get(s.parent, 0) + s.seconds
+
+        return [(s, s.seconds - children_seconds.get(i, 0))
+                for i, s in spans.items()]
+
+    def stages(self) -> dict[str, StageStats]:
+        stages: dict[str, StageStats] = {}
+        for s, self_seconds in self.spans_with_self_seconds():
+            st = stages.setdefault(s.name, StageStats())
+            st.count += 1
+            st.seconds += s.seconds
+            st.self_seconds += self_seconds
+            st.durations.append(s.seconds)
+        return stages
+
+    # post -> stage -> seconds, excluding nested spans, so each post's
+    # stages add up to its total
+    def posts(self) -> dict[int, dict[str, float]]:
+        posts: dict[int, dict[str, float]] = {}
+        for s, self_seconds in self.spans_with_self_seconds():
+            if s.post is None:
+                continue
+            by_stage = posts.setdefault(s.post, {})
+            by_stage[s.name] = by_stage.get(s.name, 0) + self_seconds
+        return posts
+
+    def summary(self) -> str:
+        elapsed = (time.perf_counter_ns() - self.origin) / 1e9
+
+        rows = [('stage', 'count', 'total s', 'self s', '% run', 'mean ms',
+                 'p95 ms', 'max ms')]
+        stages = sorted(self.stages().items(),
+                        key=lambda item: item[1].self_seconds, reverse=True)
+        for name, st in stages:
+            ordered = sorted(st.durations)
+            p95 = ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+            rows.append((
+                name, str(st.count), f'{st.seconds:.2f}',
+                f'{st.self_seconds:.2f}',
+                f'{100 * st.self_seconds / elapsed:.0f}',
+                f'{st.seconds / st.count * 1000:.0f}',
+                f'{p95 * 1000:.0f}', f'{ordered[-1] * 1000:.0f}'))
+
+        lines = [format_table(rows), '', f'run: {elapsed:.2f}s']
+
+        posts = self.posts()
+        post_seconds = {post: sum(by_stage.values())
+                        for post, by_stage in posts.items()}
+        if post_seconds:
+            lines.append(
+                f'posts: {len(post_seconds)}, '
+                f'median {statistics.median(post_seconds.values()):.2f}s, '
+                f'max {max(post_seconds.values()):.2f}s')
+
+            slowest = sorted(post_seconds, key=post_seconds.get,
+                             reverse=True)[:SLOWEST_POSTS]
+            for post in slowest:
+                breakdown = ', '.join(
+                    f'{name} {seconds:.2f}s' for name, seconds in sorted(
+                        posts[post].items(), key=lambda item: item[1],
+                        reverse=True))
+                lines.append(
+                    f'  post {post}: {post_seconds[post]:.2f}s ({breakdown})')
+
+        return '\n'.join(lines)
+
+    # https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU
+    def chrome_trace(self) -> dict:
+        pid = os.getpid()
+        thread_ids: dict[int, int] = {}
+
+        events = []
+        for s in self.finished_spans().values():
+            # small numbers read better in the viewer than raw thread idents
+            tid = thread_ids.setdefault(s.thread_id, len(thread_ids) + 1)
+            args = s.args if s.post is None else s.args | {'post': s.post}
+            events.append({
+                'name': s.name,
+                'ph': 'X',
+                'ts': (s.start - self.origin) / 1000,
+                'dur': (s.end - s.start) / 1000,
+                'pid': pid,
+                'tid': tid,
+                'args': args,
+            })
+
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+# Traces a whole command into `trace_file`. With `profile`, also runs it
+# under cProfile and tracemalloc and writes their results next to the trace:
+# `<trace>.prof` (for `python -m pstats` or snakeviz) and `<trace>.memory.txt`.
+class TracedRun:
+    trace_file: Path
+    tracer: Tracer
+    profiler: cProfile.Profile | None
+
+    def __init__(self, trace_file: Path, profile: bool = False):
+        self.trace_file = trace_file
+        self.tracer = Tracer()
+        self.profiler = cProfile.Profile() if profile else None
+
+    @property
+    def profile_file(self) -> Path:
+        return self.trace_file.with_suffix('.prof')
+
+    @property
+    def memory_file(self) -> Path:
+        return self.trace_file.with_suffix('.memory.txt')
+
+    def start(self):
+        global _tracer, _run
+        assert _tracer is None, 'already tracing'
+        _tracer = self.tracer
+        _run = self
+
+        if self.profiler is not None:
+            tracemalloc.start()
+            self.profiler.enable()
+
+    def finish(self):
+        global _tracer, _run
+
+        if self.profiler is not None:
+            self.profiler.disable()
+
+        _tracer = None
+        _run = None
+
+        self.write()
+
+        if self.profiler is not None:
+            tracemalloc.stop()
+
+    # Write out what's been traced so far, as `finish` does, and collect
+    # spans afresh, so memory doesn't grow. Spans still open are dropped.
+    def checkpoint(self):
+        global _tracer
+
+        self.write()
+
+        self.tracer = Tracer()
+        _tracer = self.tracer
+
+        if self.profiler is not None:
+            # `dump_stats` stopped it
+            self.profiler.enable()
+
+    def write(self):
+        print(self.tracer.summary(), file=sys.stderr)
+
+        write_atomically(self.trace_file,
+                         json.dumps(self.tracer.chrome_trace()))
+        print(f'trace: {self.trace_file}', file=sys.stderr)
+
+        if self.profiler is not None:
+            # `dump_stats` wants a path, not a file
+            self.profiler.dump_stats(self.profile_file)
+            print(f'profile: {self.profile_file}', file=sys.stderr)
+
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            lines = [f'current {current / 1e6:.1f} MB, '
+                     f'peak {peak / 1e6:.1f} MB', '']
+            lines += [str(s) for s in
+                      snapshot.statistics('lineno')[:TOP_ALLOCATIONS]]
+            report = '\n'.join(lines) + '\n'
+            write_atomically(self.memory_file, report)
+            print(f'memory: {self.memory_file}', file=sys.stderr)
+
+
+# For commands that never finish, e.g. `sync watch`: between rounds of work,
+# write out the traced run's results so far and start afresh. Does nothing
+# when not tracing.
+def checkpoint():
+    if _run is not None:
+        _run.checkpoint()
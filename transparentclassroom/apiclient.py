@@ -1,29 +1,48 @@
-from collections.abc import Iterable
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Executor, ThreadPoolExecutor
 import functools
+import heapq
 import re
 import os
 
 import apischema
 import requests
 
+import httpmetrics
+from tracing import span
 from . import apitypes
 
 
 deserialize = functools.partial(apischema.deserialize, additional_properties=True)
+# Post listings are most of what we read, so build that one once.
+deserialize_posts = apischema.deserialization_method(
+    list[apitypes.Post], additional_properties=True)
 API_BASE = 'https://www.transparentclassroom.com'
 
 CHILD_ID_REGEX = re.compile(r'/s/\d+/children/(\d+)')
 CLASSROOM_ID_REGEX = re.compile(r'/s/\d+/users\?classroom_id=(\d+)')
 
+# Most requests we make in parallel to the API from one client.
+MAX_CONCURRENT_REQUESTS = 8
+
+
 class TransparentClassroomClient:
+    api_base: str
     session: requests.Session
     user_info: apitypes.UserInfo
 
-    def __init__(self, username: str, password: str):
+    def __init__(self, username: str, password: str,
+                 session: requests.Session | None = None,
+                 api_base: str = API_BASE):
         # Create a session that will have the right authentication header for
         # all requests. As an added bonus, using a session gets us connection
         # keep-alive.
-        self.session = requests.Session()
+        #
+        # Callers can pass their own session, e.g. to share a connection pool
+        # between clients.
+        self.session = httpmetrics.instrument_session(
+            session or requests.Session())
+        self.api_base = api_base
 
         self.user_info = self._authenticate(username, password)
         self.session.headers.update({
@@ -32,7 +51,7 @@ class TransparentClassroomClient:
 
     def _authenticate(self, username: str, password: str) -> apitypes.UserInfo:
         r = self.session.get(
-            f'{API_BASE}/api/v1/authenticate.json', auth=(username, password))
+            f'{self.api_base}/api/v1/authenticate.json', auth=(username, password))
         r.raise_for_status()
 
         return deserialize(apitypes.UserInfo, r.json())
@@ -49,7 +68,7 @@ class TransparentClassroomClient:
         #   - includes links to each of their childrens' pages
         #   - is shown as part of the "Directory" view and has links to the other
         #     classrooms that the user has access to
-        r = self.session.get(f'{API_BASE}/s/{self.school_id}/users/{self.user_info.id}')
+        r = self.session.get(f'{self.api_base}/s/{self.school_id}/users/{self.user_info.id}')
         r.raise_for_status()
 
         # Get the child and classroom IDs, then load each classroom to figure out
@@ -59,9 +78,10 @@ class TransparentClassroomClient:
 
         children = []
 
-        for classroom_id in classroom_ids:
-            all_children = self.children_in_classroom(classroom_id)
-            children += [c for c in all_children if c.id in child_ids]
+        with ThreadPoolExecutor(MAX_CONCURRENT_REQUESTS) as executor:
+            for all_children in executor.map(self.children_in_classroom,
+                                             classroom_ids):
+                children += [c for c in all_children if c.id in child_ids]
 
         # Check we found all the children.
         assert len(children) == len(child_ids)
@@ -70,67 +90,140 @@ class TransparentClassroomClient:
 
     def children_in_classroom(self, classroom_id: int) -> list[apitypes.Child]:
         r = self.session.get(
-            f'{API_BASE}/s/{self.school_id}/classrooms/{classroom_id}/children.json')
+            f'{self.api_base}/s/{self.school_id}/classrooms/{classroom_id}/children.json')
         r.raise_for_status()
 
         return deserialize(list[apitypes.Child], r.json())
 
     def all_child_posts_one_page(self, page: int) -> list[apitypes.Post]:
-        # for just one child:
-        # {API_BASE}/s/{school_id}/children/{child_id}/posts.json?page={page}
-        r = self.session.get(
-            f'{API_BASE}/s/{self.school_id}/posts.json?page={page}')
-        r.raise_for_status()
-
-        return deserialize(list[apitypes.Post], r.json())
-
-    def all_child_posts(self) -> Iterable[apitypes.Post]:
-        # Number of posts in a "full" page from `posts.json`.
-        #
-        # Derived empirically. It's also hardcoded in the mobile app and the
-        # website: when they see fewer than 30 posts on a page, they stop
-        # listing.
-        #
-        # The `posts.json` endpoint *seems* to accept a `per_page` argument, but
-        # setting it to any value -- even the apparent default of 30 -- causes
-        # it to return a 500 error.
-        POSTS_PER_FULL_PAGE = 30
-
-        page = 1
-        prev_sort_key = None
-        while True:
-            page_of_posts = self.all_child_posts_one_page(page)
-            assert len(page_of_posts) <= POSTS_PER_FULL_PAGE, (
-                f'page has {len(page_of_posts)} posts, '
-                f'expected no more than {POSTS_PER_FULL_PAGE}')
-
-            for p in page_of_posts:
-                sort_key = (p.date, p.created_at)
-                if prev_sort_key:
-                    # Check that posts come sorted the way we expect.
-                    #
-                    # We've seen a legitimate case of "equal". At that point
-                    # there's no obvious guarantee of order, although it's
-                    # empirically *not* by ID.
-                    assert sort_key <= prev_sort_key
-                prev_sort_key = sort_key
-
+        with span('posts page', page=page):
+            r = self.session.get(
+                f'{self.api_base}/s/{self.school_id}/posts.json?page={page}')
+            r.raise_for_status()
+
+            return deserialize_posts(r.json())
+
+    def child_posts_one_page(self, child_id: int, page: int
+                             ) -> list[apitypes.Post]:
+        with span('posts page', child=child_id, page=page):
+            r = self.session.get(
+                f'{self.api_base}/s/{self.school_id}/children/{child_id}'
+                f'/posts.json?page={page}')
+            r.raise_for_status()
+
+            return deserialize_posts(r.json())
+
+    # With `child_ids`, reads each child's own feed instead of the
+    # school-wide one, all at once, and merges them. A post that tags several
+    # of the children appears once.
+    def all_child_posts(self, child_ids: Iterable[int] | None = None
+                        ) -> Iterable[apitypes.Post]:
+        if child_ids is None:
+            yield from _paginated_posts(self.all_child_posts_one_page)
+            return
+
+        child_ids = list(child_ids)
+        with ThreadPoolExecutor(len(child_ids) or 1) as executor:
+            feeds = [
+                _paginated_posts(
+                    functools.partial(self.child_posts_one_page, child_id),
+                    prefetch=executor)
+                for child_id in child_ids]
+
+            seen_ids = set()
+            for p in heapq.merge(*feeds, key=_post_sort_key, reverse=True):
+                if p.id in seen_ids:
+                    continue
+                seen_ids.add(p.id)
                 yield p
 
-            if len(page_of_posts) < POSTS_PER_FULL_PAGE:
-                break
-
-            page = page + 1
-
+    # At most a page of IDs: the response is paginated like any other
+    # listing, so more could come back with some missing.
     def posts_by_id(self, ids: Iterable[int]) -> list[apitypes.Post]:
+        ids = list(ids)
+        assert len(ids) <= POSTS_PER_FULL_PAGE, (
+            f'{len(ids)} IDs, expected no more than {POSTS_PER_FULL_PAGE}')
+
         r = self.session.get(
-            f'{API_BASE}/s/{self.school_id}/posts.json',
+            f'{self.api_base}/s/{self.school_id}/posts.json',
             params={
                 'ids[]': ids,
             })
         r.raise_for_status()
 
-        return deserialize(list[apitypes.Post], r.json())
+        return deserialize_posts(r.json())
+
+    # Like `posts_by_id` for any number of IDs, split into several requests
+    # made at once. IDs that aren't found are missing from the result.
+    def posts_by_id_batched(self, ids: Iterable[int]
+                            ) -> dict[int, apitypes.Post]:
+        ids = list(ids)
+        chunks = [ids[i:i + POSTS_PER_FULL_PAGE]
+                  for i in range(0, len(ids), POSTS_PER_FULL_PAGE)]
+
+        posts = {}
+        with ThreadPoolExecutor(MAX_CONCURRENT_REQUESTS) as executor:
+            for page in executor.map(self.posts_by_id, chunks):
+                posts |= {p.id: p for p in page}
+
+        return posts
+
+
+# Number of posts in a "full" page from `posts.json`.
+#
+# Derived empirically. It's also hardcoded in the mobile app and the
+# website: when they see fewer than 30 posts on a page, they stop
+# listing.
+#
+# The `posts.json` endpoint *seems* to accept a `per_page` argument, but
+# setting it to any value -- even the apparent default of 30 -- causes
+# it to return a 500 error.
+POSTS_PER_FULL_PAGE = 30
+
+
+def _post_sort_key(p: apitypes.Post) -> tuple[str, str]:
+    return (p.date, p.created_at)
+
+
+# Yields posts from successive pages of `get_page` until a page isn't full.
+# With `prefetch`, the next page is requested while callers work through
+# this one.
+def _paginated_posts(get_page: Callable[[int], list[apitypes.Post]],
+                     prefetch: Executor | None = None
+                     ) -> Iterator[apitypes.Post]:
+    page = 1
+    next_page = prefetch.submit(get_page, page) if prefetch else None
+    prev_sort_key = None
+    while True:
+        if next_page is not None:
+            page_of_posts = next_page.result()
+        else:
+            page_of_posts = get_page(page)
+        assert len(page_of_posts) <= POSTS_PER_FULL_PAGE, (
+            f'page has {len(page_of_posts)} posts, '
+            f'expected no more than {POSTS_PER_FULL_PAGE}')
+
+        is_last_page = len(page_of_posts) < POSTS_PER_FULL_PAGE
+        if prefetch and not is_last_page:
+            next_page = prefetch.submit(get_page, page + 1)
+
+        for p in page_of_posts:
+            sort_key = _post_sort_key(p)
+            if prev_sort_key:
+                # Check that posts come sorted the way we expect.
+                #
+                # We've seen a legitimate case of "equal". At that point
+                # there's no obvious guarantee of order, although it's
+                # empirically *not* by ID.
+                assert sort_key <= prev_sort_key
+            prev_sort_key = sort_key
+
+            yield p
+
+        if is_last_page:
+            break
+
+        page = page + 1
 
 
 @functools.cache
@@ -139,4 +232,7 @@ def default_client() -> TransparentClassroomClient:
     password = os.getenv('TRANSPARENT_CLASSROOM_PASSWORD')
     assert username and password, 'set TRANSPARENT_CLASSROOM_USERNAME and TRANSPARENT_CLASSROOM_PASSWORD'
 
-    return TransparentClassroomClient(username, password)
+    # e.g. a local stand-in server, see `bench/`
+    api_base = os.getenv('TRANSPARENT_CLASSROOM_API_BASE', API_BASE)
+
+    return TransparentClassroomClient(username, password, api_base=api_base)
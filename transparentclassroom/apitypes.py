@@ -1,11 +1,26 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Literal
+import functools
 
 from apischema import validator
 
+
+# The same few dates turn up on every post of a day, and properties below
+# get read over and over, so remember what we've parsed. `datetime`s are
+# immutable, so sharing them is safe.
+@functools.lru_cache(maxsize=4096)
+def parse_date(s: str) -> datetime:
+    return datetime.strptime(s, '%Y-%m-%d')
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_created_at(s: str) -> datetime:
+    # ISO 8601
+    return datetime.strptime(s, '%Y-%m-%dT%H:%M:%S.%f%z')
+
+
 # Response from `authenticate.json`
-@dataclass
+@dataclass(slots=True)
 class UserInfo:
     id: int
 
@@ -19,7 +34,7 @@ class UserInfo:
 
 
 # One child from `classroom/nnn/children.json`
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, slots=True)
 class Child:
     id: int
 
@@ -38,15 +53,15 @@ class Child:
 
 
 # One post from `posts.json`
-@dataclass
+@dataclass(slots=True)
 class Post:
     id: int
-    created_at: str = field()
+    created_at: str
 
     classroom_id: int
 
     author: str
-    date: str = field()
+    date: str
 
     html: str
     normalized_text: str
@@ -59,17 +74,22 @@ class Post:
 
     @property
     def date_as_datetime(self) -> datetime:
-        return datetime.strptime(self.date, '%Y-%m-%d')
+        return parse_date(self.date)
 
     @property
     def created_at_as_datetime(self) -> datetime:
-        # ISO 8601
-        return datetime.strptime(self.created_at, '%Y-%m-%dT%H:%M:%S.%f%z')
+        return parse_created_at(self.created_at)
+
+
+# Validators are registered outside the class body: `slots=True` replaces the
+# class, which would leave validators declared inside it attached to the
+# discarded original.
+
+@validator('date')
+def check_date_format(post: Post):
+    post.date_as_datetime
 
-    @validator(date)
-    def check_date_format(self):
-        self.date_as_datetime
 
-    @validator(created_at)
-    def check_created_at_format(self):
-        self.created_at_as_datetime
+@validator('created_at')
+def check_created_at_format(post: Post):
+    post.created_at_as_datetime
@@ -3,26 +3,32 @@
 import argparse
 import asyncio
 from collections import Counter
+from dataclasses import dataclass
 import datetime
-import functools
 import json
 import os
 import pathlib
 import sqlite3
 import sys
-from typing import Iterator, List
-import urllib.parse
+from typing import AsyncIterator, Iterable, Iterator, List, TYPE_CHECKING
 
 import apischema
 from apischema import serialize
 import dotenv
 import requests
 
+import httpmetrics
+import tracing
+from tracing import span
+from urlfunctions import trim_url
 from . import apitypes
-from .download import DownloadItem, download_urls
 from . import apiclient as TC
 from .postfunctions import all_class_post_confidence
 
+if TYPE_CHECKING:
+    # imported when needed, since they pull in aiohttp
+    from .download import Downloader, DownloadItem
+
 
 SCRIPT_START_TIME = datetime.datetime.now(
     datetime.timezone.utc).isoformat(timespec='milliseconds')
@@ -33,8 +39,13 @@ SCRIPT_START_TIME = datetime.datetime.now(
 LOW_DATE_SENTINEL = '0100-01-01'
 
 
-deserialize = functools.partial(apischema.deserialize,
-                                additional_properties=True)
+# When refreshing from the API, assume we already have all posts dated more
+# than this long before the newest `created_at` value we've previously seen.
+OLD_POST_MARGIN = datetime.timedelta(days=7)
+
+
+deserialize_post = apischema.deserialization_method(
+    apitypes.Post, additional_properties=True)
 
 
 # TODO: announcements have photos too
@@ -50,50 +61,45 @@ def newest_post_created_at(db: sqlite3.Connection) -> str:
     return r['newest_post_date'] or LOW_DATE_SENTINEL
 
 
-def trim_url(url: str) -> str:
-    parsed_url = urllib.parse.urlparse(url)
-    query_params = urllib.parse.parse_qs(parsed_url.query)
-    for p in ['X-Amz-Algorithm',
-              'X-Amz-Credential',
-              'X-Amz-Date',
-              'X-Amz-Expires',
-              'X-Amz-SignedHeaders',
-              'X-Amz-Signature']:
-        if p in query_params:
-            del query_params[p]
-    return urllib.parse.urlunparse(parsed_url._replace(
-        query=urllib.parse.urlencode(query_params, doseq=True)))
+# Return the newest version of each post dated between `since` and `until`
+# (inclusive, 'YYYY-MM-DD'), sorted the same way as `posts.json`.
+def posts_in_date_range(db: sqlite3.Connection, since: str, until: str
+                        ) -> Iterator[apitypes.Post]:
+    # SQLite guarantees the bare `post_json` column comes from the row that
+    # supplied MAX(last_seen), i.e. the most recently seen version of the post.
+    c = db.execute("""
+        SELECT post_json, MAX(last_seen)
+        FROM Posts
+        WHERE JSON_EXTRACT(post_json, '$.date') BETWEEN :since AND :until
+        GROUP BY JSON_EXTRACT(post_json, '$.id')
+        ORDER BY
+            JSON_EXTRACT(post_json, '$.date') DESC,
+            JSON_EXTRACT(post_json, '$.created_at') DESC
+        """, {
+        'since': since,
+        'until': until,
+    })
 
+    for r in c:
+        yield deserialize_post(json.loads(r['post_json']))
 
-def retrieve_school_posts(db: sqlite3.Connection, not_before_date: str = LOW_DATE_SENTINEL):
-    for p in TC.default_client().all_child_posts():
-        if p.date < not_before_date:
-            break
 
-        # TODO: is it better to trim up these URLs or remove them entirely?
-        # either way the URL is useless for *downloading*.
-        # 
-        # TODO 2: actually the stripped URLs work for downloading as of this
-        # writing.
-        for f in ['photo_url',
-                  'medium_photo_url',
-                  'large_photo_url',
-                  'original_photo_url']:
-            s = getattr(p, f)
-            if s is not None:
-                setattr(p, f, trim_url(s))
-
-        db.execute("""
-            INSERT INTO Posts (post_json, first_seen, last_seen)
-            VALUES (:post_json, :now, :now)
-            ON CONFLICT(post_json) DO UPDATE
-            SET last_seen = :now
-            """, {
-            # sort keys for canonical representation
-            'post_json': json.dumps(serialize(p, exclude_none=True), sort_keys=True),
-            'now': SCRIPT_START_TIME,
-        })
+# Fetch and store new posts, then continue the backfill of older ones if it
+# isn't done. With `downloader`, each post's photos are queued as soon as it's
+# stored.
+async def retrieve_school_posts(db: sqlite3.Connection,
+                                not_before_date: str = LOW_DATE_SENTINEL,
+                                downloader: 'Downloader | None' = None):
+    with span('retrieve posts'):
+        async for p in ingest_posts(db, TC.default_client(), not_before_date):
+            if downloader is not None:
+                for item in post_photo_items(p):
+                    await downloader.add(item)
+
+    print_new_post_count(db)
 
+
+def print_new_post_count(db: sqlite3.Connection):
     r = db.execute("""
             SELECT SUM(first_seen = :now) AS new_this_run
             FROM Posts
@@ -104,6 +110,184 @@ def retrieve_school_posts(db: sqlite3.Connection, not_before_date: str = LOW_DAT
     print()
 
 
+# Record each of `posts`, newest first, until one is dated before
+# `not_before_date`. A post we already have unchanged just gets its
+# `last_seen` bumped; a changed post is stored as a new version.
+def store_posts(db: sqlite3.Connection, posts: Iterable[apitypes.Post],
+                not_before_date: str = LOW_DATE_SENTINEL,
+                now: str = SCRIPT_START_TIME):
+    for p in posts:
+        if p.date < not_before_date:
+            break
+        store_post(db, p, now)
+
+
+# How far the first, deep walk through a school's `posts.json` has got. It
+# can take a long time, so it's saved after each page and picked up where it
+# stopped by the next run.
+@dataclass
+class BackfillProgress:
+    # next page to read
+    next_page: int = 1
+
+    # `date` and `created_at` of the oldest post stored so far, i.e. the
+    # last one read, since pages go newest first
+    oldest_date: str | None = None
+    oldest_created_at: str | None = None
+
+    # reached the last page
+    complete: bool = False
+
+
+def load_backfill_progress(db: sqlite3.Connection, school_id: int
+                           ) -> BackfillProgress:
+    r = db.execute("""
+        SELECT next_page, oldest_date, oldest_created_at, complete
+        FROM BackfillProgress
+        WHERE school_id = :school_id
+        """, {
+        'school_id': school_id,
+    }).fetchone()
+
+    if r is None:
+        # Archives from before we kept progress were filled in one go, so
+        # assume one with any posts is complete.
+        has_posts = db.execute('SELECT 1 FROM Posts LIMIT 1').fetchone()
+        return BackfillProgress(complete=has_posts is not None)
+
+    return BackfillProgress(next_page=r['next_page'],
+                            oldest_date=r['oldest_date'],
+                            oldest_created_at=r['oldest_created_at'],
+                            complete=bool(r['complete']))
+
+
+def save_backfill_progress(db: sqlite3.Connection, school_id: int,
+                           progress: BackfillProgress):
+    db.execute("""
+        INSERT INTO BackfillProgress (school_id, next_page, oldest_date,
+                                      oldest_created_at, complete, updated_at)
+        VALUES (:school_id, :next_page, :oldest_date, :oldest_created_at,
+                :complete, :now)
+        ON CONFLICT(school_id) DO UPDATE
+        SET next_page = :next_page,
+            oldest_date = :oldest_date,
+            oldest_created_at = :oldest_created_at,
+            complete = :complete,
+            updated_at = :now
+        """, {
+        'school_id': school_id,
+        'next_page': progress.next_page,
+        'oldest_date': progress.oldest_date,
+        'oldest_created_at': progress.oldest_created_at,
+        'complete': progress.complete,
+        'now': SCRIPT_START_TIME,
+    })
+
+
+# Store new posts from the head of the school's feed, back to
+# `not_before_date`, then carry on with the backfill if it isn't complete.
+# Commits after every page, so an interrupted run loses at most one. Pages
+# are fetched in a worker thread, so the event loop keeps going meanwhile,
+# e.g. with photo downloads. Yields each post once it's stored.
+async def ingest_posts(db: sqlite3.Connection,
+                       tc: TC.TransparentClassroomClient,
+                       not_before_date: str = LOW_DATE_SENTINEL
+                       ) -> AsyncIterator[apitypes.Post]:
+    progress = load_backfill_progress(db, tc.school_id)
+
+    # A first run's backfill starts from page 1 anyway.
+    if progress.complete or progress.next_page > 1:
+        page = 1
+        while True:
+            posts = await asyncio.to_thread(tc.all_child_posts_one_page, page)
+            new = [p for p in posts if p.date >= not_before_date]
+
+            for p in new:
+                store_post(db, p)
+            db.commit()
+            for p in new:
+                yield p
+
+            if len(new) < len(posts) or \
+                    len(posts) < TC.POSTS_PER_FULL_PAGE:
+                break
+            page += 1
+
+    if not progress.complete:
+        async for p in backfill_posts(db, tc, progress):
+            yield p
+
+
+def _sort_key(p: apitypes.Post) -> tuple[str, str]:
+    return (p.date, p.created_at)
+
+
+async def backfill_posts(db: sqlite3.Connection,
+                         tc: TC.TransparentClassroomClient,
+                         progress: BackfillProgress
+                         ) -> AsyncIterator[apitypes.Post]:
+    page = progress.next_page
+    posts = await asyncio.to_thread(tc.all_child_posts_one_page, page)
+
+    # Since the last run, new posts will have pushed older ones to later
+    # pages, which only means reading some again. Deleted posts would pull
+    # them to earlier pages, though, so step back until the page reaches
+    # back to the oldest post we stored and nothing is skipped.
+    if progress.oldest_date is not None:
+        oldest = (progress.oldest_date, progress.oldest_created_at)
+        while page > 1 and (not posts or _sort_key(posts[0]) < oldest):
+            page -= 1
+            posts = await asyncio.to_thread(tc.all_child_posts_one_page,
+                                            page)
+
+    while True:
+        for p in posts:
+            store_post(db, p)
+
+        if posts:
+            progress.oldest_date = posts[-1].date
+            progress.oldest_created_at = posts[-1].created_at
+        progress.next_page = page + 1
+        progress.complete = len(posts) < TC.POSTS_PER_FULL_PAGE
+        save_backfill_progress(db, tc.school_id, progress)
+        db.commit()
+
+        for p in posts:
+            yield p
+
+        if progress.complete:
+            return
+        page += 1
+        posts = await asyncio.to_thread(tc.all_child_posts_one_page, page)
+
+
+def store_post(db: sqlite3.Connection, p: apitypes.Post,
+               now: str = SCRIPT_START_TIME):
+    # TODO: is it better to trim up these URLs or remove them entirely?
+    # either way the URL is useless for *downloading*.
+    # 
+    # TODO 2: actually the stripped URLs work for downloading as of this
+    # writing.
+    for f in ['photo_url',
+              'medium_photo_url',
+              'large_photo_url',
+              'original_photo_url']:
+        s = getattr(p, f)
+        if s is not None:
+            setattr(p, f, trim_url(s))
+
+    db.execute("""
+        INSERT INTO Posts (post_json, first_seen, last_seen)
+        VALUES (:post_json, :now, :now)
+        ON CONFLICT(post_json) DO UPDATE
+        SET last_seen = :now
+        """, {
+        # sort keys for canonical representation
+        'post_json': json.dumps(serialize(p, exclude_none=True), sort_keys=True),
+        'now': now,
+    })
+
+
 def all_posts(db: sqlite3.Connection) -> Iterator[apitypes.Post]:
     # TODO: handle potential duplicate versions by ID
     c = db.execute("""
@@ -115,26 +299,76 @@ def all_posts(db: sqlite3.Connection) -> Iterator[apitypes.Post]:
     """)
 
     for r in c:
-        yield deserialize(apitypes.Post, json.loads(r['post_json']))
+        yield deserialize_post(json.loads(r['post_json']))
+
+
+# How many posts in each classroom have each all-class confidence score,
+# keyed by (classroom_id, confidence).
+def classification_report(db: sqlite3.Connection) -> Counter[tuple[int, int]]:
+    lls = []
+    for p in all_posts(db):
+        c = all_class_post_confidence(p.html)
+        # if c == 9 and p['classroom_id'] == 1141:
+        #     print(json.dumps(p, indent=2))
+        lls.append((p.classroom_id, c))
+        # if c == 8:
+        #     print(p['html'])
+
+    return Counter(lls)
 
 
 async def download_post_photos(posts: Iterator[apitypes.Post], target_path: pathlib.Path):
-    download_items = []
+    # aiohttp is slow to import and only needed here, so don't make everyone
+    # who reads the archive pay for it
+    from .download import download_urls
 
+    download_items = []
     for p in posts:
-        # skip text-only posts
-        if not p.photo_url or not p.original_photo_url:
-            continue
+        download_items += post_photo_items(p)
+
+    with span('download photos', items=len(download_items)):
+        await download_urls(download_items, target_path)
+
+
+# What to download for `p`'s photos.
+def post_photo_items(p: apitypes.Post) -> list['DownloadItem']:
+    from .download import DownloadItem
+
+    # skip text-only posts
+    if not p.photo_url or not p.original_photo_url:
+        return []
 
-        # TODO: is `id` unique enough here or should I include namespacing, e.g. photo{id}
-        # actually, will probably solve this by downloading into different *directories*
+    # TODO: is `id` unique enough here or should I include namespacing, e.g. photo{id}
+    # actually, will probably solve this by downloading into different *directories*
 
-        download_items += [
-            DownloadItem(f'{p.id}', p.photo_url),
-            DownloadItem(f'{p.id}_original', p.original_photo_url),
-        ]
+    return [
+        DownloadItem(f'{p.id}', p.photo_url),
+        DownloadItem(f'{p.id}_original', p.original_photo_url),
+    ]
 
-    await download_urls(download_items, target_path)
+
+# Fetch new posts and store them, like `retrieve_school_posts`, while
+# downloading the photos of each one as soon as it's stored. Then download any
+# photos of posts already in the archive that we don't have yet.
+async def retrieve_school_posts_and_photos(db: sqlite3.Connection,
+                                           target_path: pathlib.Path,
+                                           not_before_date: str | None):
+    from .download import Downloader
+    from .verify import clear_redownloaded
+
+    with span('retrieve posts and photos'):
+        async with Downloader(target_path) as downloader:
+            if not_before_date is not None:
+                await retrieve_school_posts(db, not_before_date, downloader)
+
+            # cheap for photos we have, which are skipped without a request
+            for p in all_posts(db):
+                for item in post_photo_items(p):
+                    await downloader.add(item)
+
+        # e.g. files `verify-archive` found broken
+        clear_redownloaded(db, target_path)
+        db.commit()
 
 
 def download_announcements(s: requests.Session, school_id: int, base_path: pathlib.Path):
@@ -195,6 +429,15 @@ def parse_announcements(announcements):
     print(f'{len(announcements)} announcements')
 
 
+# For readers of an archive `db_init` created, e.g. sync. Doesn't create
+# anything or take the write lock, so it can't get in a running archiver's
+# way.
+def db_open_readonly(path: pathlib.Path) -> sqlite3.Connection:
+    db_conn = sqlite3.connect(f'{path.resolve().as_uri()}?mode=ro', uri=True)
+    db_conn.row_factory = sqlite3.Row
+    return db_conn
+
+
 def db_init(path: pathlib.Path) -> sqlite3.Connection:
     db_conn = sqlite3.connect(path, isolation_level='IMMEDIATE')
     db_conn.row_factory = sqlite3.Row
@@ -206,6 +449,41 @@ def db_init(path: pathlib.Path) -> sqlite3.Connection:
             last_seen TEXT NOT NULL
         );
 
+        -- Expressions must match the queries above exactly to be used.
+        CREATE INDEX IF NOT EXISTS PostsByDate ON Posts (
+            JSON_EXTRACT(post_json, '$.date'),
+            JSON_EXTRACT(post_json, '$.created_at')
+        );
+        CREATE INDEX IF NOT EXISTS PostsByCreatedDate ON Posts (
+            DATE(JSON_EXTRACT(post_json, '$.created_at'))
+        );
+
+        -- One row per school, see `BackfillProgress`.
+        CREATE TABLE IF NOT EXISTS BackfillProgress (
+            school_id INTEGER PRIMARY KEY,
+            next_page INTEGER NOT NULL,
+            oldest_date TEXT,
+            oldest_created_at TEXT,
+            complete INTEGER NOT NULL,
+            updated_at TEXT NOT NULL
+        );
+
+        -- Photos as of their last verification, see `verify.py`.
+        CREATE TABLE IF NOT EXISTS PhotoManifest (
+            filename TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            verified_at TEXT NOT NULL
+        );
+
+        -- Photos that failed verification, until they're downloaded again.
+        CREATE TABLE IF NOT EXISTS RedownloadQueue (
+            filename TEXT PRIMARY KEY,
+            problem TEXT NOT NULL,
+            queued_at TEXT NOT NULL
+        );
+
         CREATE TABLE IF NOT EXISTS Announcements (
             announcement_json NOT NULL UNIQUE,
             first_seen TEXT NOT NULL,
@@ -219,6 +497,24 @@ def db_init(path: pathlib.Path) -> sqlite3.Connection:
 async def main(args):
     dotenv.load_dotenv()
 
+    if args.metrics is not None:
+        metrics = httpmetrics.HttpMetrics()
+        httpmetrics.add_sink(metrics)
+    if args.profile and args.trace is None:
+        args.trace = pathlib.Path('archiver-trace.json')
+    if args.trace is not None:
+        run = tracing.TracedRun(args.trace, profile=args.profile)
+        run.start()
+    try:
+        await archive(args)
+    finally:
+        if args.trace is not None:
+            run.finish()
+        if args.metrics is not None:
+            metrics.report(args.metrics, job='archiver')
+
+
+async def archive(args):
     base_path = pathlib.Path('TransparentClassroomArchive').resolve()
     base_path.mkdir(exist_ok=True)
 
@@ -233,38 +529,32 @@ async def main(args):
     #     parse_announcements(announcements)
     # sys.exit(1)
 
+    posts_not_before = None
     if args.no_update_posts:
         print('Not retrieving posts')
     else:
         tc = TC.default_client()
 
         # Download posts. Assume we already have all posts >7d earlier than the
-        # newest `created_at` value we've previously seen.
+        # newest `created_at` value we've previously seen (`OLD_POST_MARGIN`).
         #
         # We set the threshold using `created_at` instead of `date` to avoid any
         # potential problem with future-dated posts. Post authors set `date`;
         # the server sets `created_at`. We assume the server always uses a
         # reasonable value, though we never compare it to this machine's clock
         # (which is why we shy away from using `last_seen`).
-        old_post_margin = datetime.timedelta(days=7)
-        posts_not_before = datetime.date.fromisoformat(
-            newest_post_created_at(db)) - old_post_margin
-        retrieve_school_posts(db, not_before_date=str(posts_not_before))
-        db.commit()
-
-    # await download_post_photos(all_posts(db), base_path.joinpath('photos'))
-
-
-    lls = []
-    for p in all_posts(db):
-        c = all_class_post_confidence(p.html)
-        # if c == 9 and p['classroom_id'] == 1141:
-        #     print(json.dumps(p, indent=2))
-        lls.append((p.classroom_id, c))
-        # if c == 8:
-        #     print(p['html'])
-    
-    for k, v in Counter(lls).items():
+        posts_not_before = str(datetime.date.fromisoformat(
+            newest_post_created_at(db)) - OLD_POST_MARGIN)
+
+    if args.download_photos:
+        await retrieve_school_posts_and_photos(
+            db, base_path.joinpath('photos'), posts_not_before)
+    elif posts_not_before is not None:
+        await retrieve_school_posts(db, not_before_date=posts_not_before)
+
+    with span('classification report'):
+        report = classification_report(db)
+    for k, v in report.items():
         print(f'{k[0]},{k[1]},{v}')
 
     db.commit()
@@ -274,4 +564,14 @@ async def main(args):
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--no-update-posts', action='store_true')
+    parser.add_argument('--download-photos', action='store_true',
+                        help="download posts' photos as the posts come in, "
+                             'and any earlier ones still missing')
+    parser.add_argument('--metrics', type=pathlib.Path,
+                        help='write HTTP metrics here as a Prometheus textfile')
+    parser.add_argument('--trace', type=pathlib.Path,
+                        help='write stage timings here as a Chrome trace')
+    parser.add_argument('--profile', action='store_true',
+                        help='also profile CPU and memory, writing the '
+                             'results next to the trace')
     asyncio.run(main(parser.parse_args()))
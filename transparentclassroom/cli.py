@@ -1,5 +1,6 @@
 from datetime import datetime
 import json
+from pathlib import Path
 
 from apischema import serialize
 import click
@@ -46,7 +47,8 @@ def posts(since: datetime | None, until: datetime | None, ids: tuple[int, ...]):
 
     c = apiclient.default_client()
     if len(ids) > 0:
-        posts = c.posts_by_id(ids)
+        found = c.posts_by_id_batched(ids)
+        posts = [found[id] for id in ids if id in found]
     else:
         posts = c.all_child_posts()
 
@@ -65,5 +67,38 @@ def posts(since: datetime | None, until: datetime | None, ids: tuple[int, ...]):
         print('plaintext: ', text_from_html(p.html))
 
 
+@tc.command()
+@click.option('--archive', type=click.Path(exists=True, file_okay=False,
+                                           path_type=Path),
+              default='TransparentClassroomArchive', show_default=True)
+@click.option('--workers', type=click.IntRange(min=1),
+              help='Processes to check files with.  [default: one per CPU]')
+@click.option('--quick', is_flag=True,
+              help="Don't hash files whose size and modification time match "
+                   'their last verification.')
+def verify_archive(archive: Path, workers: int | None, quick: bool):
+    """Check the archive's photos and queue bad ones to download again"""
+    # the archiver imports a lot that other commands don't need
+    from . import archiver
+    from . import verify
+
+    db = archiver.db_init(archive.joinpath('posts.sqlite'))
+    try:
+        counts = verify.verify_photos(db, archive.joinpath('photos'),
+                                      workers, quick)
+    finally:
+        db.close()
+
+    ok = counts.pop('ok', 0)
+    print(f'{ok} ok')
+    for problem, n in counts.most_common():
+        print(f'{n} {problem}')
+
+    if counts:
+        raise click.ClickException(
+            f'{counts.total()} files failed. `archiver --download-photos` '
+            'will download them again.')
+
+
 if __name__ == '__main__':
     tc()
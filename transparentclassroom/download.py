@@ -5,11 +5,16 @@ import pathlib
 
 from tqdm.asyncio import tqdm
 
+import httpmetrics
 from urlfunctions import url_suffix
 
 
 MAX_CONCURRENT_DOWNLOADS = 10
 
+# Downloads waiting for a worker. Past this, `Downloader.add` waits, so a
+# producer that's well ahead of the downloads doesn't queue up everything.
+MAX_QUEUED_DOWNLOADS = 1000
+
 
 class DownloadItem:
     filename: pathlib.Path
@@ -28,39 +33,100 @@ class DownloadItem:
 # - may want a mode that double-checks photos already downloaded
 #   (with what? etag?)
 
+# Downloads items to `target_path` as they're added, while the caller goes
+# on producing more. Skips items already downloaded, or already added.
+# Leaving the `async with` waits for everything added to finish.
+class Downloader:
+    target_path: pathlib.Path
+    workers: int
+
+    session: aiohttp.ClientSession
+    queue: asyncio.Queue[tuple[str, pathlib.Path]]
+    worker_tasks: list[asyncio.Task]
+    progress: tqdm
+
+    # final paths of everything added, so repeats aren't downloaded twice
+    added: set[pathlib.Path]
+
+    errors: list[BaseException]
+
+    def __init__(self, target_path: pathlib.Path,
+                 workers: int = MAX_CONCURRENT_DOWNLOADS):
+        self.target_path = target_path
+        self.workers = workers
+        self.added = set()
+        self.errors = []
+
+    async def __aenter__(self) -> 'Downloader':
+        self.target_path.mkdir(exist_ok=True)
+        self.session = aiohttp.ClientSession(
+            trace_configs=httpmetrics.aiohttp_trace_configs())
+        self.queue = asyncio.Queue(MAX_QUEUED_DOWNLOADS)
+        self.progress = tqdm(total=0, unit='file')
+        self.worker_tasks = [asyncio.create_task(self._work())
+                             for _ in range(self.workers)]
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                await self.queue.join()
+        finally:
+            for t in self.worker_tasks:
+                t.cancel()
+            await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+            await self.session.close()
+            self.progress.close()
+
+        if exc_type is None and self.errors:
+            raise self.errors[0]
+
+    async def add(self, item: DownloadItem):
+        final_path = self.target_path.joinpath(item.filename)
+        if final_path in self.added or final_path.exists():
+            return
+        self.added.add(final_path)
+
+        self.progress.total += 1
+        await self.queue.put((item.url, final_path))
+
+    async def _work(self):
+        while True:
+            url, final_path = await self.queue.get()
+            try:
+                await self._download_one(url, final_path)
+            except Exception as e:
+                # keep going; the first error is raised at the end
+                print(f'FAIL: {url}: {e!r}')
+                self.errors.append(e)
+            finally:
+                self.queue.task_done()
+                self.progress.update(1)
+
+    async def _download_one(self, url: str, final_path: pathlib.Path):
+        # Invariant: file exists at final path only if it was downloaded
+        # successfully and completely.
+        assert final_path.suffix != '.unfinished'
+        temp_path = final_path.with_suffix('.unfinished')
+        async with self.session.get(url) as response:
+            # response.raise_for_status()
+            if response.status >= 400:
+                print(f'FAIL: {url}')
+                return
+
+            mimetype = response.headers.getone('content-type')
+            assert final_path.suffix in mimetypes.guess_all_extensions(
+                mimetype), f"{url} shouldn't be {mimetype}"
+
+            with temp_path.open('wb') as f:
+                f.write(await response.read())
+            temp_path.rename(final_path)
+            # print(final_path)
+
+
 # Downloads some URLs to `target_path`. Skips items already downloaded.
 # TODO: remove `target_path`, make it part of `items`.
 async def download_urls(items: list[DownloadItem], target_path: pathlib.Path):
-    target_path.mkdir(exist_ok=True)
-    limiter = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
-    tasks = []
-
-    async with aiohttp.ClientSession() as session:
-        async def download_one(url: str, final_path: pathlib.Path):
-            # Invariant: file exists at final path only if it was downloaded
-            # successfully and completely.
-            assert final_path.suffix != '.unfinished'
-            temp_path = final_path.with_suffix('.unfinished')
-            async with limiter, session.get(url) as response:
-                # response.raise_for_status()
-                if response.status >= 400:
-                    print(f'FAIL: {url}')
-                    return
-
-                mimetype = response.headers.getone('content-type')
-                assert final_path.suffix in mimetypes.guess_all_extensions(
-                    mimetype), f"{url} shouldn't be {mimetype}"
-
-                with temp_path.open('wb') as f:
-                    f.write(await response.read())
-                temp_path.rename(final_path)
-                # print(final_path)
-
+    async with Downloader(target_path) as downloader:
         for i in items:
-            final_path = target_path.joinpath(i.filename)
-            if final_path.exists():
-                continue
-
-            tasks += [asyncio.create_task(download_one(i.url, final_path))]
-
-        await tqdm.gather(*tasks)
+            await downloader.add(i)
@@ -0,0 +1,239 @@
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+import datetime
+import hashlib
+import mmap
+import os
+import pathlib
+import sqlite3
+
+from tqdm import tqdm
+
+
+# Checks the archive's downloaded photos: that each one looks complete for
+# its format, and hasn't changed since it was last verified. Files that fail
+# are moved aside and queued, so the next `archiver --download-photos` run
+# fetches them again.
+
+
+# suffix -> (format, first bytes, last bytes)
+FORMATS = {
+    '.jpg': ('jpeg', b'\xff\xd8\xff', b'\xff\xd9'),
+    '.jpeg': ('jpeg', b'\xff\xd8\xff', b'\xff\xd9'),
+    '.png': ('png', b'\x89PNG\r\n\x1a\n', b'\x00\x00\x00\x00IEND\xaeB`\x82'),
+    '.gif': ('gif', b'GIF8', b'\x3b'),
+}
+
+# Some encoders pad JPEGs after the end marker, so look for it this far
+# from the end.
+JPEG_END_SEARCH_BYTES = 1024
+
+# Files handed to a worker at a time. Big enough to keep the pool busy on
+# small files; small enough that the last chunks don't leave cores idle.
+CHUNK_SIZE = 32
+
+# Results to store per transaction.
+COMMIT_EVERY = 1000
+
+# Where files that failed are moved, relative to the photos directory. The
+# downloader only skips files that exist under their own name.
+QUARANTINE_DIR = 'quarantine'
+
+
+@dataclass
+class ManifestEntry:
+    size: int
+    mtime_ns: int
+    sha256: str
+
+
+@dataclass
+class PhotoCheck:
+    filename: str
+    size: int
+    mtime_ns: int
+
+    # None if we didn't hash it, see `check_photo`
+    sha256: str | None
+
+    # what's wrong with it, or None if nothing is
+    problem: str | None
+
+
+def sniff_format(head: bytes) -> str | None:
+    for format, start, _ in FORMATS.values():
+        if head.startswith(start):
+            return format
+    return None
+
+
+# Runs in a worker process. With `recorded` and `quick`, a file the same size
+# and age as when it was recorded isn't hashed again.
+def check_photo(path: pathlib.Path, recorded: ManifestEntry | None,
+                quick: bool) -> PhotoCheck:
+    st = path.stat()
+    check = PhotoCheck(filename=path.name, size=st.st_size,
+                       mtime_ns=st.st_mtime_ns, sha256=None, problem=None)
+
+    if path.suffix == '.unfinished':
+        check.problem = 'unfinished download'
+        return check
+    if st.st_size == 0:
+        check.problem = 'empty'
+        return check
+
+    with path.open('rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        expected = FORMATS.get(path.suffix.lower())
+        if expected is not None:
+            format, start, end = expected
+            actual = sniff_format(m[:16])
+            if actual is None:
+                check.problem = f'not a {format} file'
+                return check
+            if actual != format:
+                check.problem = f'{actual} content with {path.suffix} suffix'
+                return check
+
+            if format == 'jpeg':
+                complete = m.rfind(
+                    end, max(0, len(m) - JPEG_END_SEARCH_BYTES)) != -1
+            else:
+                complete = m[-len(end):] == end
+            if not complete:
+                check.problem = f'truncated {format}'
+                return check
+
+        unchanged = recorded is not None and \
+            (recorded.size, recorded.mtime_ns) == (st.st_size, st.st_mtime_ns)
+        if quick and unchanged:
+            check.sha256 = recorded.sha256
+            return check
+
+        # hashlib releases the GIL and reads straight from the mapping
+        check.sha256 = hashlib.sha256(m).hexdigest()
+
+    if recorded is not None:
+        if recorded.size != check.size:
+            check.problem = 'size changed'
+        elif recorded.sha256 != check.sha256:
+            check.problem = 'content changed'
+
+    return check
+
+
+def _check_photo(job: tuple[pathlib.Path, ManifestEntry | None, bool]
+                 ) -> PhotoCheck:
+    return check_photo(*job)
+
+
+def load_manifest(db: sqlite3.Connection) -> dict[str, ManifestEntry]:
+    return {
+        r['filename']: ManifestEntry(size=r['size'], mtime_ns=r['mtime_ns'],
+                                     sha256=r['sha256'])
+        for r in db.execute("""
+            SELECT filename, size, mtime_ns, sha256
+            FROM PhotoManifest
+            """)
+    }
+
+
+def record_ok(db: sqlite3.Connection, check: PhotoCheck, now: str):
+    db.execute("""
+        INSERT INTO PhotoManifest (filename, size, mtime_ns, sha256,
+                                   verified_at)
+        VALUES (:filename, :size, :mtime_ns, :sha256, :now)
+        ON CONFLICT(filename) DO UPDATE
+        SET size = :size,
+            mtime_ns = :mtime_ns,
+            sha256 = :sha256,
+            verified_at = :now
+        """, {
+        'filename': check.filename,
+        'size': check.size,
+        'mtime_ns': check.mtime_ns,
+        'sha256': check.sha256,
+        'now': now,
+    })
+
+
+# Move a failed file out of the downloader's way and queue it to be fetched
+# again. Leftover `.unfinished` files are just removed.
+def quarantine(db: sqlite3.Connection, photos_path: pathlib.Path,
+               check: PhotoCheck, now: str):
+    path = photos_path.joinpath(check.filename)
+    if path.suffix == '.unfinished':
+        path.unlink(missing_ok=True)
+        return
+
+    quarantine_path = photos_path.joinpath(QUARANTINE_DIR)
+    quarantine_path.mkdir(exist_ok=True)
+    path.replace(quarantine_path.joinpath(check.filename))
+
+    db.execute("""
+        DELETE FROM PhotoManifest
+        WHERE filename = :filename
+        """, {
+        'filename': check.filename,
+    })
+    db.execute("""
+        INSERT INTO RedownloadQueue (filename, problem, queued_at)
+        VALUES (:filename, :problem, :now)
+        ON CONFLICT(filename) DO UPDATE
+        SET problem = :problem,
+            queued_at = :now
+        """, {
+        'filename': check.filename,
+        'problem': check.problem,
+        'now': now,
+    })
+
+
+# Drop queued files that have since been downloaded again.
+def clear_redownloaded(db: sqlite3.Connection, photos_path: pathlib.Path):
+    done = [r['filename'] for r in db.execute("""
+        SELECT filename
+        FROM RedownloadQueue
+        """) if photos_path.joinpath(r['filename']).exists()]
+    db.executemany("""
+        DELETE FROM RedownloadQueue
+        WHERE filename = ?
+        """, [(f,) for f in done])
+
+
+# Check every file in `photos_path`, recording good ones in the manifest
+# and quarantining bad ones. Returns how many files had each problem, and
+# how many were 'ok'.
+def verify_photos(db: sqlite3.Connection, photos_path: pathlib.Path,
+                  workers: int | None = None, quick: bool = False
+                  ) -> Counter[str]:
+    now = datetime.datetime.now(
+        datetime.timezone.utc).isoformat(timespec='milliseconds')
+
+    if not photos_path.exists():
+        return Counter()
+
+    manifest = load_manifest(db)
+    paths = [pathlib.Path(e.path) for e in os.scandir(photos_path)
+             if e.is_file()]
+    jobs = [(p, manifest.get(p.name), quick) for p in paths]
+
+    problems: Counter[str] = Counter()
+    with ProcessPoolExecutor(workers or os.cpu_count()) as executor:
+        checks = executor.map(_check_photo, jobs, chunksize=CHUNK_SIZE)
+        for i, check in enumerate(tqdm(checks, total=len(jobs),
+                                       unit='file')):
+            if check.problem is None:
+                record_ok(db, check, now)
+                problems['ok'] += 1
+            else:
+                print(f'FAIL: {check.filename}: {check.problem}')
+                problems[check.problem] += 1
+                quarantine(db, photos_path, check, now)
+
+            if i % COMMIT_EVERY == COMMIT_EVERY - 1:
+                db.commit()
+
+    db.commit()
+    return problems
@@ -10,3 +10,18 @@ def url_suffix(url: str) -> str:
     assert suffix in ['.jpg', '.jpeg', '.png'], f'unexpected image extension: {suffix}'
 
     return suffix
+
+
+def trim_url(url: str) -> str:
+    parsed_url = urllib.parse.urlparse(url)
+    query_params = urllib.parse.parse_qs(parsed_url.query)
+    for p in ['X-Amz-Algorithm',
+              'X-Amz-Credential',
+              'X-Amz-Date',
+              'X-Amz-Expires',
+              'X-Amz-SignedHeaders',
+              'X-Amz-Signature']:
+        if p in query_params:
+            del query_params[p]
+    return urllib.parse.urlunparse(parsed_url._replace(
+        query=urllib.parse.urlencode(query_params, doseq=True)))